@@ -1,10 +1,28 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, g
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory, g
 from flask_cors import CORS
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
+import time
+import hashlib
 import requests
 import json
 
+import assets_export
+import datalake_index
+import instrumentation
+import metrics_stream
+import request_logging
+import upstream
+import upstream_async
+from assets_proxy import assets_proxy, normalize_params, wrap
+from insights_metrics import PROBES_BY_KEY, PROBE_TIMEOUT, collect_metrics, parse_deadline
+from metric_jobs import create_job_store, job_status, start_job
+from metrics_cache import authorized_key, metrics_cache
+from metrics_history import METRIC_KEYS, TIER_NAMES, metrics_history, parse_window
+from submission_search import SubmissionIndex, parse_query, parse_timestamp
+from token_check import TokenRejected
+from submission_store import create_store
+
 app = Flask(__name__, static_folder='static', static_url_path='/static')
 CORS(app)  # Enable CORS for all routes
 
@@ -14,82 +32,86 @@ BASE_PATH = os.environ.get('BASE_PATH', '').rstrip('/')
 # Insights Hub API base URLs
 MINDSPHERE_API_BASE = 'https://gateway.eu1.mindsphere.io'
 SIEMENS_CLOUD_API_BASE = 'https://api.eu1.cloud.sw.siemens.com'
+# When set, every request uses this API base instead (e.g. a local stub for benchmarks)
+INSIGHTS_HUB_API_BASE = os.environ.get('INSIGHTS_HUB_API_BASE', '').rstrip('/')
+
+# Submissions live in a SQLite database shared by all gunicorn workers
+# (SUBMISSIONS_BACKEND=memory keeps them in this process only)
+submission_store = create_store(
+    os.environ.get('SUBMISSIONS_BACKEND', 'sqlite'),
+    os.environ.get('SUBMISSIONS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'submissions.db'))
+)
+
+# Largest page GET /api/submissions returns for a single `limit` request
+SUBMISSIONS_MAX_LIMIT = int(os.environ.get('SUBMISSIONS_MAX_LIMIT', 1000))
 
-# Store submissions in memory (in production, use a database)
-submissions = []
+# Full-text index over the submissions, kept per worker and caught up from the store.
+# Built in the background from startup; a forked worker builds its own.
+submission_index = SubmissionIndex(submission_store)
+submission_index.start()
+
+# Dashboard-metrics jobs; shared through SQLite so any worker can answer a poll
+metric_job_store = create_job_store(
+    os.environ.get('METRIC_JOBS_BACKEND', 'sqlite'),
+    os.environ.get('METRIC_JOBS_DB', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jobs.db'))
+)
 
 def get_api_base():
     """Get the appropriate API base URL for this request"""
     return getattr(g, 'api_base', MINDSPHERE_API_BASE)
 
-# Request interceptor to log caller information
-@app.before_request
-def log_request_info():
-    """Log information about incoming requests and set API base URL"""
-    # Determine API base URL based on request origin
-    host = request.headers.get('Host', '')
-    origin = request.headers.get('Origin', '')
-    referer = request.headers.get('Referer', '')
+def detect_platform(headers):
+    """(API base, platform name) for a request, based on where it came from"""
+    host = headers.get('Host', '')
+    origin = headers.get('Origin', '')
+    referer = headers.get('Referer', '')
     
     # Check if request is from siemens.app domain
     if 'siemens.app' in host or 'siemens.app' in origin or 'siemens.app' in referer:
-        g.api_base = SIEMENS_CLOUD_API_BASE
-        platform = 'Siemens Xcelerator (siemens.app)'
+        api_base, platform = SIEMENS_CLOUD_API_BASE, 'Siemens Xcelerator (siemens.app)'
     else:
-        g.api_base = MINDSPHERE_API_BASE
-        platform = 'MindSphere (mindsphere.io)'
-    
-    print("=" * 60)
-    print(f"INCOMING REQUEST at {datetime.now().isoformat()}")
-    print("=" * 60)
-    print(f"Platform: {platform}")
-    print(f"API Base URL: {g.api_base}")
-    print(f"Method: {request.method}")
-    print(f"Path: {request.path}")
-    print(f"Full URL: {request.url}")
-    print(f"Remote IP: {request.remote_addr}")
-    
-    # Check for forwarded IP (when behind proxy/gateway)
-    forwarded_for = request.headers.get('X-Forwarded-For')
-    if forwarded_for:
-        print(f"X-Forwarded-For: {forwarded_for}")
-    
-    real_ip = request.headers.get('X-Real-IP')
-    if real_ip:
-        print(f"X-Real-IP: {real_ip}")
-    
-    print(f"User-Agent: {request.headers.get('User-Agent', 'Not provided')}")
-    
-    # Log authorization info (without exposing full token)
-    auth_header = request.headers.get('Authorization')
-    if auth_header:
-        if auth_header.startswith('Bearer '):
-            token = auth_header[7:]
-            # Show first and last 10 chars of token for identification
-            masked_token = f"{token[:10]}...{token[-10:]}" if len(token) > 20 else "***"
-            print(f"Authorization: Bearer {masked_token}")
-        else:
-            print(f"Authorization: {auth_header[:20]}...")
-    
-    # Log Insights Hub specific headers
-    tenant = request.headers.get('X-MindSphere-Tenant')
-    if tenant:
-        print(f"Tenant: {tenant}")
-    
-    user = request.headers.get('X-MindSphere-User')
-    if user:
-        print(f"User: {user}")
+        api_base, platform = MINDSPHERE_API_BASE, 'MindSphere (mindsphere.io)'
+    return INSIGHTS_HUB_API_BASE or api_base, platform
+
+def strip_base_path(path):
+    """Path as seen without the deployment base path, so both route variants match"""
+    if BASE_PATH and path.startswith(BASE_PATH):
+        return path[len(BASE_PATH):] or '/'
+    return path
+
+# Request interceptor to set the API base and start the request timer
+@app.before_request
+def log_request_info():
+    """Set the API base URL for this request and remember when it started"""
+    g.request_start = time.perf_counter()
+    instrumentation.REQUESTS_IN_FLIGHT.inc()
     
-    # Log all headers (for debugging)
-    print("-" * 40)
-    print("All Headers:")
-    for header, value in request.headers:
-        # Mask sensitive headers
-        if header.lower() in ['authorization', 'cookie', 'x-xsrf-token']:
-            print(f"  {header}: ***masked***")
-        else:
-            print(f"  {header}: {value}")
-    print("=" * 60)
+    # Determine API base URL based on request origin
+    g.api_base, g.platform = detect_platform(request.headers)
+
+# Write one structured log line per request (queued; never blocks on I/O)
+@app.after_request
+def write_request_log(response):
+    """Record request metrics and hand a structured record to the background logger"""
+    start = getattr(g, 'request_start', None)
+    duration = time.perf_counter() - start if start is not None else 0.0
+    route = strip_base_path(request.url_rule.rule) if request.url_rule else 'unmatched'
+    instrumentation.observe_request(route, request.method, response.status_code, duration)
+    request_logging.log_request(
+        request,
+        response.status_code,
+        duration,
+        strip_base_path(request.path),
+        platform=getattr(g, 'platform', None),
+        api_base=getattr(g, 'api_base', None)
+    )
+    return response
+
+@app.teardown_request
+def end_request(exception=None):
+    """Balance the in-flight gauge even when the request failed"""
+    if 'request_start' in g:
+        instrumentation.REQUESTS_IN_FLIGHT.dec()
 
 @app.route(f'{BASE_PATH}/')
 @app.route('/')
@@ -124,19 +146,13 @@ def submit_text():
             }), 400
         
         # Create submission entry
-        submission = {
-            'id': len(submissions) + 1,
-            'name': data['name'],
-            'text': data['text'],
-            'timestamp': datetime.now().isoformat()
-        }
-        
-        submissions.append(submission)
+        submission = submission_store.add(data['name'], data['text'])
+        submission_index.add(submission)
         
         return jsonify({
             'success': True,
             'message': 'Text submitted successfully',
-            'submission': submission
+            'submission': submission.to_dict()
         }), 201
         
     except Exception as e:
@@ -148,23 +164,149 @@ def submit_text():
 @app.route(f'{BASE_PATH}/api/submissions', methods=['GET'])
 @app.route('/api/submissions', methods=['GET'])
 def get_submissions():
-    """API endpoint to retrieve all submissions"""
-    return jsonify({
+    """API endpoint to retrieve submissions.
+
+    Optional query parameters:
+      after  - only return submissions with a greater id (cursor)
+      limit  - maximum number of submissions to return
+      format - `ndjson` streams one JSON record per line instead of one document
+    """
+    try:
+        after = int(request.args.get('after', 0))
+        limit = request.args.get('limit')
+        limit = min(int(limit), SUBMISSIONS_MAX_LIMIT) if limit else None
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'after and limit must be integers'
+        }), 400
+    if limit is not None and limit < 1:
+        return jsonify({
+            'success': False,
+            'error': 'limit must be at least 1'
+        }), 400
+    
+    # Unchanged store → nothing to send
+    etag = submission_store.version()
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    
+    if request.args.get('format') == 'ndjson':
+        def generate():
+            records = submission_store.iter_all(after=after)
+            for i, submission in enumerate(records):
+                if limit is not None and i >= limit:
+                    break
+                yield json.dumps(submission.to_dict()) + '\n'
+        
+        response = app.response_class(generate(), mimetype='application/x-ndjson')
+        response.set_etag(etag, weak=True)
+        return response
+    
+    page = submission_store.page(after=after, limit=limit)
+    more = limit is not None and len(page) == limit
+    
+    response = jsonify({
         'success': True,
-        'count': len(submissions),
-        'submissions': submissions
-    }), 200
+        'count': submission_store.count(),
+        'submissions': [submission.to_dict() for submission in page],
+        'next_after': page[-1].id if more else None
+    })
+    response.set_etag(etag, weak=True)
+    return response, 200
+
+@app.route(f'{BASE_PATH}/api/submissions/search', methods=['GET'])
+@app.route('/api/submissions/search', methods=['GET'])
+def search_submissions():
+    """Full-text search over submissions, best matches first.
+
+    Query parameters (at least one of q, name, since, until):
+      q      - words that must all occur; `pump*` matches words starting with `pump`
+      name   - exact submitter name (case-insensitive)
+      since  - ISO 8601 timestamp, inclusive lower bound
+      until  - ISO 8601 timestamp, inclusive upper bound
+      offset - matches to skip (default 0)
+      limit  - matches to return (default 20)
+    """
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = min(int(request.args.get('limit', 20)), SUBMISSIONS_MAX_LIMIT)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'offset and limit must be integers'
+        }), 400
+    if offset < 0 or limit < 1:
+        return jsonify({
+            'success': False,
+            'error': 'offset must not be negative and limit must be at least 1'
+        }), 400
+    try:
+        since = request.args.get('since')
+        until = request.args.get('until')
+        since = parse_timestamp(since) if since else None
+        until = parse_timestamp(until) if until else None
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'since and until must be ISO 8601 timestamps'
+        }), 400
+    
+    terms, prefixes = parse_query(request.args.get('q'))
+    name = request.args.get('name') or None
+    if not (terms or prefixes or name or since is not None or until is not None):
+        return jsonify({
+            'success': False,
+            'error': 'Provide q (with at least one searchable word), name, since or until'
+        }), 400
+    
+    if not submission_index.is_ready():
+        error = submission_index.build_error
+        response = jsonify({
+            'success': False,
+            'indexing': True,
+            'indexed': len(submission_index),
+            'error': f'Search index could not be built: {error}' if error else
+                     'Search index is being built; try again shortly'
+        })
+        response.headers['Retry-After'] = '5'
+        return response, 503
+    
+    try:
+        total, page = submission_index.search(
+            terms, prefixes, name=name, since=since, until=until, offset=offset, limit=limit
+        )
+        results = []
+        for submission_id, score in page:
+            submission = submission_store.get(submission_id)
+            if submission:
+                results.append(dict(submission.to_dict(), score=round(score, 4)))
+        
+        return jsonify({
+            'success': True,
+            'total': total,
+            'results': results,
+            'next_offset': offset + limit if offset + limit < total else None
+        }), 200
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
 
 @app.route(f'{BASE_PATH}/api/submissions/<int:submission_id>', methods=['GET'])
 @app.route('/api/submissions/<int:submission_id>', methods=['GET'])
 def get_submission(submission_id):
     """API endpoint to retrieve a specific submission"""
-    submission = next((s for s in submissions if s['id'] == submission_id), None)
+    submission = submission_store.get(submission_id)
     
     if submission:
         return jsonify({
             'success': True,
-            'submission': submission
+            'submission': submission.to_dict()
         }), 200
     else:
         return jsonify({
@@ -190,242 +332,296 @@ def get_dashboard_metrics():
             'Content-Type': 'application/json'
         }
         
-        metrics = {}
-        errors = []
+        # Run all probes concurrently; anything slower than the deadline comes back as a timeout
+        deadline = parse_deadline(request.args.get('deadline'))
         
-        # 1. Get Asset Count
-        try:
-            assets_response = requests.get(
-                f'{get_api_base()}/api/assetmanagement/v3/assets',
-                headers=headers,
-                params={'size': 1},
-                timeout=30
+        # Serve from the per-tenant cache when the tenant is known (and the token is the tenant's)
+        key = authorized_key(request.headers.get('X-MindSphere-Tenant'), get_api_base(), headers)
+        if key:
+            metrics, errors = metrics_cache.get_metrics(
+                key,
+                get_api_base(),
+                headers,
+                deadline=deadline,
+                refresh=request.args.get('refresh', '').lower() in ('1', 'true')
             )
-            if assets_response.status_code == 200:
-                assets_data = assets_response.json()
-                metrics['assets'] = {
-                    'count': assets_data.get('page', {}).get('totalElements', 0),
-                    'status': 'success'
-                }
-            else:
-                metrics['assets'] = {'count': 0, 'status': 'error', 'message': f'HTTP {assets_response.status_code}'}
-                errors.append(f'GET {get_api_base()}/api/assetmanagement/v3/assets → HTTP {assets_response.status_code}')
-        except Exception as e:
-            metrics['assets'] = {'count': 0, 'status': 'error', 'message': str(e)}
-            errors.append(f'GET {get_api_base()}/api/assetmanagement/v3/assets → {str(e)}')
+        else:
+            metrics, errors = collect_metrics(get_api_base(), headers, deadline=deadline)
         
-        # 2. Get Agent Count from Asset Manager
-        try:
-            agents_response = requests.get(
-                f'{get_api_base()}/api/assetmanagement/v3/assets',
-                headers=headers,
-                params={'filter': '{"hasType":{"in":["core.basicagent"]}}', 'page': 1000000, 'size': 200},
-                timeout=30
-            )
-            if agents_response.status_code == 200:
-                agents_data = agents_response.json()
-                metrics['agents'] = {
-                    'count': agents_data.get('page', {}).get('totalElements', 0),
-                    'status': 'success'
-                }
-            else:
-                metrics['agents'] = {'count': 0, 'status': 'error', 'message': f'HTTP {agents_response.status_code}'}
-                errors.append(f'GET {get_api_base()}/api/assetmanagement/v3/assets?filter={{"hasType":{{"in":["core.basicagent"]}}}} → HTTP {agents_response.status_code}')
-        except Exception as e:
-            metrics['agents'] = {'count': 0, 'status': 'error', 'message': str(e)}
-            errors.append(f'GET {get_api_base()}/api/assetmanagement/v3/assets (agents filter) → {str(e)}')
+        return jsonify({
+            'success': True,
+            'metrics': metrics,
+            'errors': errors if errors else None,
+            'timestamp': datetime.now().isoformat()
+        }), 200
         
-        # 3. Get Data Lake Objects Count
-        try:
-            datalake_response = requests.get(
-                f'{get_api_base()}/api/datalake/v3/listObjects',
-                headers=headers,
-                params={'path': '/', 'size': 1000},
-                timeout=30
-            )
-            if datalake_response.status_code == 200:
-                datalake_data = datalake_response.json()
-                # API returns: {"objects": {"files": [], "folders": []}}
-                objects_data = datalake_data.get('objects', {})
-                files_count = len(objects_data.get('files', []))
-                folders_count = len(objects_data.get('folders', []))
-                total_objects = files_count + folders_count
-                
-                metrics['datalake'] = {
-                    'objects': total_objects,
-                    'status': 'success'
-                }
-            else:
-                metrics['datalake'] = {'objects': 0, 'status': 'error', 'message': f'HTTP {datalake_response.status_code}'}
-                errors.append(f'GET {get_api_base()}/api/datalake/v3/listObjects?path=/ → HTTP {datalake_response.status_code}')
-        except Exception as e:
-            metrics['datalake'] = {'objects': 0, 'status': 'error', 'message': str(e)}
-            errors.append(f'GET {get_api_base()}/api/datalake/v3/listObjects?path=/ → {str(e)}')
+    except TokenRejected as e:
+        return token_rejected(e)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
+def token_rejected(e):
+    """Response for a token upstream refused or that belongs to another tenant"""
+    return jsonify({
+        'success': False,
+        'error': str(e)
+    }), e.status_code
+
+def job_owner(headers=None):
+    """Identity a metrics job belongs to: the tenant, or a hash of the caller's token"""
+    if headers is None:
+        headers = request.headers
+    tenant = headers.get('X-MindSphere-Tenant')
+    if tenant:
+        return f'tenant:{tenant}'
+    auth_header = headers.get('Authorization', '')
+    return 'token:' + hashlib.sha256(auth_header.encode()).hexdigest()
+
+@app.route(f'{BASE_PATH}/api/insights-hub/dashboard-metrics/jobs', methods=['POST'])
+@app.route('/api/insights-hub/dashboard-metrics/jobs', methods=['POST'])
+def create_dashboard_metrics_job():
+    """Start collecting dashboard metrics in the background and return a job id"""
+    try:
+        auth_header = request.headers.get('Authorization')
         
-        # 4. Get Event Count
-        try:
-            # API defaults to last 7 days if no timestamp filter provided
-            # Query last 365 days to get all events
-            one_year_ago = (datetime.now() - timedelta(days=365)).strftime('%Y-%m-%dT%H:%M:%S.000Z')
-            
-            events_response = requests.get(
-                f'{get_api_base()}/api/eventmanagement/v3/events',
-                headers=headers,
-                params={
-                    'size': 1,
-                    'filter': f'{{"timestamp":{{"after":"{one_year_ago}"}}}}',
-                    'history': 'true',  # Include historical events
-                    'includeShared': 'false'  # Only tenant's own events
-                },
-                timeout=30
-            )
-            if events_response.status_code == 200:
-                events_data = events_response.json()
-                # API returns: {"_embedded": {"events": [...]}, "page": {"totalElements": X}}
-                metrics['events'] = {
-                    'count': events_data.get('page', {}).get('totalElements', 0),
-                    'status': 'success'
-                }
-            else:
-                metrics['events'] = {'count': 0, 'status': 'error', 'message': f'HTTP {events_response.status_code}'}
-                errors.append(f'GET {get_api_base()}/api/eventmanagement/v3/events → HTTP {events_response.status_code}')
-        except Exception as e:
-            metrics['events'] = {'count': 0, 'status': 'error', 'message': str(e)}
-            errors.append(f'GET {get_api_base()}/api/eventmanagement/v3/events → {str(e)}')
+        if not auth_header:
+            return jsonify({
+                'success': False,
+                'error': 'No authorization token provided'
+            }), 401
         
-        # 5. Get VFC Flows Count
-        try:
-            vfc_response = requests.get(
-                f'{get_api_base()}/api/visualflowcreator/v3/flows',
-                headers=headers,
-                params={'size': 1},
-                timeout=30
-            )
-            if vfc_response.status_code == 200:
-                vfc_data = vfc_response.json()
-                metrics['vfc_flows'] = {
-                    'count': vfc_data.get('page', {}).get('totalElements', 0),
-                    'status': 'success'
-                }
-            else:
-                metrics['vfc_flows'] = {'count': 0, 'status': 'error', 'message': f'HTTP {vfc_response.status_code}'}
-                errors.append(f'GET {get_api_base()}/api/visualflowcreator/v3/flows → HTTP {vfc_response.status_code}')
-        except Exception as e:
-            metrics['vfc_flows'] = {'count': 0, 'status': 'error', 'message': str(e)}
-            errors.append(f'GET {get_api_base()}/api/visualflowcreator/v3/flows → {str(e)}')
+        headers = {
+            'Authorization': auth_header,
+            'Content-Type': 'application/json'
+        }
         
-        # 6. Get Dashboard Count
-        try:
-            dashboards_response = requests.get(
-                f'{get_api_base()}/api/kpidashboardconfiguration/v3/dashboards',
-                headers=headers,
-                params={'size': 1},
-                timeout=30
-            )
-            if dashboards_response.status_code == 200:
-                dashboards_data = dashboards_response.json()
-                metrics['dashboards'] = {
-                    'count': dashboards_data.get('page', {}).get('totalElements', 0),
-                    'status': 'success'
-                }
-            else:
-                metrics['dashboards'] = {'count': 0, 'status': 'error', 'message': f'HTTP {dashboards_response.status_code}'}
-                errors.append(f'GET {get_api_base()}/api/kpidashboardconfiguration/v3/dashboards → HTTP {dashboards_response.status_code}')
-        except Exception as e:
-            metrics['dashboards'] = {'count': 0, 'status': 'error', 'message': str(e)}
-            errors.append(f'GET {get_api_base()}/api/kpidashboardconfiguration/v3/dashboards → {str(e)}')
+        job_id = start_job(
+            metric_job_store,
+            job_owner(),
+            get_api_base(),
+            headers,
+            key=authorized_key(request.headers.get('X-MindSphere-Tenant'), get_api_base(), headers)
+        )
         
-        # 7. Get Rules Count
-        try:
-            rules_response = requests.get(
-                f'{get_api_base()}/api/rulesmanagement/v4/rules',
-                headers=headers,
-                params={'size': 1},
-                timeout=30
-            )
-            if rules_response.status_code == 200:
-                rules_data = rules_response.json()
-                metrics['rules'] = {
-                    'count': rules_data.get('page', {}).get('totalElements', 0),
-                    'status': 'success'
-                }
-            else:
-                metrics['rules'] = {'count': 0, 'status': 'error', 'message': f'HTTP {rules_response.status_code}'}
-                errors.append(f'GET {get_api_base()}/api/rulesmanagement/v4/rules → HTTP {rules_response.status_code}')
-        except Exception as e:
-            metrics['rules'] = {'count': 0, 'status': 'error', 'message': str(e)}
-            errors.append(f'GET {get_api_base()}/api/rulesmanagement/v4/rules → {str(e)}')
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': f'{BASE_PATH}/api/insights-hub/dashboard-metrics/jobs/{job_id}'
+        }), 202
         
-        # 8. Get Cases Count (if available)
-        try:
-            cases_response = requests.get(
-                f'{get_api_base()}/api/casemanagement/v3/cases',
-                headers=headers,
-                params={'size': 1},
-                timeout=30
-            )
-            if cases_response.status_code == 200:
-                cases_data = cases_response.json()
-                metrics['cases'] = {
-                    'count': cases_data.get('totalElements', 0),
-                    'status': 'success'
-                }
-            else:
-                metrics['cases'] = {'count': 0, 'status': 'error', 'message': f'HTTP {cases_response.status_code}'}
-                errors.append(f'GET {get_api_base()}/api/casemanagement/v3/cases → HTTP {cases_response.status_code}')
-        except Exception as e:
-            metrics['cases'] = {'count': 0, 'status': 'error', 'message': str(e)}
-            errors.append(f'GET {get_api_base()}/api/casemanagement/v3/cases → {str(e)}')
+    except TokenRejected as e:
+        return token_rejected(e)
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
+@app.route(f'{BASE_PATH}/api/insights-hub/dashboard-metrics/jobs/<job_id>', methods=['GET'])
+@app.route('/api/insights-hub/dashboard-metrics/jobs/<job_id>', methods=['GET'])
+def get_dashboard_metrics_job(job_id):
+    """Return the metrics a job has collected so far"""
+    job = metric_job_store.get(job_id)
+    
+    # Jobs are owned by the tenant the caller names, so the token must be that tenant's
+    try:
+        authorized_key(
+            request.headers.get('X-MindSphere-Tenant'),
+            get_api_base(),
+            {'Authorization': request.headers.get('Authorization', '')}
+        )
+    except TokenRejected as e:
+        return token_rejected(e)
+    
+    if not job or job['owner'] != job_owner():
+        return jsonify({
+            'success': False,
+            'error': 'Job not found'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        **job_status(job, get_api_base()),
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+@app.route(f'{BASE_PATH}/api/insights-hub/dashboard-metrics/stream', methods=['GET'])
+@app.route('/api/insights-hub/dashboard-metrics/stream', methods=['GET'])
+def stream_dashboard_metrics():
+    """Push dashboard metrics as Server-Sent Events from the tenant's shared poller"""
+    auth_header = request.headers.get('Authorization')
+    
+    if not auth_header:
+        return jsonify({
+            'success': False,
+            'error': 'No authorization token provided'
+        }), 401
+    
+    headers = {
+        'Authorization': auth_header,
+        'Content-Type': 'application/json'
+    }
+    
+    # Every viewer of a tenant shares one poller (and its cache entries)
+    try:
+        key = authorized_key(request.headers.get('X-MindSphere-Tenant'), get_api_base(), headers)
+    except TokenRejected as e:
+        return token_rejected(e)
+    key = key or (job_owner(), get_api_base())
+    
+    return Response(
+        metrics_stream.events(key, get_api_base(), headers),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route(f'{BASE_PATH}/api/insights-hub/dashboard-metrics/history', methods=['GET'])
+@app.route('/api/insights-hub/dashboard-metrics/history', methods=['GET'])
+def get_dashboard_metrics_history():
+    """Recorded dashboard metrics over a time window, with the change across it.
+
+    Served from the tenant's history store. The only upstream call is the
+    token check (see token_check), at most once per token per TOKEN_CHECK_TTL.
+
+    Query parameters:
+      metrics    - comma-separated metric keys (default: all)
+      window     - how far back, e.g. `30d`, `12h`, `90m` or seconds (default 7d)
+      resolution - `raw`, `hourly`, `daily`, or `auto` (default) for the
+                   finest tier that covers the window
+    """
+    auth_header = request.headers.get('Authorization')
+    
+    if not auth_header:
+        return jsonify({
+            'success': False,
+            'error': 'No authorization token provided'
+        }), 401
+    
+    metrics = request.args.get('metrics')
+    metrics = [metric.strip() for metric in metrics.split(',') if metric.strip()] if metrics else METRIC_KEYS
+    unknown = [metric for metric in metrics if metric not in METRIC_KEYS]
+    if unknown or not metrics:
+        return jsonify({
+            'success': False,
+            'error': f'Unknown metrics: {", ".join(unknown)}; choose from {", ".join(METRIC_KEYS)}'
+        }), 400
+    resolution = request.args.get('resolution', 'auto')
+    if resolution != 'auto' and resolution not in TIER_NAMES:
+        return jsonify({
+            'success': False,
+            'error': f'resolution must be auto, {", ".join(TIER_NAMES)}'
+        }), 400
+    try:
+        window = parse_window(request.args.get('window'))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'window must be a positive number of seconds or a duration like 30d, 12h, 90m'
+        }), 400
+    
+    # Same key the cache (and so the recorder) uses; tenantless callers have no history
+    try:
+        key = authorized_key(
+            request.headers.get('X-MindSphere-Tenant'),
+            get_api_base(),
+            {'Authorization': auth_header}
+        )
+    except TokenRejected as e:
+        return token_rejected(e)
+    if key is None:
+        return jsonify({
+            'success': False,
+            'error': 'Metrics history is kept per tenant; send X-MindSphere-Tenant'
+        }), 400
+    now = time.time()
+    resolution, series = metrics_history.query(key, metrics, window, resolution, now=now)
+    
+    return jsonify({
+        'success': True,
+        'resolution': resolution,
+        'window': {
+            'seconds': window,
+            'since': datetime.fromtimestamp(now - window).isoformat(),
+            'until': datetime.fromtimestamp(now).isoformat()
+        },
+        'metrics': series,
+        'timestamp': datetime.now().isoformat()
+    }), 200
+
+@app.route(f'{BASE_PATH}/api/insights-hub/datalake/summary', methods=['GET'])
+@app.route('/api/insights-hub/datalake/summary', methods=['GET'])
+def get_datalake_summary():
+    """Object and byte totals for a Data Lake folder, with per-folder breakdowns"""
+    try:
+        auth_header = request.headers.get('Authorization')
         
-        # 9. Get Predictions Count (AI/ML)
-        try:
-            predictions_response = requests.get(
-                f'{get_api_base()}/api/oipredictapi/v3/predict-assets/all',
-                headers=headers,
-                timeout=30
-            )
-            if predictions_response.status_code == 200:
-                predictions_data = predictions_response.json()
-                metrics['predictions'] = {
-                    'count': predictions_data.get('page', {}).get('totalElements', 0),
-                    'status': 'success'
-                }
-            else:
-                metrics['predictions'] = {'count': 0, 'status': 'error', 'message': f'HTTP {predictions_response.status_code}'}
-                errors.append(f'GET {get_api_base()}/api/oipredictapi/v3/predict-assets/all → HTTP {predictions_response.status_code}')
-        except Exception as e:
-            metrics['predictions'] = {'count': 0, 'status': 'error', 'message': str(e)}
-            errors.append(f'GET {get_api_base()}/api/oipredictapi/v3/predict-assets/all → {str(e)}')
+        if not auth_header:
+            return jsonify({
+                'success': False,
+                'error': 'No authorization token provided'
+            }), 401
         
-        # 10. Get Anomaly Detection Count
-        try:
-            # Note: Using appropriate gateway endpoint based on platform
-            anomaly_response = requests.get(
-                f'{get_api_base()}/api/oipredictapi/v3/usageDetails',
-                headers=headers,
-                params={'requestType': 'ANOMALY'},
-                timeout=30
-            )
-            if anomaly_response.status_code == 200:
-                anomaly_data = anomaly_response.json()
-                metrics['anomaly_detections'] = {
-                    'count': anomaly_data.get('page', {}).get('totalElements', 0),
-                    'status': 'success'
-                }
-            else:
-                metrics['anomaly_detections'] = {'count': 0, 'status': 'error', 'message': f'HTTP {anomaly_response.status_code}'}
-                errors.append(f'GET {get_api_base()}/api/oipredictapi/v3/usageDetails?requestType=ANOMALY → HTTP {anomaly_response.status_code}')
-        except Exception as e:
-            metrics['anomaly_detections'] = {'count': 0, 'status': 'error', 'message': str(e)}
-            errors.append(f'GET {get_api_base()}/api/oipredictapi/v3/usageDetails?requestType=ANOMALY → {str(e)}')
+        headers = {
+            'Authorization': auth_header,
+            'Content-Type': 'application/json'
+        }
+        path = request.args.get('path', '/')
+        if not path.endswith('/'):
+            path += '/'
+        depth = min(max(request.args.get('depth', 1, type=int), 0), 5)
+        
+        # Re-crawl (incrementally) once the index is older than the datalake metric's TTL
+        index = datalake_index.authorized_index(get_api_base(), headers, PROBE_TIMEOUT)
+        refresh = request.args.get('refresh', '').lower() in ('1', 'true')
+        refreshing = False
+        if refresh or index.refreshed_at is None or time.time() - index.refreshed_at > PROBES_BY_KEY['datalake']['ttl']:
+            crawl = index.refresh_async(get_api_base(), headers, PROBE_TIMEOUT)
+            try:
+                crawl.result(timeout=parse_deadline(request.args.get('deadline')))
+            except TimeoutError:
+                refreshing = True
+        
+        if index.refreshed_at is None:
+            return jsonify({
+                'success': True,
+                'refreshing': True,
+                'message': 'Data Lake index is being built; try again shortly'
+            }), 202
+        
+        summary = index.summary(path, depth)
+        if summary is None:
+            return jsonify({
+                'success': False,
+                'error': f'Folder not found in index: {path}'
+            }), 404
         
         return jsonify({
             'success': True,
-            'metrics': metrics,
-            'errors': errors if errors else None,
+            'refreshing': refreshing,
+            'summary': summary,
             'timestamp': datetime.now().isoformat()
         }), 200
         
+    except datalake_index.DataLakeError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Insights Hub API error: {e.status_code}',
+            'details': str(e)
+        }), e.status_code
+    except requests.exceptions.Timeout:
+        return jsonify({
+            'success': False,
+            'error': 'Request to Insights Hub timed out'
+        }), 504
+    except requests.exceptions.RequestException as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to connect to Insights Hub: {str(e)}'
+        }), 500
     except Exception as e:
         return jsonify({
             'success': False,
@@ -435,43 +631,62 @@ def get_dashboard_metrics():
 @app.route(f'{BASE_PATH}/api/insights-hub/assets', methods=['GET'])
 @app.route('/api/insights-hub/assets', methods=['GET'])
 def get_insights_hub_assets():
-    """Proxy endpoint to fetch assets from Insights Hub Asset Management API"""
+    """Proxy endpoint to fetch assets from Insights Hub Asset Management API.
+
+    Upstream bytes are passed through unchanged inside the JSON envelope,
+    pages are cached per caller and revalidated with ETags, and the next
+    page is prefetched (see assets_proxy).
+    """
     try:
         # Get authorization token from request headers (passed through by gateway)
         auth_header = request.headers.get('Authorization')
-        # Insights Hub Asset Management API endpoint
-        api_url = f'{get_api_base()}/api/assetmanagement/v3/assets'
         
-        # Get query parameters (for pagination, filtering, etc.)
-        params = {
-            'size': request.args.get('size', 10),  # Number of assets to return
-            'page': request.args.get('page', 0),    # Page number
-        }
+        if not auth_header:
+            return jsonify({
+                'success': False,
+                'error': 'No authorization token provided'
+            }), 401
         
-        # Add filter if provided
-        if request.args.get('filter'):
-            params['filter'] = request.args.get('filter')
+        # Get query parameters (for pagination, filtering, etc.)
+        try:
+            params = normalize_params(request.args)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'error': 'size and page must be integers'
+            }), 400
         
         # Make request to Insights Hub API
         headers = {
-            'Authorization': user_auth_header,
+            'Authorization': auth_header,
             'Content-Type': 'application/json'
         }
         
-        response = requests.get(api_url, headers=headers, params=params, timeout=30)
+        page, cache_result = assets_proxy.get_page(
+            get_api_base(),
+            headers,
+            params,
+            if_none_match=request.headers.get('If-None-Match')
+        )
         
         # Return the response from Insights Hub
-        if response.status_code == 200:
-            return jsonify({
-                'success': True,
-                'data': response.json()
-            }), 200
+        if page.status in (200, 304):
+            tag, weak = page.etag or (None, False)
+            if page.status == 304 or (tag and request.if_none_match.contains_weak(tag)):
+                response = app.response_class(status=304)
+            else:
+                response = app.response_class(wrap(page.body), mimetype='application/json')
+            if tag:
+                response.set_etag(tag, weak=weak)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.headers['X-Cache'] = cache_result
+            return response
         else:
             return jsonify({
                 'success': False,
-                'error': f'Insights Hub API error: {response.status_code}',
-                'details': response.text
-            }), response.status_code
+                'error': f'Insights Hub API error: {page.status}',
+                'details': page.body.decode('utf-8', 'replace')
+            }), page.status
             
     except requests.exceptions.Timeout:
         return jsonify({
@@ -489,6 +704,71 @@ def get_insights_hub_assets():
             'error': f'Internal server error: {str(e)}'
         }), 500
 
+@app.route(f'{BASE_PATH}/api/insights-hub/assets/export', methods=['GET'])
+@app.route('/api/insights-hub/assets/export', methods=['GET'])
+def export_insights_hub_assets():
+    """Stream every asset of the tenant as NDJSON (default) or CSV.
+
+    Optional query parameters:
+      format - `ndjson` or `csv`
+      filter - Asset Management filter expression
+    """
+    try:
+        auth_header = request.headers.get('Authorization')
+        
+        if not auth_header:
+            return jsonify({
+                'success': False,
+                'error': 'No authorization token provided'
+            }), 401
+        
+        format_name = request.args.get('format', 'ndjson')
+        export_format = assets_export.FORMATS.get(format_name)
+        if export_format is None:
+            return jsonify({
+                'success': False,
+                'error': 'format must be ndjson or csv'
+            }), 400
+        
+        headers = {
+            'Authorization': auth_header,
+            'Content-Type': 'application/json'
+        }
+        filter_ = request.args.get('filter')
+        
+        # The first page is fetched before streaming so upstream errors keep their status code
+        first = assets_export.fetch_page(get_api_base(), headers, 0, filter_)
+        pages = assets_export.iter_pages(get_api_base(), headers, first, filter_)
+        
+        response = app.response_class(
+            assets_export.export_chunks(pages, export_format),
+            mimetype=export_format.mimetype
+        )
+        response.headers['Content-Disposition'] = f'attachment; filename=assets.{format_name}'
+        return response
+        
+    except assets_export.ExportError as e:
+        return jsonify({
+            'success': False,
+            'error': f'Insights Hub API error: {e.status_code}',
+            'details': e.details
+        }), e.status_code
+    except requests.exceptions.Timeout:
+        return jsonify({
+            'success': False,
+            'error': 'Request to Insights Hub timed out'
+        }), 504
+    except requests.exceptions.RequestException as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to connect to Insights Hub: {str(e)}'
+        }), 500
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Internal server error: {str(e)}'
+        }), 500
+
 @app.route(f'{BASE_PATH}/api/health', methods=['GET'])
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -498,6 +778,26 @@ def health_check():
         'timestamp': datetime.now().isoformat()
     }), 200
 
+@app.route(f'{BASE_PATH}/api/upstream/stats', methods=['GET'])
+@app.route('/api/upstream/stats', methods=['GET'])
+def upstream_stats():
+    """Connection pool counters for this worker's upstream sessions"""
+    return jsonify({
+        'success': True,
+        'upstream': upstream.stats(),
+        'streams': metrics_stream.stats(),
+        'upstream_async': upstream_async.stats(),
+        'assets_cache': assets_proxy.stats(),
+        'metrics_history': metrics_history.stats()
+    }), 200
+
+@app.route(f'{BASE_PATH}/metrics', methods=['GET'])
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus scrape endpoint (text exposition format, all workers aggregated)"""
+    body, content_type = instrumentation.render()
+    return app.response_class(body, content_type=content_type)
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=False)
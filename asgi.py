@@ -0,0 +1,382 @@
+"""ASGI entry point: the Insights Hub routes as async views, everything else served by the Flask app.
+
+    gunicorn asgi:app -k uvicorn_worker.UvicornWorker --bind 0.0.0.0:$PORT --workers 2
+
+The async views await upstream calls on an event loop instead of holding a
+thread each, so one process can keep hundreds of them in flight while the
+remaining (fast, synchronous) Flask routes run on a small thread pool.
+Responses, caches, circuit breakers and BASE_PATH routing are the same as
+with `app:app`.
+"""
+import asyncio
+import contextlib
+import os
+import time
+from datetime import datetime
+
+import httpx
+import requests
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_etags, quote_etag
+
+import assets_export
+import datalake_index
+import instrumentation
+import metrics_stream
+import request_logging
+import upstream_async
+from app import BASE_PATH, app as flask_app, detect_platform, job_owner, strip_base_path
+from assets_proxy import assets_proxy, normalize_params, wrap
+from insights_metrics import PROBES_BY_KEY, PROBE_TIMEOUT, collect_metrics_async, parse_deadline
+from metrics_cache import authorized_key, metrics_cache
+from token_check import TokenRejected
+
+# Threads running the Flask routes that have no async view (submissions, jobs, health, ...)
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 32))
+
+routes = []
+
+
+class _LoggedRequest:
+    """The request attributes request_logging reads, in the shape Flask provides them"""
+
+    def __init__(self, request):
+        self.method = request.method
+        self.path = request.url.path
+        self.remote_addr = request.client.host if request.client else None
+        self.headers = Headers([(name.title(), value) for name, value in request.headers.items()])
+
+
+def json_response(payload, status=200):
+    """Same body as Flask's jsonify"""
+    return Response(
+        flask_app.json.dumps(payload, separators=(',', ':')) + '\n',
+        status_code=status,
+        media_type='application/json'
+    )
+
+
+def _cors(request, response):
+    """The headers Flask-CORS adds with its defaults"""
+    origin = request.headers.get('Origin')
+    if origin:
+        response.headers['Access-Control-Allow-Origin'] = origin
+        response.headers['Vary'] = 'Origin'
+    else:
+        response.headers['Access-Control-Allow-Origin'] = '*'
+
+
+def route(rule):
+    """Register an async GET view under `BASE_PATH + rule` and `rule`, like the Flask routes.
+
+    The view is called as view(request, api_base) and gets the same request
+    metrics and structured log line as a Flask request.
+    """
+    def decorate(view):
+        async def endpoint(request):
+            start = time.perf_counter()
+            instrumentation.REQUESTS_IN_FLIGHT.inc()
+            api_base, platform = detect_platform(request.headers)
+            status = 500
+            try:
+                try:
+                    response = await view(request, api_base)
+                except Exception as e:
+                    # Views answer their own errors; this covers anything that escapes them
+                    response = _internal_error(e)
+                status = response.status_code
+            finally:
+                instrumentation.REQUESTS_IN_FLIGHT.dec()
+                duration = time.perf_counter() - start
+                instrumentation.observe_request(rule, request.method, status, duration)
+                request_logging.log_request(
+                    _LoggedRequest(request),
+                    status,
+                    duration,
+                    strip_base_path(request.url.path),
+                    platform=platform,
+                    api_base=api_base
+                )
+            _cors(request, response)
+            return response
+
+        for path in dict.fromkeys([f'{BASE_PATH}{rule}', rule]):
+            routes.append(Route(path, endpoint, methods=['GET']))
+        return view
+    return decorate
+
+
+def _unauthorized():
+    return json_response({
+        'success': False,
+        'error': 'No authorization token provided'
+    }, 401)
+
+
+def _upstream_headers(auth_header):
+    return {
+        'Authorization': auth_header,
+        'Content-Type': 'application/json'
+    }
+
+
+# Raised by the async client, and by the threaded one behind Data Lake crawls
+UPSTREAM_ERRORS = (httpx.HTTPError, requests.exceptions.RequestException)
+
+
+def _upstream_error(e):
+    """Response for an upstream client error, as the Flask routes return it"""
+    if isinstance(e, (httpx.TimeoutException, requests.exceptions.Timeout)):
+        return json_response({
+            'success': False,
+            'error': 'Request to Insights Hub timed out'
+        }, 504)
+    return json_response({
+        'success': False,
+        'error': f'Failed to connect to Insights Hub: {str(e)}'
+    }, 500)
+
+
+def _token_rejected(e):
+    return json_response({
+        'success': False,
+        'error': str(e)
+    }, e.status_code)
+
+
+def _internal_error(e):
+    return json_response({
+        'success': False,
+        'error': f'Internal server error: {str(e)}'
+    }, 500)
+
+
+@route('/api/insights-hub/dashboard-metrics')
+async def get_dashboard_metrics(request, api_base):
+    """Fetch comprehensive metrics from Insights Hub tenant"""
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return _unauthorized()
+        headers = _upstream_headers(auth_header)
+        deadline = parse_deadline(request.query_params.get('deadline'))
+
+        key = await asyncio.to_thread(
+            authorized_key, request.headers.get('X-MindSphere-Tenant'), api_base, headers
+        )
+        if key:
+            metrics, errors = await metrics_cache.get_metrics_async(
+                key,
+                api_base,
+                headers,
+                deadline=deadline,
+                refresh=request.query_params.get('refresh', '').lower() in ('1', 'true')
+            )
+        else:
+            metrics, errors = await collect_metrics_async(api_base, headers, deadline=deadline)
+
+        return json_response({
+            'success': True,
+            'metrics': metrics,
+            'errors': errors if errors else None,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    except TokenRejected as e:
+        return _token_rejected(e)
+    except Exception as e:
+        return _internal_error(e)
+
+
+@route('/api/insights-hub/dashboard-metrics/stream')
+async def stream_dashboard_metrics(request, api_base):
+    """Push dashboard metrics as Server-Sent Events from the tenant's shared poller"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header:
+        return _unauthorized()
+    headers = _upstream_headers(auth_header)
+
+    try:
+        key = await asyncio.to_thread(
+            authorized_key, request.headers.get('X-MindSphere-Tenant'), api_base, headers
+        )
+    except TokenRejected as e:
+        return _token_rejected(e)
+    key = key or (job_owner(request.headers), api_base)
+
+    return StreamingResponse(
+        metrics_stream.events_async(key, api_base, headers),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def _int_arg(request, name, default):
+    try:
+        return int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+
+
+@route('/api/insights-hub/datalake/summary')
+async def get_datalake_summary(request, api_base):
+    """Object and byte totals for a Data Lake folder, with per-folder breakdowns"""
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return _unauthorized()
+        headers = _upstream_headers(auth_header)
+        path = request.query_params.get('path', '/')
+        if not path.endswith('/'):
+            path += '/'
+        depth = min(max(_int_arg(request, 'depth', 1), 0), 5)
+
+        # The token check and the crawl run on threads; only the waits happen here
+        index = await asyncio.to_thread(datalake_index.authorized_index, api_base, headers, PROBE_TIMEOUT)
+        refresh = request.query_params.get('refresh', '').lower() in ('1', 'true')
+        refreshing = False
+        if refresh or index.refreshed_at is None or time.time() - index.refreshed_at > PROBES_BY_KEY['datalake']['ttl']:
+            crawl = index.refresh_async(api_base, headers, PROBE_TIMEOUT)
+            # asyncio.wait leaves the shared crawl running when the deadline passes
+            await asyncio.wait([asyncio.wrap_future(crawl)],
+                               timeout=parse_deadline(request.query_params.get('deadline')))
+            if crawl.done():
+                crawl.result()
+            else:
+                refreshing = True
+
+        if index.refreshed_at is None:
+            return json_response({
+                'success': True,
+                'refreshing': True,
+                'message': 'Data Lake index is being built; try again shortly'
+            }, 202)
+
+        summary = index.summary(path, depth)
+        if summary is None:
+            return json_response({
+                'success': False,
+                'error': f'Folder not found in index: {path}'
+            }, 404)
+
+        return json_response({
+            'success': True,
+            'refreshing': refreshing,
+            'summary': summary,
+            'timestamp': datetime.now().isoformat()
+        })
+
+    except datalake_index.DataLakeError as e:
+        return json_response({
+            'success': False,
+            'error': f'Insights Hub API error: {e.status_code}',
+            'details': str(e)
+        }, e.status_code)
+    except UPSTREAM_ERRORS as e:
+        return _upstream_error(e)
+    except Exception as e:
+        return _internal_error(e)
+
+
+@route('/api/insights-hub/assets')
+async def get_insights_hub_assets(request, api_base):
+    """Proxy endpoint to fetch assets from Insights Hub Asset Management API (see assets_proxy)"""
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return _unauthorized()
+        try:
+            params = normalize_params(request.query_params)
+        except ValueError:
+            return json_response({
+                'success': False,
+                'error': 'size and page must be integers'
+            }, 400)
+        headers = _upstream_headers(auth_header)
+
+        page, cache_result = await assets_proxy.get_page_async(
+            api_base,
+            headers,
+            params,
+            if_none_match=request.headers.get('If-None-Match')
+        )
+
+        if page.status in (200, 304):
+            tag, weak = page.etag or (None, False)
+            if page.status == 304 or (tag and parse_etags(request.headers.get('If-None-Match')).contains_weak(tag)):
+                response = Response(status_code=304)
+            else:
+                response = Response(wrap(page.body), media_type='application/json')
+            if tag:
+                response.headers['ETag'] = quote_etag(tag, weak)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            response.headers['X-Cache'] = cache_result
+            return response
+        return json_response({
+            'success': False,
+            'error': f'Insights Hub API error: {page.status}',
+            'details': page.body.decode('utf-8', 'replace')
+        }, page.status)
+
+    except UPSTREAM_ERRORS as e:
+        return _upstream_error(e)
+    except Exception as e:
+        return _internal_error(e)
+
+
+@route('/api/insights-hub/assets/export')
+async def export_insights_hub_assets(request, api_base):
+    """Stream every asset of the tenant as NDJSON (default) or CSV"""
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header:
+            return _unauthorized()
+
+        format_name = request.query_params.get('format', 'ndjson')
+        export_format = assets_export.FORMATS.get(format_name)
+        if export_format is None:
+            return json_response({
+                'success': False,
+                'error': 'format must be ndjson or csv'
+            }, 400)
+        headers = _upstream_headers(auth_header)
+        filter_ = request.query_params.get('filter')
+
+        first = await assets_export.fetch_page_async(api_base, headers, 0, filter_)
+        pages = assets_export.iter_pages_async(api_base, headers, first, filter_)
+
+        return StreamingResponse(
+            assets_export.export_chunks_async(pages, export_format),
+            media_type=export_format.mimetype,
+            headers={'Content-Disposition': f'attachment; filename=assets.{format_name}'}
+        )
+
+    except assets_export.ExportError as e:
+        return json_response({
+            'success': False,
+            'error': f'Insights Hub API error: {e.status_code}',
+            'details': e.details
+        }, e.status_code)
+    except UPSTREAM_ERRORS as e:
+        return _upstream_error(e)
+    except Exception as e:
+        return _internal_error(e)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await upstream_async.close()
+
+
+app = Starlette(
+    routes=routes + [
+        # Every other path (and other methods on the paths above) goes to Flask
+        Mount('', app=WSGIMiddleware(flask_app, workers=ASGI_WSGI_THREADS)),
+    ],
+    lifespan=lifespan
+)
@@ -0,0 +1,221 @@
+"""Streaming export of every Asset Management page, fetched through a bounded in-order window"""
+import asyncio
+import csv
+import io
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import requests
+
+import upstream
+import upstream_async
+
+ASSETS_PATH = '/api/assetmanagement/v3/assets'
+
+# Assets requested per upstream page
+ASSETS_EXPORT_PAGE_SIZE = int(os.environ.get('ASSETS_EXPORT_PAGE_SIZE', 200))
+# Pages fetched ahead of the one being streamed; also the most pages held in memory
+ASSETS_EXPORT_WINDOW = int(os.environ.get('ASSETS_EXPORT_WINDOW', 4))
+# Page fetches running at once across all exports in a worker
+ASSETS_EXPORT_MAX_WORKERS = int(os.environ.get('ASSETS_EXPORT_MAX_WORKERS', 16))
+ASSETS_EXPORT_TIMEOUT = 30
+
+CSV_FIELDS = ('assetId', 'externalId', 'name', 'typeId', 'parentId', 'description',
+              'twinType', 'timezone', 'etag')
+
+
+class ExportError(Exception):
+    """An Asset Management page could not be fetched"""
+
+    def __init__(self, page, status_code, details=''):
+        super().__init__(f'HTTP {status_code} fetching page {page}')
+        self.page = page
+        self.status_code = status_code
+        self.details = details
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process-wide page fetch pool, creating it after fork if needed"""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(
+                    max_workers=ASSETS_EXPORT_MAX_WORKERS,
+                    thread_name_prefix='assets-export'
+                )
+                _executor_pid = pid
+    return _executor
+
+
+def _parse(page, response):
+    if response.status_code != 200:
+        raise ExportError(page, response.status_code, response.text)
+    data = response.json()
+    return data.get('_embedded', {}).get('assets', []), data.get('page', {}).get('totalPages', 0)
+
+
+def _params(page, filter_, size):
+    params = {'page': page, 'size': size}
+    if filter_:
+        params['filter'] = filter_
+    return params
+
+
+def fetch_page(api_base, headers, page, filter_=None, size=ASSETS_EXPORT_PAGE_SIZE):
+    """Return (assets, total pages) for one page"""
+    response = upstream.get(api_base, ASSETS_PATH, headers=headers, params=_params(page, filter_, size),
+                            timeout=ASSETS_EXPORT_TIMEOUT)
+    return _parse(page, response)
+
+
+async def fetch_page_async(api_base, headers, page, filter_=None, size=ASSETS_EXPORT_PAGE_SIZE):
+    """fetch_page over the asynchronous client"""
+    response = await upstream_async.get(api_base, ASSETS_PATH, headers=headers,
+                                        params=_params(page, filter_, size), timeout=ASSETS_EXPORT_TIMEOUT)
+    return _parse(page, response)
+
+
+def iter_pages(api_base, headers, first, filter_=None, size=ASSETS_EXPORT_PAGE_SIZE,
+               window=ASSETS_EXPORT_WINDOW):
+    """Yield the assets of every page in order, starting from the already fetched `first`.
+
+    At most `window` later pages are requested ahead of the consumer, and a
+    new request is only made when a page has been handed on. A slow client
+    therefore slows the export down instead of filling memory. Fetches run
+    on the pool shared by all exports, so concurrent exports queue for
+    ASSETS_EXPORT_MAX_WORKERS threads rather than each starting `window`.
+    """
+    assets, total_pages = first
+    yield assets
+    if total_pages <= 1:
+        return
+
+    executor = get_executor()
+    pending = []
+    next_page = 1
+    try:
+        while next_page < total_pages and len(pending) < window:
+            pending.append(executor.submit(fetch_page, api_base, headers, next_page, filter_, size))
+            next_page += 1
+        while pending:
+            assets, _ = pending.pop(0).result()
+            if next_page < total_pages:
+                pending.append(executor.submit(fetch_page, api_base, headers, next_page, filter_, size))
+                next_page += 1
+            if not assets:
+                # The inventory shrank while exporting; later pages are empty too
+                break
+            yield assets
+    finally:
+        # Runs when the export ends or the client disconnects; fetches not yet started are dropped
+        for future in pending:
+            future.cancel()
+
+
+async def iter_pages_async(api_base, headers, first, filter_=None, size=ASSETS_EXPORT_PAGE_SIZE,
+                           window=ASSETS_EXPORT_WINDOW):
+    """iter_pages with the window of fetches as tasks on the running event loop"""
+    assets, total_pages = first
+    yield assets
+    if total_pages <= 1:
+        return
+
+    pending = []
+    next_page = 1
+    try:
+        while next_page < total_pages and len(pending) < window:
+            pending.append(asyncio.ensure_future(fetch_page_async(api_base, headers, next_page, filter_, size)))
+            next_page += 1
+        while pending:
+            assets, _ = await pending.pop(0)
+            if next_page < total_pages:
+                pending.append(asyncio.ensure_future(fetch_page_async(api_base, headers, next_page, filter_, size)))
+                next_page += 1
+            if not assets:
+                break
+            yield assets
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class NdjsonFormat:
+    """One JSON document per asset per line; a failure ends the stream with an error line"""
+
+    mimetype = 'application/x-ndjson'
+
+    def header(self):
+        return ''
+
+    def page(self, assets):
+        return ''.join(json.dumps(asset) + '\n' for asset in assets)
+
+    def error(self, e):
+        return json.dumps({'error': str(e), 'details': getattr(e, 'details', '')}) + '\n'
+
+
+class CsvFormat:
+    """CSV with a header row and CSV_FIELDS columns; a failure ends the stream with an error row"""
+
+    mimetype = 'text/csv'
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def _flush(self):
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return text
+
+    def header(self):
+        self._writer.writerow(CSV_FIELDS)
+        return self._flush()
+
+    def page(self, assets):
+        for asset in assets:
+            self._writer.writerow([asset.get(field, '') for field in CSV_FIELDS])
+        return self._flush()
+
+    def error(self, e):
+        self._writer.writerow([f'# export failed: {e}'])
+        return self._flush()
+
+
+FORMATS = {'ndjson': NdjsonFormat, 'csv': CsvFormat}
+
+# What may end an export after the response has started
+_STREAM_ERRORS = (ExportError, requests.exceptions.RequestException, httpx.HTTPError)
+
+
+def export_chunks(pages, export_format):
+    """Text chunks of an export, one per page"""
+    writer = export_format()
+    yield writer.header()
+    try:
+        for assets in pages:
+            yield writer.page(assets)
+    except _STREAM_ERRORS as e:
+        yield writer.error(e)
+
+
+async def export_chunks_async(pages, export_format):
+    """export_chunks over iter_pages_async"""
+    writer = export_format()
+    yield writer.header()
+    try:
+        async for assets in pages:
+            yield writer.page(assets)
+    except _STREAM_ERRORS as e:
+        yield writer.error(e)
@@ -0,0 +1,268 @@
+"""Caching pass-through proxy for Asset Management pages, with ETag revalidation and next-page prefetch"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from werkzeug.http import unquote_etag
+
+import instrumentation
+import upstream
+import upstream_async
+from count_probe import CountScanner
+
+ASSETS_PATH = '/api/assetmanagement/v3/assets'
+
+# Seconds a cached page is served without asking upstream; after that it is
+# revalidated with If-None-Match
+ASSETS_CACHE_TTL = float(os.environ.get('ASSETS_CACHE_TTL', 30))
+# Bounds on cached pages; least recently used are evicted first
+ASSETS_CACHE_MAX_ENTRIES = int(os.environ.get('ASSETS_CACHE_MAX_ENTRIES', 500))
+ASSETS_CACHE_MAX_BYTES = int(os.environ.get('ASSETS_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+# Threads fetching page N+1 in the background after page N was served (0 disables prefetch)
+ASSETS_PREFETCH_WORKERS = int(os.environ.get('ASSETS_PREFETCH_WORKERS', 4))
+ASSETS_TIMEOUT = 30
+
+
+class AssetPage:
+    """Raw upstream body of one page and what is needed to revalidate it"""
+
+    __slots__ = ('status', 'body', 'etag', 'fetched_at', 'total_pages')
+
+    def __init__(self, status, body, etag=None):
+        self.status = status
+        self.body = body
+        # (tag, weak) from upstream, or a hash of the body when upstream sent none
+        if etag is None and status == 200:
+            etag = (hashlib.sha256(body).hexdigest()[:32], True)
+        self.etag = etag
+        self.fetched_at = time.time()
+        self.total_pages = _total_pages(body) if status == 200 else None
+
+
+def _total_pages(body):
+    scanner = CountScanner(('page', 'totalPages'))
+    value = scanner.feed(body, final=True)
+    return int(value) if value is not None else None
+
+
+def _upstream_etag(response):
+    value = response.headers.get('ETag')
+    if not value:
+        return None
+    tag, weak = unquote_etag(value)
+    return (tag, weak) if tag else None
+
+
+def _etag_header(etag):
+    tag, weak = etag
+    return f'W/"{tag}"' if weak else f'"{tag}"'
+
+
+def wrap(body):
+    """The route's JSON envelope around raw upstream bytes, without re-encoding them"""
+    return b'{"success": true, "data": ' + body + b'}'
+
+
+class AssetsProxy:
+    """LRU of asset pages keyed by (token hash, API base, normalized query).
+
+    Fresh pages are served from memory. Stale ones are revalidated upstream
+    with If-None-Match and kept on 304. Concurrent requests for the same
+    page share one upstream call, and serving page N schedules page N+1.
+    """
+
+    def __init__(self, max_entries=ASSETS_CACHE_MAX_ENTRIES, max_bytes=ASSETS_CACHE_MAX_BYTES,
+                 ttl=ASSETS_CACHE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+        self._tasks = set()
+
+    def _get_executor(self):
+        pid = os.getpid()
+        if self._executor is None or self._executor_pid != pid:
+            with self._lock:
+                if self._executor is None or self._executor_pid != pid:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=ASSETS_PREFETCH_WORKERS,
+                        thread_name_prefix='assets-prefetch'
+                    )
+                    self._executor_pid = pid
+        return self._executor
+
+    def _lookup(self, key):
+        with self._lock:
+            page = self._entries.get(key)
+            if page is not None:
+                self._entries.move_to_end(key)
+            return page
+
+    def _store(self, key, page):
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous.body)
+            self._entries[key] = page
+            self._bytes += len(page.body)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted.body)
+
+    def _request_headers(self, headers, cached, if_none_match):
+        request_headers = dict(headers)
+        if cached is not None:
+            request_headers['If-None-Match'] = _etag_header(cached.etag)
+        elif if_none_match:
+            request_headers['If-None-Match'] = if_none_match
+        return request_headers
+
+    def _accept(self, key, cached, response):
+        """(page, cache result) for an upstream response to a page request"""
+        if response.status_code == 304 and cached is not None:
+            cached.fetched_at = time.time()
+            return cached, 'revalidated'
+        if response.status_code == 304:
+            # The caller's own copy is current; there is no body to cache
+            return AssetPage(304, b'', _upstream_etag(response)), 'not_modified'
+        page = AssetPage(response.status_code, response.content, _upstream_etag(response))
+        if page.status == 200:
+            self._store(key, page)
+        return page, 'miss'
+
+    def _fetch(self, key, api_base, headers, params, cached, if_none_match):
+        response = upstream.get(api_base, ASSETS_PATH, params=params, timeout=ASSETS_TIMEOUT,
+                                headers=self._request_headers(headers, cached, if_none_match))
+        return self._accept(key, cached, response)
+
+    async def _fetch_async(self, key, api_base, headers, params, cached, if_none_match, future):
+        try:
+            response = await upstream_async.get(api_base, ASSETS_PATH, params=params, timeout=ASSETS_TIMEOUT,
+                                                headers=self._request_headers(headers, cached, if_none_match))
+            future.set_result(self._accept(key, cached, response))
+        except Exception as e:
+            future.set_exception(e)
+
+    def _start(self, key, api_base, headers, params, cached, if_none_match=None, background=False,
+               on_loop=False):
+        """Start (or join) the upstream fetch of a page and return its future.
+
+        Foreground fetches run in the calling thread; prefetches on the pool.
+        With `on_loop`, both run as tasks on the running event loop instead.
+        """
+        executor = self._get_executor() if background and not on_loop else None
+        # Without a cached copy, the caller's own If-None-Match goes upstream and a 304
+        # only suits callers holding that copy, so such fetches are shared among them alone
+        inflight_key = key if cached is not None or not if_none_match else (key, if_none_match)
+        with self._lock:
+            future = self._inflight.get(inflight_key)
+            if future is not None:
+                return future
+            if executor is not None:
+                future = executor.submit(
+                    self._fetch, key, api_base, headers, params, cached, if_none_match
+                )
+            else:
+                future = Future()
+            self._inflight[inflight_key] = future
+
+        def done(f):
+            with self._lock:
+                self._inflight.pop(inflight_key, None)
+
+        future.add_done_callback(done)
+        if on_loop:
+            task = asyncio.get_running_loop().create_task(
+                self._fetch_async(key, api_base, headers, params, cached, if_none_match, future)
+            )
+            # The loop only keeps weak references to tasks
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        elif not background:
+            try:
+                future.set_result(self._fetch(key, api_base, headers, params, cached, if_none_match))
+            except Exception as e:
+                future.set_exception(e)
+        return future
+
+    def get_page(self, api_base, headers, params, if_none_match=None):
+        """Return (AssetPage, cache result) for a page, prefetching the next one"""
+        key = cache_key(api_base, headers, params)
+        cached = self._lookup(key)
+        if cached is not None and time.time() - cached.fetched_at < self.ttl:
+            page, result = cached, 'hit'
+        else:
+            page, result = self._start(key, api_base, headers, params, cached, if_none_match).result()
+        instrumentation.count_cache('assets', result)
+        if page.status == 200 and ASSETS_PREFETCH_WORKERS > 0:
+            self._prefetch_next(api_base, headers, params, page)
+        return page, result
+
+    async def get_page_async(self, api_base, headers, params, if_none_match=None):
+        """get_page on the event loop; cache, in-flight fetches and prefetches are shared with it"""
+        key = cache_key(api_base, headers, params)
+        cached = self._lookup(key)
+        if cached is not None and time.time() - cached.fetched_at < self.ttl:
+            page, result = cached, 'hit'
+        else:
+            future = self._start(key, api_base, headers, params, cached, if_none_match, on_loop=True)
+            # Shielded: the fetch may be shared, so a caller that goes away must not cancel it
+            page, result = await asyncio.shield(asyncio.wrap_future(future))
+        instrumentation.count_cache('assets', result)
+        if page.status == 200 and ASSETS_PREFETCH_WORKERS > 0:
+            self._prefetch_next(api_base, headers, params, page, on_loop=True)
+        return page, result
+
+    def _prefetch_next(self, api_base, headers, params, page, on_loop=False):
+        number = int(params.get('page', 0))
+        if page.total_pages is not None and number + 1 >= page.total_pages:
+            return
+        next_params = dict(params, page=number + 1)
+        key = cache_key(api_base, headers, next_params)
+        cached = self._lookup(key)
+        if cached is not None and time.time() - cached.fetched_at < self.ttl:
+            return
+        self._start(key, api_base, headers, next_params, cached, background=True, on_loop=on_loop)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'inflight': len(self._inflight),
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+def normalize_params(args):
+    """Query parameters forwarded upstream, in a canonical form"""
+    params = {
+        'size': int(args.get('size', 10)),
+        'page': int(args.get('page', 0)),
+    }
+    if args.get('filter'):
+        params['filter'] = args.get('filter')
+    return params
+
+
+def cache_key(api_base, headers, params):
+    token = hashlib.sha256(headers.get('Authorization', '').encode()).hexdigest()
+    return (token, api_base, tuple(sorted(params.items())))
+
+
+assets_proxy = AssetsProxy()
@@ -0,0 +1,129 @@
+"""Benchmark: one worker process serving slow upstream-bound requests, WSGI vs. ASGI.
+
+Starts the Insights Hub stub (benchmarks/insights_hub_stub.py) answering
+after `--latency` seconds, then runs the app under gunicorn in each mode:
+
+  * sync    - `app:app` with sync workers (what the Procfile used to run)
+  * gthread - `app:app` with gunicorn.conf.py's threaded workers
+  * asgi    - `asgi:app` on uvicorn workers
+
+`--clients` concurrent clients request /api/insights-hub/assets with
+distinct tokens (so nothing is served from the cache), while /api/health
+is probed every 100 ms to show how fast requests fare next to them. The
+stub reports the most upstream calls it saw in flight at once, which is
+what the serving mode decides; req/s also depends on the CPU the client,
+stub and server share.
+
+    python benchmarks/bench_async_serving.py [--clients 200] [--latency 0.5] [--duration 10]
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+
+import httpx
+
+from load_test import MODES, percentile, start_app, start_stub, stop, wait_ready
+
+
+async def drive(base, clients, duration):
+    limits = httpx.Limits(max_connections=clients + 10, max_keepalive_connections=clients + 10)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        await wait_ready(client, base)
+        ends_at = time.monotonic() + duration
+        latencies, health, failures = [], [], 0
+
+        async def worker(n):
+            nonlocal failures
+            i = 0
+            while time.monotonic() < ends_at:
+                start = time.perf_counter()
+                try:
+                    response = await client.get(f'{base}/api/insights-hub/assets',
+                                                headers={'Authorization': f'Bearer bench-{n}-{i}'})
+                    ok = response.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if time.monotonic() <= ends_at:
+                    if ok:
+                        latencies.append(time.perf_counter() - start)
+                    else:
+                        failures += 1
+                i += 1
+
+        probe_started = None
+
+        async def prober():
+            nonlocal probe_started
+            while time.monotonic() < ends_at:
+                probe_started = time.perf_counter()
+                try:
+                    await client.get(f'{base}/api/health')
+                    health.append(time.perf_counter() - probe_started)
+                except httpx.HTTPError:
+                    pass
+                probe_started = None
+                await asyncio.sleep(0.1)
+
+        tasks = [asyncio.create_task(worker(n)) for n in range(clients)] + [asyncio.create_task(prober())]
+        # Requests still queued at the end are not counted
+        await asyncio.wait(tasks, timeout=duration + 5)
+        if probe_started is not None:
+            # A health check still queued at the end counts with the time it has waited so far
+            health.append(time.perf_counter() - probe_started)
+        for task in tasks:
+            task.cancel()
+        return latencies, health, failures
+
+
+def run_mode(mode, args, stub_base, workdir):
+    # No prefetching, so the stub only sees the calls the clients cause
+    server, base, _ = start_app(mode, args.workers, stub_base, workdir, {'ASSETS_PREFETCH_WORKERS': '0'})
+    try:
+        httpx.get(f'{stub_base}/__stub/reset')
+        latencies, health, failures = asyncio.run(drive(base, args.clients, args.duration))
+        peak = httpx.get(f'{stub_base}/__stub/stats').json()['peak_in_flight']
+    finally:
+        stop(server)
+    return {
+        'mode': mode,
+        'upstream_peak': peak,
+        'completed': len(latencies),
+        'failed': failures,
+        'throughput': len(latencies) / args.duration,
+        'p50': percentile(latencies, 0.5),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'health_p50': percentile(health, 0.5),
+        'health_max': max(health) if health else float('nan'),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.5, help='upstream response time (seconds)')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers per mode')
+    parser.add_argument('--modes', default=','.join(MODES))
+    args = parser.parse_args()
+
+    stub, stub_base = start_stub(['--latency', str(args.latency), '--jitter', '0', '--tenant-size', '10'])
+
+    print(f'{args.clients} clients, upstream latency {args.latency:g}s, {args.workers} worker(s), '
+          f'{args.duration:g}s per mode')
+    print(f'{"mode":>8} | {"upstream peak":>13} | {"req/s":>7} {"p50":>8} {"p95":>8} {"p99":>8} '
+          f'{"failed":>6} | {"health p50":>10} {"health max":>10}')
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            for mode in args.modes.split(','):
+                r = run_mode(mode, args, stub_base, workdir)
+                print(f'{mode:>8} | {r["upstream_peak"]:>13} | {r["throughput"]:>7.1f} {r["p50"]:>7.2f}s {r["p95"]:>7.2f}s '
+                      f'{r["p99"]:>7.2f}s {r["failed"]:>6} | {r["health_p50"] * 1e3:>8.1f}ms '
+                      f'{r["health_max"] * 1e3:>8.1f}ms')
+    finally:
+        stop(stub)
+
+
+if __name__ == '__main__':
+    main()
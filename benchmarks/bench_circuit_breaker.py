@@ -0,0 +1,124 @@
+"""Benchmark: circuit breaker bookkeeping per probe, and half-open settling.
+
+First checks that a half-open probe always settles its breaker, whatever
+ends it: a 4xx from a `run` probe, a Data Lake index still being built
+(202), a failure (503) and a cancelled async probe. A probe that never
+settles would leave the circuit half-open and failing fast for good.
+Then times allow() plus record_success() per call, from one thread and
+from several at once.
+
+    python benchmarks/bench_circuit_breaker.py [--iterations 200000] [--threads 8]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, get_breaker  # noqa: E402
+from datalake_index import DataLakeError, IndexBuilding  # noqa: E402
+from insights_metrics import run_probe, run_probe_async  # noqa: E402
+
+API_BASE = 'http://bench.invalid'
+
+
+def probe(name, run):
+    return {'key': name, 'field': name, 'path': f'/bench/{name}', 'params': {}, 'run': run}
+
+
+def half_open(p):
+    """The probe's breaker, opened and past its reset timeout"""
+    breaker = get_breaker(API_BASE, p['path'])
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    breaker.opened_at -= breaker.reset_timeout
+    return breaker
+
+
+def raising(e):
+    def run(api_base, headers, timeout):
+        raise e
+    return run
+
+
+def check_settled(name, run, expected_state):
+    p = probe(name, run)
+    breaker = half_open(p)
+    # run_probe makes the half-open call itself
+    result, _ = run_probe(p, API_BASE, {})
+    assert result['status'] != 'degraded', f'{name}: the probe was not let through'
+    assert breaker.state == expected_state, f'{name}: {breaker.state}'
+    if expected_state == HALF_OPEN:
+        assert breaker.allow(), f'{name}: the next call was not let through to probe'
+    print(f'{name:<14} {breaker.state}')
+
+
+async def cancelled_probe():
+    def run(api_base, headers, timeout):
+        time.sleep(0.5)
+        return {'cancelled': 1}
+
+    p = probe('cancelled', run)
+    breaker = half_open(p)
+    # run_probe_async makes the half-open call itself
+    task = asyncio.ensure_future(run_probe_async(p, API_BASE, {}))
+    await asyncio.sleep(0.05)
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    assert breaker.state == HALF_OPEN and breaker.allow(), 'cancelled: the next call was not let through to probe'
+    print(f'{"cancelled":<14} {breaker.state}')
+
+
+def check_half_open():
+    print('Half-open probe ended by')
+    check_settled('http 403', raising(DataLakeError('/', 403)), HALF_OPEN)
+    check_settled('index 202', raising(IndexBuilding()), HALF_OPEN)
+    check_settled('http 503', raising(DataLakeError('/', 503)), OPEN)
+    check_settled('success', lambda api_base, headers, timeout: {'success': 1}, CLOSED)
+    asyncio.run(cancelled_probe())
+    print()
+
+
+def bench_calls(iterations, threads):
+    breaker = CircuitBreaker(API_BASE, 'bench')
+
+    def calls(n):
+        for _ in range(n):
+            breaker.allow()
+            breaker.record_success(0.01)
+
+    start = time.perf_counter()
+    calls(iterations)
+    single = (time.perf_counter() - start) / iterations
+
+    per_thread = iterations // threads
+    workers = [threading.Thread(target=calls, args=(per_thread,)) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    contended = (time.perf_counter() - start) / (per_thread * threads)
+
+    print('allow() + record_success() per call')
+    print(f'  1 thread:   {single * 1e6:.2f} us')
+    print(f'  {threads} threads:  {contended * 1e6:.2f} us')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+    check_half_open()
+    bench_calls(args.iterations, args.threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Benchmark: count-only streaming probes vs. downloading and decoding whole bodies.
+
+Builds payloads shaped like Asset Management pages (an `_embedded` list of
+assets followed by the `page` object) and compares
+
+  * first, that the count survives the body being split at every byte offset
+  * in process: json.loads of the whole body vs. CountScanner over 16 KiB chunks
+  * over HTTP (local server): requests .json() vs. read_count on a streamed
+    response, with `page` at the end (worst case) and at the start of the body
+
+    python benchmarks/bench_count_probe.py [--sizes 10,1000,10000,100000]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from count_probe import CHUNK_SIZE, CountScanner, read_count  # noqa: E402
+
+PATH = ('page', 'totalElements')
+REPEAT = 5
+
+
+def asset(i):
+    return {
+        'assetId': f'{i:032x}',
+        'tenantId': 'tenant',
+        'name': f'Pump station {i}',
+        'typeId': 'tenant.PumpType',
+        'description': 'Centrifugal pump with vibration and temperature sensors',
+        'location': {'country': 'Germany', 'locality': 'Erlangen', 'latitude': 49.5925, 'longitude': 1500.0, 'altitude': -2.5e-3},
+        'variables': [{'name': 'speed', 'value': '1450'}, {'name': 'power', 'value': '55'}],
+        'aspects': [{'name': 'vibration', 'variables': [{'name': 'rms', 'value': '0.4'}]}],
+        'etag': i,
+        '_links': {'self': {'href': f'https://gateway/api/assetmanagement/v3/assets/{i:032x}'}},
+    }
+
+
+def payload(items, page_first=False):
+    page = {'size': items, 'totalElements': items, 'totalPages': 1, 'number': 0}
+    embedded = {'assets': [asset(i) for i in range(items)]}
+    doc = {'page': page, '_embedded': embedded} if page_first else {'_embedded': embedded, 'page': page}
+    return json.dumps(doc).encode()
+
+
+def best(fn):
+    times = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def scan(body):
+    scanner = CountScanner(PATH)
+    for i in range(0, len(body), CHUNK_SIZE):
+        # Slices stand in for the chunks a socket read would return
+        value = scanner.feed(body[i:i + CHUNK_SIZE])
+        if value is not None:
+            return value
+    return scanner.feed(b'', final=True)
+
+
+def check_splits():
+    """Every two-chunk split of a body must give the same count (numbers can straddle a chunk)"""
+    body = payload(10)
+    for i in range(1, len(body)):
+        scanner = CountScanner(PATH)
+        value = scanner.feed(body[:i])
+        if value is None:
+            value = scanner.feed(body[i:])
+        if value is None:
+            value = scanner.feed(b'', final=True)
+        assert value == 10, f'split at byte {i} of {len(body)}: got {value!r}'
+    print(f'Count found at every split of a {len(body)}-byte body\n')
+
+
+def bench_in_process(sizes):
+    print('In process, page at the end of the body')
+    print(f'{"assets":>8} {"body":>10} | {"json.loads":>11} {"peak mem":>10} | {"scanner":>9} {"peak mem":>10}')
+    for size in sizes:
+        body = payload(size)
+        assert scan(body) == json.loads(body)['page']['totalElements'] == size
+        full = best(lambda: json.loads(body))
+        full_memory = peak_memory(lambda: json.loads(body))
+        scanned = best(lambda: scan(body))
+        scanned_memory = peak_memory(lambda: scan(body))
+        print(f'{size:>8} {len(body) / 1e6:>8.2f}MB | {full * 1e3:>9.2f}ms {full_memory / 1e6:>8.2f}MB | '
+              f'{scanned * 1e3:>7.2f}ms {scanned_memory / 1e6:>8.2f}MB')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    bodies = {}
+
+    def do_GET(self):
+        body = self.bodies[self.path]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # Streamed probes close the connection early on purpose
+        pass
+
+
+def bench_http(sizes):
+    server = _Server(('127.0.0.1', 0), _Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    session = requests.Session()
+
+    print('\nOver HTTP (localhost; real gateways add transfer time per byte)')
+    print(f'{"assets":>8} {"layout":>10} | {"full .json()":>12} | {"streamed count":>14}')
+    for size in sizes:
+        for page_first in (False, True):
+            path = f'/{size}/{"first" if page_first else "last"}'
+            _Handler.bodies[path] = payload(size, page_first)
+
+            def full():
+                return session.get(base + path).json()['page']['totalElements']
+
+            def streamed():
+                # No byte cap here, to time the worst case end to end
+                return read_count(session.get(base + path, stream=True), PATH, max_bytes=float('inf'))
+
+            assert full() == streamed() == size
+            print(f'{size:>8} {"page first" if page_first else "page last":>10} | '
+                  f'{best(full) * 1e3:>10.2f}ms | {best(streamed) * 1e3:>12.2f}ms')
+    server.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10,1000,10000,100000')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+    check_splits()
+    bench_in_process(sizes)
+    bench_http(sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Benchmark: per-request cost of the Prometheus instrumentation.
+
+Measures the work the request hooks add (in-flight gauge, duration
+histogram, status counter) and an upstream observation, in single-process
+mode and in gunicorn multiprocess mode (mmap-backed samples). A full Flask
+test-client request to /api/health is timed for scale.
+
+    python benchmarks/bench_instrumentation.py [--iterations 100000]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(iterations):
+    sys.path.insert(0, ROOT)
+    import instrumentation
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        instrumentation.REQUESTS_IN_FLIGHT.inc()
+        instrumentation.observe_request('/api/health', 'GET', 200, 0.001)
+        instrumentation.REQUESTS_IN_FLIGHT.dec()
+    per_request = (time.perf_counter() - start) / iterations
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        instrumentation.observe_upstream('/api/assetmanagement/v3/assets', 200, 0.05)
+    per_upstream = (time.perf_counter() - start) / iterations
+
+    os.environ.setdefault('SUBMISSIONS_BACKEND', 'memory')
+    os.environ.setdefault('LOG_SAMPLE_RATES', '/=0')
+    from app import app
+    client = app.test_client()
+    requests_count = max(iterations // 20, 100)
+    start = time.perf_counter()
+    for _ in range(requests_count):
+        client.get('/api/health')
+    per_flask = (time.perf_counter() - start) / requests_count
+
+    mode = 'multiprocess' if os.environ.get('PROMETHEUS_MULTIPROC_DIR') else 'single-process'
+    print(f'{mode:>15}: request hooks {per_request * 1e6:6.2f} us, '
+          f'upstream observation {per_upstream * 1e6:6.2f} us, '
+          f'full /api/health request {per_flask * 1e6:7.1f} us')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        measure(args.iterations)
+        return
+
+    # Each mode runs in a fresh interpreter; prometheus_client picks its value
+    # backend when first imported.
+    command = [sys.executable, os.path.abspath(__file__), '--child', '--iterations', str(args.iterations)]
+    env = {k: v for k, v in os.environ.items() if k != 'PROMETHEUS_MULTIPROC_DIR'}
+    subprocess.run(command, env=env, check=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        subprocess.run(command, env=dict(env, PROMETHEUS_MULTIPROC_DIR=tmp), check=True)
+
+
+if __name__ == '__main__':
+    main()
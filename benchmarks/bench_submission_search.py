@@ -0,0 +1,116 @@
+"""Benchmark: search latency over the submission index at up to a million submissions.
+
+Fills an in-memory store with synthetic texts (a Zipf-distributed vocabulary,
+so a few words are very common and most are rare), builds the index, then
+times each query kind. For comparison, it also times the scan a client does
+when it filters GET /api/submissions itself.
+
+    python benchmarks/bench_submission_search.py [--sizes 100000,1000000] [--queries 200]
+"""
+import argparse
+import itertools
+import os
+import random
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from submission_search import SubmissionIndex, parse_query, parse_timestamp, tokenize  # noqa: E402
+from submission_store import InMemorySubmissionStore  # noqa: E402
+
+VOCABULARY = 20000
+WORDS_PER_TEXT = 12
+NAMES = 1000
+SYLLABLES = ['ka', 'lo', 'mi', 'ne', 'pu', 'ra', 'si', 'to', 'vu', 'ze', 'pump', 'valve', 'flow']
+
+
+def vocabulary(rng):
+    words = set()
+    while len(words) < VOCABULARY:
+        words.add(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words, key=lambda _: rng.random())
+
+
+def fill(size, rng):
+    words = vocabulary(rng)
+    weights = list(itertools.accumulate(1 / rank for rank in range(1, VOCABULARY + 1)))
+    store = InMemorySubmissionStore()
+    for i in range(size):
+        text = ' '.join(rng.choices(words, cum_weights=weights, k=WORDS_PER_TEXT))
+        store.add(f'user{rng.randrange(NAMES)}', text)
+    return store, words
+
+
+def timed(fn, args_list):
+    durations = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return durations[len(durations) // 2], durations[min(int(len(durations) * 0.95), len(durations) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='100000,1000000')
+    parser.add_argument('--queries', type=int, default=200, help='queries timed per kind')
+    args = parser.parse_args()
+
+    for size in (int(s) for s in args.sizes.split(',')):
+        rng = random.Random(size)
+        store, words = fill(size, rng)
+        submissions = store.all()
+        first, last = submissions[0].timestamp, submissions[-1].timestamp
+        span = submissions[size // 2].timestamp, submissions[size // 2 + size // 100].timestamp
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        index = SubmissionIndex(store)
+        start = time.perf_counter()
+        index.sync()
+        build = time.perf_counter() - start
+        grown = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) * 1024
+
+        common, mid, rare = words[:10], words[100:1000], words[5000:]
+        middle = parse_timestamp(span[0]), parse_timestamp(span[1])
+        kinds = {
+            'common term': [(tokenize(w), ()) for w in rng.choices(common, k=args.queries)],
+            'mid term': [(tokenize(w), ()) for w in rng.choices(mid, k=args.queries)],
+            'rare term': [(tokenize(w), ()) for w in rng.choices(rare, k=args.queries)],
+            'two terms': [parse_query(f'{a} {b}') for a, b in zip(rng.choices(common, k=args.queries),
+                                                                  rng.choices(mid, k=args.queries))],
+            'prefix': [parse_query(w[:5] + '*') for w in rng.choices(mid, k=args.queries)],
+        }
+        # The same prefixes again, now answered from the prefix cache
+        kinds['prefix, repeated'] = kinds['prefix']
+        print(f'{size} submissions: index built in {build:.1f}s, ~{grown / size:.0f} bytes/submission '
+              f'({first[:19]} .. {last[:19]})')
+        print(f'{"query":>22}  {"p50":>9}  {"p95":>9}')
+        for kind, queries in kinds.items():
+            p50, p95 = timed(lambda terms, prefixes: index.search(terms, prefixes), queries)
+            print(f'{kind:>22}  {p50 * 1e3:>6.2f} ms  {p95 * 1e3:>6.2f} ms')
+        filters = {
+            'name': lambda name: index.search(name=name),
+            'time range (1%)': lambda _: index.search(since=middle[0], until=middle[1]),
+            'mid term + time range': lambda w: index.search(tokenize(w), since=middle[0], until=middle[1]),
+            'common term + name': lambda name: index.search(tokenize(common[0]), name=name),
+        }
+        for kind, fn in filters.items():
+            values = [(f'user{rng.randrange(NAMES)}',) if 'name' in kind else (rng.choice(mid),)
+                      for _ in range(args.queries)]
+            p50, p95 = timed(fn, values)
+            print(f'{kind:>22}  {p50 * 1e3:>6.2f} ms  {p95 * 1e3:>6.2f} ms')
+
+        # What clients did: fetch everything, then scan it
+        word = mid[0]
+        start = time.perf_counter()
+        for _ in range(3):
+            [s for s in submissions if word in tokenize(s.text)]
+        print(f'{"client-side scan":>22}  {(time.perf_counter() - start) / 3 * 1e3:>6.0f} ms')
+        print()
+
+
+if __name__ == '__main__':
+    main()
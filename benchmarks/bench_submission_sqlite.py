@@ -0,0 +1,93 @@
+"""Throughput benchmark: concurrent submits and reads against the SQLite submission store.
+
+Runs several processes (like gunicorn workers), each with writer and reader
+threads, against one database file, then checks every process sees every row.
+
+    python benchmarks/bench_submission_sqlite.py [--processes 2] [--writers 8] [--readers 8] [--seconds 5]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from submission_store import SqliteSubmissionStore  # noqa: E402
+
+TEXT = 'lorem ipsum dolor sit amet ' * 4
+
+
+def worker(path, writers, readers, seconds, results):
+    store = SqliteSubmissionStore(path)
+    counts = {'submit': 0, 'get': 0, 'page': 0}
+    lock = threading.Lock()
+    stop = time.monotonic() + seconds
+
+    def write():
+        done = 0
+        while time.monotonic() < stop:
+            store.add('bench', TEXT)
+            done += 1
+        with lock:
+            counts['submit'] += done
+
+    def read():
+        gets = pages = 0
+        while time.monotonic() < stop:
+            last = int(store.version())
+            if last:
+                store.get(random.randint(1, last))
+                gets += 1
+            store.page(after=max(last - 50, 0), limit=50)
+            pages += 1
+        with lock:
+            counts['get'] += gets
+            counts['page'] += pages
+
+    threads = [threading.Thread(target=write) for _ in range(writers)]
+    threads += [threading.Thread(target=read) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    counts['visible'] = store.count()
+    results.put(counts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        SqliteSubmissionStore(path)
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=worker, args=(path, args.writers, args.readers, args.seconds, results))
+            for _ in range(args.processes)
+        ]
+        for process in processes:
+            process.start()
+        totals = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+        stored = SqliteSubmissionStore(path).count()
+
+    submitted = sum(t['submit'] for t in totals)
+    print(f'processes={args.processes} writers/process={args.writers} readers/process={args.readers}')
+    print(f"submit: {submitted / args.seconds:>10.0f} /s")
+    print(f"get:    {sum(t['get'] for t in totals) / args.seconds:>10.0f} /s")
+    print(f"page:   {sum(t['page'] for t in totals) / args.seconds:>10.0f} /s  (50 rows each)")
+    print(f'consistent: {stored == submitted} ({stored} rows stored, {submitted} submitted)')
+
+
+if __name__ == '__main__':
+    main()
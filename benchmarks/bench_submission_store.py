@@ -0,0 +1,83 @@
+"""Microbenchmark: submission insert and lookup cost at different store sizes.
+
+Compares InMemorySubmissionStore with the list + linear scan it replaced.
+
+    python benchmarks/bench_submission_store.py [--sizes 10000,100000,1000000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from submission_store import InMemorySubmissionStore  # noqa: E402
+
+TEXT = 'lorem ipsum dolor sit amet ' * 4
+LOOKUPS = 1000
+LIST_LOOKUPS = 20
+
+
+def bench_store(size):
+    # Memory is measured on a separate build so tracing doesn't skew insert timings
+    tracemalloc.start()
+    traced = InMemorySubmissionStore()
+    for i in range(size):
+        traced.add(f'user{i % 100}', TEXT)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del traced
+
+    store = InMemorySubmissionStore()
+    start = time.perf_counter()
+    for i in range(size):
+        store.add(f'user{i % 100}', TEXT)
+    insert = (time.perf_counter() - start) / size
+
+    ids = [random.randint(1, size) for _ in range(LOOKUPS)]
+    start = time.perf_counter()
+    for submission_id in ids:
+        store.get(submission_id)
+    lookup = (time.perf_counter() - start) / LOOKUPS
+    return insert, lookup, memory / size
+
+
+def bench_list(size):
+    submissions = []
+    start = time.perf_counter()
+    for i in range(size):
+        submissions.append({
+            'id': len(submissions) + 1,
+            'name': f'user{i % 100}',
+            'text': TEXT,
+            'timestamp': datetime.now().isoformat()
+        })
+    insert = (time.perf_counter() - start) / size
+
+    ids = [random.randint(1, size) for _ in range(LIST_LOOKUPS)]
+    start = time.perf_counter()
+    for submission_id in ids:
+        next((s for s in submissions if s['id'] == submission_id), None)
+    lookup = (time.perf_counter() - start) / LIST_LOOKUPS
+    return insert, lookup
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='10000,100000,1000000')
+    args = parser.parse_args()
+
+    print(f"{'size':>9}  {'store insert':>13}  {'store lookup':>13}  {'bytes/rec':>9}  "
+          f"{'list insert':>12}  {'list lookup':>12}")
+    for size in (int(s) for s in args.sizes.split(',')):
+        insert, lookup, per_record = bench_store(size)
+        list_insert, list_lookup = bench_list(size)
+        print(f'{size:>9}  {insert * 1e6:>10.2f} us  {lookup * 1e6:>10.2f} us  {per_record:>9.0f}  '
+              f'{list_insert * 1e6:>9.2f} us  {list_lookup * 1e6:>9.0f} us')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+"""Local stand-in for the Insights Hub APIs the app calls, for offline load tests.
+
+Serves the endpoints behind the dashboard metrics and the asset routes with
+a synthetic tenant whose size, response latency, error rate and payload size
+are configurable:
+
+  /api/assetmanagement/v3/assets              paged assets (ETag / If-None-Match)
+  /api/datalake/v3/listObjects                a folder tree, paged with nextToken
+  /api/eventmanagement/v3/events              events spread over the last year
+  /api/visualflowcreator/v3/flows             \
+  /api/kpidashboardconfiguration/v3/dashboards |
+  /api/rulesmanagement/v4/rules                 > paged collections
+  /api/casemanagement/v3/cases                 |  (cases report totalElements at the top level)
+  /api/oipredictapi/v3/predict-assets/all      |
+  /api/oipredictapi/v3/usageDetails           /
+
+GET /__stub/stats returns request counters (and the most requests seen in
+flight at once); GET /__stub/reset clears them.
+
+    python benchmarks/insights_hub_stub.py --port 9000 --latency 0.05 --error-rate 0.01 --tenant-size 10000
+    INSIGHTS_HUB_API_BASE=http://127.0.0.1:9000 gunicorn app:app
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+YEAR = 365 * 86400
+
+
+class Tenant:
+    """Object counts of a synthetic tenant, derived from its number of assets"""
+
+    def __init__(self, size, event_rate=0.0, datalake_fanout=4, datalake_depth=2):
+        self.assets = size
+        self.agents = max(size // 10, 1)
+        self.flows = max(size // 20, 1)
+        self.dashboards = max(size // 50, 1)
+        self.rules = max(size // 30, 1)
+        self.cases = max(size // 25, 1)
+        self.predictions = max(size // 60, 1)
+        self.anomaly_detections = max(size // 200, 1)
+        # Events: `size * 100` spread evenly over the year before the stub started,
+        # then `event_rate` new ones per second
+        self.events = size * 100
+        self.event_rate = event_rate
+        self.started = time.time()
+        self.datalake_fanout = datalake_fanout
+        self.datalake_depth = datalake_depth
+        folders = sum(datalake_fanout ** level for level in range(datalake_depth + 1))
+        self.files_per_folder = max(size // folders, 1)
+
+    def event_time(self, i):
+        if i < self.events:
+            return self.started - YEAR + i * YEAR / self.events
+        return self.started + (i - self.events + 1) / self.event_rate
+
+    def count_events(self, after=None, before=None):
+        """Events with after < timestamp <= before"""
+        now = time.time()
+        before = now if before is None else min(before, now)
+        return max(self._events_until(before) - self._events_until(after), 0)
+
+    def _events_until(self, t):
+        """Number of events with timestamp <= t"""
+        if t is None or t < self.started - YEAR:
+            return 0
+        if t < self.started:
+            return min(int((t - (self.started - YEAR)) * self.events / YEAR) + 1, self.events)
+        return self.events + int((t - self.started) * self.event_rate)
+
+
+def _parse_time(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def _iso(t):
+    return datetime.fromtimestamp(t, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+
+class Stub:
+    """Configuration and counters shared by the stub's request handlers"""
+
+    def __init__(self, tenant, latency=0.0, jitter=0.0, error_rate=0.0, payload_bytes=200, seed=None):
+        self.tenant = tenant
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.payload_bytes = payload_bytes
+        self.padding = 'x' * payload_bytes
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.reset()
+
+    def reset(self):
+        """Clear the counters; requests in flight stay counted"""
+        with self.lock:
+            self.requests = {}
+            self.errors_injected = 0
+            self.not_modified = 0
+            self.peak_in_flight = self.in_flight
+
+    def stats(self):
+        with self.lock:
+            return {
+                'requests': dict(self.requests),
+                'total': sum(self.requests.values()),
+                'errors_injected': self.errors_injected,
+                'not_modified': self.not_modified,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+            }
+
+    def delay(self):
+        if self.latency > 0:
+            time.sleep(max(self.latency * (1 + self.random.uniform(-self.jitter, self.jitter)), 0))
+
+    def fail(self):
+        return self.error_rate > 0 and self.random.random() < self.error_rate
+
+
+def _page(total, size, number):
+    return {'size': size, 'totalElements': total, 'totalPages': -(-total // size) if size else 0, 'number': number}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # path -> counter name; `_<name>` handles the request if defined, else `_collection`
+    ROUTES = {
+        '/api/assetmanagement/v3/assets': 'assets',
+        '/api/datalake/v3/listObjects': 'list_objects',
+        '/api/eventmanagement/v3/events': 'events',
+        '/api/visualflowcreator/v3/flows': 'flows',
+        '/api/kpidashboardconfiguration/v3/dashboards': 'dashboards',
+        '/api/rulesmanagement/v4/rules': 'rules',
+        '/api/casemanagement/v3/cases': 'cases',
+        '/api/oipredictapi/v3/predict-assets/all': 'predictions',
+        '/api/oipredictapi/v3/usageDetails': 'anomaly_detections',
+    }
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        if body:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body:
+            try:
+                self.wfile.write(body)
+            except (BrokenPipeError, ConnectionResetError):
+                # Count probes close the connection once they have the total
+                pass
+
+    def _json(self, data, headers=None):
+        self._send(200, json.dumps(data).encode(), headers)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        stub = self.server.stub
+
+        if url.path == '/__stub/stats':
+            return self._json(stub.stats())
+        if url.path == '/__stub/reset':
+            stub.reset()
+            return self._json({'reset': True})
+
+        name = self.ROUTES.get(url.path)
+        if name is None:
+            return self._send(404, json.dumps({'error': f'No stub for {url.path}'}).encode())
+
+        with stub.lock:
+            stub.requests[name] = stub.requests.get(name, 0) + 1
+            stub.in_flight += 1
+            stub.peak_in_flight = max(stub.peak_in_flight, stub.in_flight)
+        try:
+            stub.delay()
+            if stub.fail():
+                with stub.lock:
+                    stub.errors_injected += 1
+                return self._send(503, json.dumps({'error': 'Injected failure'}).encode())
+            getattr(self, f'_{name}', self._collection)(name, query)
+        finally:
+            with stub.lock:
+                stub.in_flight -= 1
+
+    def _assets(self, name, query):
+        stub = self.server.stub
+        size = int(query.get('size', 10))
+        number = int(query.get('page', 0))
+        agents = 'core.basicagent' in query.get('filter', '')
+        total = stub.tenant.agents if agents else stub.tenant.assets
+        # The synthetic tenant never changes, so a page's tag only depends on the query
+        etag = f'W/"{"agents" if agents else "assets"}-{number}-{size}-{stub.payload_bytes}"'
+        if etag in self.headers.get('If-None-Match', ''):
+            with stub.lock:
+                stub.not_modified += 1
+            return self._send(304, headers={'ETag': etag})
+        first = number * size
+        assets = [
+            {
+                'assetId': f'{i:032x}',
+                'externalId': f'ext-{i}',
+                'name': f'Asset {i}',
+                'typeId': 'core.basicagent' if agents else 'tenant.PumpType',
+                'parentId': f'{0:032x}',
+                'description': stub.padding,
+                'etag': 1,
+            }
+            for i in range(first, min(first + size, total))
+        ]
+        page = _page(total, size, number)
+        self._json({'_embedded': {'assets': assets}, 'page': page}, {'ETag': etag})
+
+    def _events(self, name, query):
+        tenant = self.server.stub.tenant
+        size = int(query.get('size', 20))
+        number = int(query.get('page', 0))
+        window = json.loads(query.get('filter') or '{}').get('timestamp', {})
+        after, before = _parse_time(window.get('after')), _parse_time(window.get('before'))
+        total = tenant.count_events(after, before)
+        # Newest first, as the Event Management API sorts by default
+        newest = tenant.count_events(None, before) - 1
+        events = [
+            {'id': f'event-{i}', 'timestamp': _iso(tenant.event_time(i)), 'description': self.server.stub.padding}
+            for i in range(newest - number * size, max(newest - (number + 1) * size, newest - total), -1)
+        ]
+        self._json({'_embedded': {'events': events}, 'page': _page(total, size, number)})
+
+    def _list_objects(self, name, query):
+        stub = self.server.stub
+        tenant = stub.tenant
+        path = query.get('path', '/')
+        if not path.endswith('/'):
+            path += '/'
+        depth = path.strip('/').count('/') + 1 if path != '/' else 0
+        offset = int(query.get('pageToken') or 0)
+        size = int(query.get('size', 1000))
+
+        folders = []
+        if depth < tenant.datalake_depth:
+            folders = [{'path': f'{path}folder{i}/', 'name': f'folder{i}'} for i in range(tenant.datalake_fanout)]
+        # Folders come first in the listing, then files
+        entries = folders + [None] * tenant.files_per_folder
+        chunk = entries[offset:offset + size]
+        files = [
+            {'name': f'file{offset + i}.json', 'path': f'{path}file{offset + i}.json', 'size': stub.payload_bytes}
+            for i, entry in enumerate(chunk) if entry is None
+        ]
+        data = {'objects': {'files': files, 'folders': [entry for entry in chunk if entry is not None]}, 'page': {}}
+        if offset + size < len(entries):
+            data['page']['nextToken'] = str(offset + size)
+        self._json(data)
+
+    def _collection(self, name, query):
+        stub = self.server.stub
+        total = getattr(stub.tenant, name)
+        size = int(query.get('size', 20))
+        number = int(query.get('page', 0))
+        first = number * size
+        content = [{'id': f'{name}-{i}', 'description': stub.padding} for i in range(first, min(first + size, total))]
+        page = _page(total, size, number)
+        if name == 'cases':
+            self._json({'content': content, **page})
+        else:
+            self._json({'content': content, 'page': page})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 4096
+
+    def __init__(self, address, stub):
+        super().__init__(address, Handler)
+        self.stub = stub
+
+    def handle_error(self, request, client_address):
+        # Clients that hang up early are expected under load
+        pass
+
+
+def add_arguments(parser):
+    """Stub options, shared with the load-test harness"""
+    parser.add_argument('--latency', type=float, default=0.05, help='upstream response time (seconds)')
+    parser.add_argument('--jitter', type=float, default=0.2, help='latency varies by up to this fraction')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of calls answered with 503')
+    parser.add_argument('--payload-bytes', type=int, default=200, help='padding per returned item')
+    parser.add_argument('--tenant-size', type=int, default=1000, help='number of assets; other counts scale with it')
+    parser.add_argument('--event-rate', type=float, default=0.0, help='new events per second after start')
+    parser.add_argument('--seed', type=int, default=None)
+
+
+def stub_from_args(args):
+    return Stub(
+        Tenant(args.tenant_size, args.event_rate),
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        payload_bytes=args.payload_bytes,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = StubServer((args.host, args.port), stub_from_args(args))
+    print(f'Insights Hub stub on http://{args.host}:{server.server_port}', flush=True)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
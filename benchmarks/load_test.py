@@ -0,0 +1,379 @@
+"""Load test: concurrent clients against the app, served by a local Insights Hub stub.
+
+Starts benchmarks/insights_hub_stub.py and the app under gunicorn (or uses
+`--url` / `--stub-url`), then runs each scenario as a closed loop of
+`--concurrency` clients for `--duration` seconds after `--warmup`:
+
+  dashboard    GET /api/insights-hub/dashboard-metrics, rotating over `--tenants` tenants
+  assets       GET /api/insights-hub/assets, random pages of 10
+  submit       POST /api/submit
+  submissions  GET /api/submissions?limit=50
+  mixed        all four, weighted like a dashboard session
+
+Results (throughput, p50/p95/p99 latency, error rate, upstream calls per
+request) go to stdout as JSON, or to `--output`; a summary table goes to
+stderr. With `--baseline` the run is compared against an earlier result file
+and exits with status 1 on a regression beyond `--tolerance`.
+
+    python benchmarks/load_test.py --duration 10 --output results.json
+    python benchmarks/load_test.py --baseline results.json --tolerance 0.2
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+from insights_hub_stub import add_arguments as add_stub_arguments
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = {
+    # gunicorn switches sync workers to gthread when threads > 1 (set in gunicorn.conf.py)
+    'sync': ['app:app', '-k', 'sync', '--threads', '1'],
+    'gthread': ['app:app'],
+    'asgi': ['asgi:app', '-k', 'uvicorn_worker.UvicornWorker'],
+}
+
+# scenario -> request kind -> weight
+SCENARIOS = {
+    'dashboard': {'dashboard': 1},
+    'assets': {'assets': 1},
+    'submit': {'submit': 1},
+    'submissions': {'submissions': 1},
+    'mixed': {'dashboard': 2, 'assets': 4, 'submit': 1, 'submissions': 3},
+}
+
+TEXT = 'lorem ipsum dolor sit amet ' * 4
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def stub_argv(args):
+    """Command-line options reproducing the stub settings in `args`"""
+    argv = ['--latency', str(args.latency), '--jitter', str(args.jitter), '--error-rate', str(args.error_rate),
+            '--payload-bytes', str(args.payload_bytes), '--tenant-size', str(args.tenant_size),
+            '--event-rate', str(args.event_rate)]
+    if args.seed is not None:
+        argv += ['--seed', str(args.seed)]
+    return argv
+
+
+def start_stub(argv):
+    """Run the stub in its own process; returns (process, base URL)"""
+    stub = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'benchmarks', 'insights_hub_stub.py'), '--port', '0', *argv],
+        stdout=subprocess.PIPE, text=True
+    )
+    line = stub.stdout.readline()
+    if not line:
+        raise RuntimeError('stub did not start')
+    return stub, line.split()[-1]
+
+
+def start_app(mode, workers, stub_base, workdir, env=None):
+    """Run the app under gunicorn against the stub; returns (process, base URL, log path)"""
+    port = free_port()
+    env = dict(
+        os.environ,
+        INSIGHTS_HUB_API_BASE=stub_base,
+        SUBMISSIONS_DB=os.path.join(workdir, 'submissions.db'),
+        METRIC_JOBS_DB=os.path.join(workdir, 'jobs.db'),
+        LOG_LEVEL='ERROR',
+        **(env or {})
+    )
+    log_path = os.path.join(workdir, f'gunicorn-{mode}.log')
+    command = [sys.executable, '-m', 'gunicorn', *MODES[mode], '--bind', f'127.0.0.1:{port}',
+               '--workers', str(workers), '--timeout', '120', '--log-level', 'warning']
+    with open(log_path, 'ab') as log:
+        server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=log)
+    return server, f'http://127.0.0.1:{port}', log_path
+
+
+def stop(process):
+    if process is not None and process.poll() is None:
+        process.terminate()
+        process.wait()
+
+
+async def wait_ready(client, base, attempts=100):
+    for _ in range(attempts):
+        try:
+            if (await client.get(f'{base}/api/health')).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError(f'{base} did not become ready')
+
+
+def seed_submissions(path, count):
+    """Fill the submission database before the app opens it"""
+    from submission_store import SqliteSubmissionStore
+    store = SqliteSubmissionStore(path)
+    for i in range(count):
+        store.add(f'seed-{i}', TEXT)
+
+
+def load_test_token(tenant):
+    """Unsigned JWT-shaped token whose tenant claim matches the tenant header (the stub accepts any token)"""
+    claims = base64.urlsafe_b64encode(json.dumps({'ten': tenant}).encode()).rstrip(b'=').decode()
+    return f'load-test.{claims}.load-test'
+
+
+class Requests:
+    """Builds the HTTP request for each request kind"""
+
+    def __init__(self, base, tenants):
+        self.base = base
+        self.tenants = tenants
+
+    def _tenant_headers(self, rng):
+        tenant = f'tenant{rng.randrange(self.tenants)}'
+        return {'Authorization': f'Bearer {load_test_token(tenant)}', 'X-MindSphere-Tenant': tenant}
+
+    def dashboard(self, client, rng):
+        return client.get(f'{self.base}/api/insights-hub/dashboard-metrics', headers=self._tenant_headers(rng))
+
+    def assets(self, client, rng):
+        return client.get(f'{self.base}/api/insights-hub/assets', headers=self._tenant_headers(rng),
+                          params={'page': rng.randrange(10), 'size': 10})
+
+    def submit(self, client, rng):
+        return client.post(f'{self.base}/api/submit', json={'name': f'user-{rng.randrange(1000)}', 'text': TEXT})
+
+    def submissions(self, client, rng):
+        return client.get(f'{self.base}/api/submissions', params={'limit': 50})
+
+
+async def stub_stats(client, stub_base, reset=False):
+    if stub_base is None:
+        return None
+    response = await client.get(f'{stub_base}/__stub/{"reset" if reset else "stats"}')
+    return response.json()
+
+
+async def drive(client, requests_, weights, concurrency, duration, seed):
+    """Closed loop: each client sends its next request when the previous one completes"""
+    kinds, cumulative = list(weights), []
+    total = 0
+    for weight in weights.values():
+        total += weight
+        cumulative.append(total)
+    samples = {kind: [] for kind in kinds}
+    statuses = {kind: {} for kind in kinds}
+    ends_at = time.monotonic() + duration
+
+    async def worker(n):
+        rng = random.Random(None if seed is None else seed * 100003 + n)
+        while time.monotonic() < ends_at:
+            kind = rng.choices(kinds, cum_weights=cumulative)[0]
+            start = time.perf_counter()
+            try:
+                response = await getattr(requests_, kind)(client, rng)
+                status = str(response.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            # Requests still running when the time is up are not counted
+            if time.monotonic() <= ends_at:
+                samples[kind].append((time.perf_counter() - start, status))
+                statuses[kind][status] = statuses[kind].get(status, 0) + 1
+
+    tasks = [asyncio.create_task(worker(n)) for n in range(concurrency)]
+    await asyncio.wait(tasks, timeout=duration + 30)
+    for task in tasks:
+        task.cancel()
+    return samples, statuses
+
+
+def summarize(samples, statuses, duration):
+    latencies = [latency for latency, _ in samples]
+    errors = sum(1 for _, status in samples if not status.isdigit() or int(status) >= 400)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'error_rate': errors / len(samples) if samples else 0.0,
+        'throughput_rps': len(samples) / duration,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.5) * 1e3,
+            'p95': percentile(latencies, 0.95) * 1e3,
+            'p99': percentile(latencies, 0.99) * 1e3,
+            'max': max(latencies) * 1e3 if latencies else float('nan'),
+            'mean': sum(latencies) / len(latencies) * 1e3 if latencies else float('nan'),
+        },
+        'status_counts': statuses,
+    }
+
+
+async def run_scenario(name, args, base, stub_base):
+    limits = httpx.Limits(max_connections=args.concurrency + 10, max_keepalive_connections=args.concurrency + 10)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        await wait_ready(client, base)
+        requests_ = Requests(base, args.tenants)
+        weights = SCENARIOS[name]
+        if args.warmup > 0:
+            await drive(client, requests_, weights, args.concurrency, args.warmup, args.seed)
+        await stub_stats(client, stub_base, reset=True)
+        samples, statuses = await drive(client, requests_, weights, args.concurrency, args.duration, args.seed)
+        upstream = await stub_stats(client, stub_base)
+
+    combined = [sample for kind in samples for sample in samples[kind]]
+    merged = {}
+    for counts in statuses.values():
+        for status, count in counts.items():
+            merged[status] = merged.get(status, 0) + count
+    result = summarize(combined, merged, args.duration)
+    if len(weights) > 1:
+        result['by_request'] = {kind: summarize(samples[kind], statuses[kind], args.duration) for kind in samples}
+    if upstream is not None:
+        result['upstream_calls'] = upstream['total']
+        result['upstream_per_request'] = upstream['total'] / len(combined) if combined else None
+        result['upstream_errors_injected'] = upstream['errors_injected']
+    return result
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit,
+    }
+
+
+def compare(results, baseline, tolerance, error_tolerance):
+    """Regressions of `results` against `baseline` (both keyed by scenario)"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(f'{name}: throughput {result["throughput_rps"]:.1f} req/s '
+                               f'(baseline {before["throughput_rps"]:.1f})')
+        if result['latency_ms']['p95'] > before['latency_ms']['p95'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {result["latency_ms"]["p95"]:.1f} ms '
+                               f'(baseline {before["latency_ms"]["p95"]:.1f})')
+        if result['error_rate'] > before['error_rate'] + error_tolerance:
+            regressions.append(f'{name}: error rate {result["error_rate"]:.2%} '
+                               f'(baseline {before["error_rate"]:.2%})')
+    return regressions
+
+
+def print_table(results, out=sys.stderr):
+    print(f'{"scenario":>12} | {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"errors":>7} | '
+          f'{"upstream/req":>12}', file=out)
+    for name, r in results.items():
+        latency = r['latency_ms']
+        upstream = r.get('upstream_per_request')
+        print(f'{name:>12} | {r["throughput_rps"]:>8.1f} {latency["p50"]:>8.1f} {latency["p95"]:>8.1f} '
+              f'{latency["p99"]:>8.1f} {r["error_rate"]:>7.2%} | '
+              f'{"-" if upstream is None else f"{upstream:.3f}":>12}', file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--mode', choices=MODES, default='gthread', help='how gunicorn serves the app')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--concurrency', type=int, default=50, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=10, help='measured seconds per scenario')
+    parser.add_argument('--warmup', type=float, default=2, help='unmeasured seconds before each scenario')
+    parser.add_argument('--tenants', type=int, default=10, help='distinct tenants the clients rotate over')
+    parser.add_argument('--seed-submissions', type=int, default=1000, help='submissions stored before the run')
+    parser.add_argument('--url', help='test a running app instead of starting one')
+    parser.add_argument('--stub-url', help='stub the app at --url calls, for upstream counters')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    parser.add_argument('--baseline', help='earlier JSON results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative throughput drop / p95 rise against the baseline')
+    parser.add_argument('--error-tolerance', type=float, default=0.01,
+                        help='allowed absolute error rate rise against the baseline')
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+    scenarios = args.scenarios.split(',')
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f'unknown scenario {name!r}; choose from {", ".join(SCENARIOS)}')
+
+    stub = server = None
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        try:
+            stub_base = args.stub_url
+            base = args.url
+            if base is None:
+                if stub_base is None:
+                    stub, stub_base = start_stub(stub_argv(args))
+                seed_submissions(os.path.join(workdir, 'submissions.db'), args.seed_submissions)
+                server, base, log_path = start_app(args.mode, args.workers, stub_base, workdir)
+            for name in scenarios:
+                try:
+                    results[name] = asyncio.run(run_scenario(name, args, base, stub_base))
+                except RuntimeError:
+                    if server is not None:
+                        with open(log_path) as log:
+                            sys.stderr.write(log.read())
+                    raise
+        finally:
+            stop(server)
+            stop(stub)
+
+    report = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'environment': environment(),
+        'config': {
+            name: value for name, value in vars(args).items()
+            if name not in ('output', 'baseline', 'tolerance', 'error_tolerance')
+        },
+        'results': results,
+    }
+    print_table(results)
+
+    status = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        report['regressions'] = compare(results, baseline, args.tolerance, args.error_tolerance)
+        for regression in report['regressions']:
+            print(f'REGRESSION {regression}', file=sys.stderr)
+        status = 1 if report['regressions'] else 0
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    sys.exit(status)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Circuit breakers and adaptive timeouts per (API base, Insights Hub service)"""
+import os
+import threading
+import time
+from collections import deque
+
+import instrumentation
+
+# Consecutive failures (errors, timeouts, 5xx/429) that open a circuit
+CB_FAILURE_THRESHOLD = int(os.environ.get('CB_FAILURE_THRESHOLD', 5))
+# Seconds an open circuit fails fast before letting one probe request through
+CB_RESET_TIMEOUT = float(os.environ.get('CB_RESET_TIMEOUT', 30))
+# Adaptive timeout = observed p99 latency * multiplier, kept within [min, caller's timeout]
+CB_TIMEOUT_MULTIPLIER = float(os.environ.get('CB_TIMEOUT_MULTIPLIER', 2))
+CB_MIN_TIMEOUT = float(os.environ.get('CB_MIN_TIMEOUT', 2))
+# Latency samples kept per service, and how many are needed before adapting
+CB_LATENCY_WINDOW = int(os.environ.get('CB_LATENCY_WINDOW', 200))
+CB_MIN_SAMPLES = int(os.environ.get('CB_MIN_SAMPLES', 20))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Tracks one upstream service and decides whether calls may go through.
+
+    Closed: every call goes through. After `failure_threshold` consecutive
+    failures the circuit opens and calls fail fast. Once `reset_timeout` has
+    passed a single half-open probe is let through; its outcome closes or
+    re-opens the circuit.
+    """
+
+    def __init__(self, api_base, service, failure_threshold=CB_FAILURE_THRESHOLD,
+                 reset_timeout=CB_RESET_TIMEOUT):
+        self.api_base = api_base
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._latencies = deque(maxlen=CB_LATENCY_WINDOW)
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        instrumentation.CIRCUIT_STATE.labels(self.api_base, self.service).set(_STATE_VALUES[state])
+
+    def retry_in(self):
+        if self.opened_at is None:
+            return 0.0
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def allow(self):
+        """Whether a call may be made now; moves an expired open circuit to half-open"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.retry_in() == 0:
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self, latency):
+        with self._lock:
+            self._latencies.append(latency)
+            self.failures = 0
+            self._probing = False
+            self.opened_at = None
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+                self._set_state(OPEN)
+
+    def release(self):
+        """End a call that says nothing about the service's health (a 4xx, a cancelled call).
+
+        The circuit keeps its state; a half-open circuit lets the next call probe.
+        """
+        with self._lock:
+            self._probing = False
+
+    def timeout(self, ceiling):
+        """Timeout for the next call: p99 of recent latencies scaled, capped at `ceiling`"""
+        with self._lock:
+            if len(self._latencies) < CB_MIN_SAMPLES:
+                return ceiling
+            ordered = sorted(self._latencies)
+        p99 = ordered[min(int(len(ordered) * 0.99), len(ordered) - 1)]
+        return min(max(p99 * CB_TIMEOUT_MULTIPLIER, CB_MIN_TIMEOUT), ceiling)
+
+    def snapshot(self):
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'retry_in': round(self.retry_in(), 1) if self.state == OPEN else None,
+        }
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(api_base, service):
+    """The breaker for a service on an API base (one per process)"""
+    key = (api_base, service)
+    breaker = _breakers.get(key)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(key)
+            if breaker is None:
+                breaker = _breakers[key] = CircuitBreaker(api_base, service)
+    return breaker
+
+
+def is_failure(status_code):
+    """Responses that say the service itself is unhealthy (not the caller's request)"""
+    return status_code >= 500 or status_code == 429
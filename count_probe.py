@@ -0,0 +1,208 @@
+"""Count-only reads: stream an upstream body and stop as soon as a total field has been parsed"""
+import codecs
+import json
+import os
+import re
+
+# Most body bytes a count probe reads before giving up
+COUNT_PROBE_MAX_BYTES = int(os.environ.get('COUNT_PROBE_MAX_BYTES', 1024 * 1024))
+# After the count is found, up to this many more bytes are read so the
+# connection can go back to the pool; larger remainders close it instead
+COUNT_PROBE_DRAIN_BYTES = int(os.environ.get('COUNT_PROBE_DRAIN_BYTES', 64 * 1024))
+CHUNK_SIZE = 16 * 1024
+
+_WHITESPACE = re.compile(r'[ \t\r\n]*')
+_STRING = re.compile(r'"(?:[^"\\]|\\.)*"')
+# Characters that can carry on a number that raw_decode stopped short of
+_NUMBER_CHARS = frozenset('.eE+-0123456789')
+_decoder = json.JSONDecoder()
+
+# What the innermost open container expects next
+_KEY, _COLON, _VALUE, _NEXT = range(4)
+# Path component standing for "inside an array", which never matches a count path
+_ARRAY = object()
+
+
+class CountNotFound(Exception):
+    """The count field was not within the bytes a probe may read"""
+
+
+def _follow(value, path):
+    """The number at `path` inside an already decoded value, or None"""
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    return None
+
+
+class CountScanner:
+    """Incremental JSON scanner that looks for a number at one object path.
+
+    Values that are complete in the buffered text are decoded (and dropped)
+    by the C JSON decoder in one call. Only containers that run past the end
+    of the buffer are followed element by element, so memory stays bounded
+    by the chunk size however long the body is. Feed chunks until `feed`
+    returns the value.
+    """
+
+    def __init__(self, path):
+        self.path = tuple(path)
+        self._text = ''
+        self._utf8 = codecs.getincrementaldecoder('utf-8')('replace')
+        # One [is_object, current key, expected] per open container
+        self._stack = []
+        self._started = False
+        self._done = False
+
+    def feed(self, chunk, final=False):
+        """Consume a chunk; returns the value once found, else None"""
+        text = self._text + self._utf8.decode(chunk, final)
+        pos, value = self._scan(text, final)
+        self._text = text[pos:]
+        return value
+
+    def _close(self):
+        self._stack.pop()
+        if self._stack:
+            self._stack[-1][2] = _NEXT
+        else:
+            self._done = True
+
+    def _scan(self, text, final):
+        stack = self._stack
+        length = len(text)
+        pos = 0
+        while True:
+            pos = _WHITESPACE.match(text, pos).end()
+            if pos >= length or self._done:
+                return (length if self._done else pos), None
+            char = text[pos]
+
+            if not self._started:
+                self._started = True
+                if char != '{':
+                    # Not an object at the top level: nothing to find
+                    self._done = True
+                    continue
+                stack.append([True, None, _KEY])
+                pos += 1
+                continue
+
+            frame = stack[-1]
+            is_object, _, expected = frame
+            if expected == _KEY:
+                if char == '}':
+                    self._close()
+                    pos += 1
+                    continue
+                match = _STRING.match(text, pos)
+                if match is None:
+                    return pos, None
+                key = match.group()
+                frame[1] = json.loads(key) if '\\' in key else key[1:-1]
+                frame[2] = _COLON
+                pos = match.end()
+            elif expected == _COLON:
+                frame[2] = _VALUE
+                pos += 1
+            elif expected == _NEXT:
+                if char == ',':
+                    frame[2] = _KEY if is_object else _VALUE
+                else:
+                    self._close()
+                pos += 1
+            else:
+                if char == ']' and not is_object:
+                    self._close()
+                    pos += 1
+                    continue
+                keys = tuple(f[1] if f[0] else _ARRAY for f in stack)
+                try:
+                    value, end = _decoder.raw_decode(text, pos)
+                except ValueError:
+                    if char in '{[':
+                        # Runs past the buffer: follow it element by element
+                        stack.append([char == '{', None, _KEY if char == '{' else _VALUE])
+                        pos += 1
+                        continue
+                    return pos, None
+                if not final and not isinstance(value, (dict, list, str)):
+                    # A number or literal cut off by the chunk may continue in the next one:
+                    # `1500.` decodes as 1500 with the `.` left over
+                    if end == length or (
+                        isinstance(value, (int, float)) and not isinstance(value, bool)
+                        and text[end] in _NUMBER_CHARS
+                    ):
+                        return pos, None
+                pos = end
+                frame[2] = _NEXT
+                if keys == self.path[:len(keys)]:
+                    found = _follow(value, self.path[len(keys):])
+                    if found is not None:
+                        return pos, found
+
+
+def read_count(response, path, max_bytes=COUNT_PROBE_MAX_BYTES):
+    """Read a streamed response until the number at `path` is parsed.
+
+    Returns 0 when the body ends without the field (as `.get(..., 0)` did).
+    Raises CountNotFound when `max_bytes` are read first. The rest of the
+    body is drained if it is small, so the connection is reused, and the
+    response is closed otherwise.
+    """
+    scanner = CountScanner(path)
+    read = 0
+    value = None
+    chunks = response.iter_content(chunk_size=CHUNK_SIZE)
+    try:
+        for chunk in chunks:
+            read += len(chunk)
+            value = scanner.feed(chunk)
+            if value is not None:
+                break
+            if read >= max_bytes:
+                raise CountNotFound(f'{".".join(path)} not found in the first {max_bytes} bytes')
+        else:
+            value = scanner.feed(b'', final=True)
+            return value if value is not None else 0
+
+        # A fully read body releases the connection back to the pool
+        drained = 0
+        for chunk in chunks:
+            drained += len(chunk)
+            if drained > COUNT_PROBE_DRAIN_BYTES:
+                break
+        return value
+    finally:
+        response.close()
+
+
+async def read_count_async(response, path, max_bytes=COUNT_PROBE_MAX_BYTES):
+    """read_count for a streamed httpx response (ASGI mode)"""
+    scanner = CountScanner(path)
+    read = 0
+    value = None
+    chunks = response.aiter_bytes(CHUNK_SIZE)
+    try:
+        async for chunk in chunks:
+            read += len(chunk)
+            value = scanner.feed(chunk)
+            if value is not None:
+                break
+            if read >= max_bytes:
+                raise CountNotFound(f'{".".join(path)} not found in the first {max_bytes} bytes')
+        else:
+            value = scanner.feed(b'', final=True)
+            return value if value is not None else 0
+
+        drained = 0
+        async for chunk in chunks:
+            drained += len(chunk)
+            if drained > COUNT_PROBE_DRAIN_BYTES:
+                break
+        return value
+    finally:
+        await response.aclose()
@@ -0,0 +1,342 @@
+"""Data Lake traversal: paginated, parallel folder listing and a per-tenant incremental folder index"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, TimeoutError, wait
+
+import upstream
+from token_check import TokenRejected, check_token, token_tenant
+
+LIST_OBJECTS_PATH = '/api/datalake/v3/listObjects'
+
+# Concurrent listObjects calls per process (shared by every crawl)
+DATALAKE_MAX_PARALLEL = int(os.environ.get('DATALAKE_MAX_PARALLEL', 8))
+# Objects requested per listObjects page, and pages followed per folder
+DATALAKE_PAGE_SIZE = int(os.environ.get('DATALAKE_PAGE_SIZE', 1000))
+DATALAKE_MAX_PAGES = int(os.environ.get('DATALAKE_MAX_PAGES', 1000))
+# Folders indexed per tenant; a crawl stops there and reports a partial count
+DATALAKE_MAX_FOLDERS = int(os.environ.get('DATALAKE_MAX_FOLDERS', 100000))
+# A folder whose listing reports no change marker is re-listed after this many seconds
+DATALAKE_FOLDER_TTL = float(os.environ.get('DATALAKE_FOLDER_TTL', 3600))
+# Every folder is re-listed at least this often, marker or not
+DATALAKE_FOLDER_MAX_AGE = float(os.environ.get('DATALAKE_FOLDER_MAX_AGE', 86400))
+# Upper bound for a single crawl; unfinished folders keep their previous totals
+DATALAKE_CRAWL_TIMEOUT = float(os.environ.get('DATALAKE_CRAWL_TIMEOUT', 300))
+# Tenant indexes kept per process; least recently used are dropped first
+DATALAKE_INDEX_MAX_TENANTS = int(os.environ.get('DATALAKE_INDEX_MAX_TENANTS', 50))
+
+
+class DataLakeError(Exception):
+    """listObjects answered with a non-200 status"""
+
+    def __init__(self, path, status_code):
+        super().__init__(f'HTTP {status_code} listing {path}')
+        self.status_code = status_code
+
+
+class IndexBuilding(Exception):
+    """The first crawl of a tenant's lake has not finished yet"""
+
+    # Not a failure of the service (see circuit_breaker.is_failure)
+    status_code = 202
+
+    def __init__(self):
+        super().__init__('Data Lake index is being built')
+
+
+class Folder:
+    """One listed folder: its own files and the markers of its direct subfolders"""
+
+    __slots__ = ('path', 'files', 'bytes', 'children', 'marker', 'listed_at', 'complete')
+
+    def __init__(self, path, files, size, children, listed_at, complete):
+        self.path = path
+        self.files = files
+        self.bytes = size
+        # child path -> change marker reported by this folder's listing (or None)
+        self.children = children
+        self.marker = None
+        self.listed_at = listed_at
+        self.complete = complete
+
+
+def _marker(entry):
+    """Whatever the listing says about when a folder last changed"""
+    return entry.get('lastModified') or entry.get('eTag') or entry.get('etag')
+
+
+def _child_path(parent, entry):
+    path = entry.get('path') or f"{parent}{entry.get('name', '')}"
+    return path if path.endswith('/') else path + '/'
+
+
+def list_folder(api_base, headers, path, timeout=None):
+    """List one folder, following pagination, and return a Folder"""
+    files = 0
+    size = 0
+    children = {}
+    token = None
+    for _ in range(DATALAKE_MAX_PAGES):
+        params = {'path': path, 'size': DATALAKE_PAGE_SIZE}
+        if token:
+            params['pageToken'] = token
+        response = upstream.get(api_base, LIST_OBJECTS_PATH, headers=headers, params=params, timeout=timeout)
+        if response.status_code != 200:
+            raise DataLakeError(path, response.status_code)
+        data = response.json()
+        objects = data.get('objects', {})
+        for entry in objects.get('files', []):
+            files += 1
+            size += entry.get('size') or 0
+        for entry in objects.get('folders', []):
+            children[_child_path(path, entry)] = _marker(entry)
+        token = data.get('page', {}).get('nextToken') or data.get('nextPageToken')
+        if not token:
+            break
+    return Folder(path, files, size, children, time.time(), complete=not token)
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Process-wide pool for listObjects calls, recreated after fork"""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(
+                    max_workers=DATALAKE_MAX_PARALLEL,
+                    thread_name_prefix='datalake-list'
+                )
+                _executor_pid = pid
+    return _executor
+
+
+class FolderIndex:
+    """Folder listings of one tenant's Data Lake, refreshed incrementally.
+
+    A refresh always lists the root. A subfolder is listed again only when
+    its change marker differs from the indexed one, when it has no marker
+    and its listing is older than DATALAKE_FOLDER_TTL, or when it is older
+    than DATALAKE_FOLDER_MAX_AGE. Unchanged subtrees are carried over
+    without any upstream call. Concurrent refreshes share one crawl.
+    """
+
+    def __init__(self):
+        self.folders = {}
+        self.totals = {}
+        self.refreshed_at = None
+        self.last_crawl = None
+        self._lock = threading.Lock()
+        self._crawl = None
+
+    def _unchanged(self, previous, marker, now):
+        if previous is None or not previous.complete:
+            return False
+        age = now - previous.listed_at
+        if age >= DATALAKE_FOLDER_MAX_AGE:
+            return False
+        if marker is not None:
+            return marker == previous.marker
+        return age < DATALAKE_FOLDER_TTL
+
+    def _carry_over(self, path, old, new):
+        """Copy an indexed folder and everything below it into the new index"""
+        stack = [path]
+        carried = 0
+        while stack:
+            folder = old.get(stack.pop())
+            if folder is None:
+                continue
+            new[folder.path] = folder
+            carried += 1
+            stack.extend(folder.children)
+        return carried
+
+    def _run_crawl(self, api_base, headers, timeout, crawl_timeout):
+        old = self.folders
+        new = {}
+        stats = {'listed': 0, 'reused': 0, 'failed': 0, 'partial': False}
+        ends_at = time.monotonic() + crawl_timeout
+        executor = get_executor()
+        pending = {executor.submit(list_folder, api_base, headers, '/', timeout): ('/', None)}
+
+        while pending:
+            remaining = ends_at - time.monotonic()
+            done, _ = wait(pending, timeout=max(remaining, 0), return_when=FIRST_COMPLETED)
+            if not done:
+                for future, (path, _) in pending.items():
+                    future.cancel()
+                    self._carry_over(path, old, new)
+                stats['partial'] = True
+                break
+            now = time.time()
+            for future in done:
+                path, marker = pending.pop(future)
+                try:
+                    folder = future.result()
+                except Exception:
+                    if path == '/':
+                        for other in pending:
+                            other.cancel()
+                        raise
+                    # Keep what we knew about this subtree rather than dropping it
+                    stats['failed'] += 1
+                    stats['partial'] = True
+                    self._carry_over(path, old, new)
+                    continue
+                folder.marker = marker
+                new[path] = folder
+                stats['listed'] += 1
+                stats['partial'] = stats['partial'] or not folder.complete
+                for child, child_marker in folder.children.items():
+                    if self._unchanged(old.get(child), child_marker, now):
+                        stats['reused'] += self._carry_over(child, old, new)
+                    elif len(new) + len(pending) >= DATALAKE_MAX_FOLDERS:
+                        stats['partial'] = True
+                    else:
+                        pending[executor.submit(list_folder, api_base, headers, child, timeout)] = (child, child_marker)
+
+        totals = _subtree_totals(new)
+        with self._lock:
+            self.folders = new
+            self.totals = totals
+            self.refreshed_at = time.time()
+            self.last_crawl = stats
+        return self.summary('/')
+
+    def refresh_async(self, api_base, headers, timeout=None, crawl_timeout=DATALAKE_CRAWL_TIMEOUT):
+        """Start a refresh in the background (or join the running one) and return its future.
+
+        The future resolves to the root summary.
+        """
+        with self._lock:
+            if self._crawl is not None:
+                return self._crawl
+            crawl = self._crawl = Future()
+
+        def run():
+            try:
+                crawl.set_result(self._run_crawl(api_base, headers, timeout, crawl_timeout))
+            except Exception as e:
+                crawl.set_exception(e)
+            finally:
+                with self._lock:
+                    self._crawl = None
+
+        threading.Thread(target=run, name='datalake-crawl', daemon=True).start()
+        return crawl
+
+    def refresh(self, api_base, headers, timeout=None, crawl_timeout=DATALAKE_CRAWL_TIMEOUT):
+        """Bring the index up to date and return the root summary"""
+        return self.refresh_async(api_base, headers, timeout, crawl_timeout).result()
+
+    def summary(self, path='/', depth=0):
+        """Totals for a folder, with per-folder breakdowns `depth` levels down"""
+        with self._lock:
+            return self._summary(path, depth)
+
+    def _summary(self, path, depth):
+        totals = self.totals.get(path)
+        if totals is None:
+            return None
+        folder = self.folders[path]
+        summary = dict(totals, path=path, listed_at=folder.listed_at)
+        if path == '/':
+            summary['refreshed_at'] = self.refreshed_at
+            summary['crawl'] = self.last_crawl
+        if depth > 0:
+            summary['children'] = [
+                child for child in (self._summary(child, depth - 1) for child in sorted(folder.children))
+                if child is not None
+            ]
+        return summary
+
+
+def _subtree_totals(folders):
+    """{path: {files, folders, objects, bytes}} including everything below each folder"""
+    totals = {}
+    # Deepest folders first, so every child is summed before its parent
+    for path in sorted(folders, key=lambda p: p.count('/'), reverse=True):
+        folder = folders[path]
+        files = folder.files
+        subfolders = 0
+        size = folder.bytes
+        for child in folder.children:
+            child_totals = totals.get(child)
+            subfolders += 1
+            if child_totals is not None:
+                files += child_totals['files']
+                subfolders += child_totals['folders']
+                size += child_totals['bytes']
+        totals[path] = {'files': files, 'folders': subfolders, 'objects': files + subfolders, 'bytes': size}
+    return totals
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def index_key(api_base, headers):
+    """Index key for the caller: the token's tenant if present, else a hash of the token"""
+    auth_header = (headers or {}).get('Authorization', '')
+    tenant = token_tenant(auth_header)
+    if tenant:
+        return (f'tenant:{tenant}', api_base)
+    return ('token:' + hashlib.sha256(auth_header.encode()).hexdigest(), api_base)
+
+
+def get_index(key):
+    """The folder index for a key, created on first use"""
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = _indexes[key] = FolderIndex()
+            while len(_indexes) > DATALAKE_INDEX_MAX_TENANTS:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(key)
+        return index
+
+
+def authorized_index(api_base, headers, timeout=None):
+    """The caller's folder index, once upstream has accepted the caller's token.
+
+    The index is keyed by the token's unverified tenant claim, so cached
+    folders are only served to a token upstream accepts (see token_check).
+    """
+    try:
+        check_token(api_base, headers, timeout)
+    except TokenRejected as e:
+        raise DataLakeError('/', e.status_code)
+    return get_index(index_key(api_base, headers))
+
+
+def count_objects(api_base, headers, timeout=None):
+    """Probe runner for the datalake metric: totals for the whole lake.
+
+    Waits at most `timeout` for the refresh, so a long crawl doesn't hold a
+    probe thread; it carries on in the background and the totals it had
+    before are returned meanwhile.
+    """
+    index = authorized_index(api_base, headers, timeout)
+    crawl = index.refresh_async(api_base, headers, timeout)
+    try:
+        summary = crawl.result(timeout=timeout)
+    except TimeoutError:
+        summary = index.summary('/')
+        if summary is None:
+            raise IndexBuilding()
+    return {
+        'objects': summary['objects'],
+        'files': summary['files'],
+        'folders': summary['folders'],
+        'bytes': summary['bytes'],
+        'partial': summary['crawl']['partial'],
+    }
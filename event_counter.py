@@ -0,0 +1,176 @@
+"""Incremental event counting: a running total advanced from a watermark, with expiring days"""
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import upstream
+from count_probe import read_count
+from datalake_index import index_key
+from token_check import check_token
+
+EVENTS_PATH = '/api/eventmanagement/v3/events'
+
+# Days counted before today (UTC); the count covers these plus today so far
+EVENT_COUNT_WINDOW_DAYS = int(os.environ.get('EVENT_COUNT_WINDOW_DAYS', 365))
+# Seconds between reconciliations, which recount the whole window in one call
+EVENT_COUNT_RECONCILE_INTERVAL = float(os.environ.get('EVENT_COUNT_RECONCILE_INTERVAL', 86400))
+# Seconds before a failed reconciliation is tried again (incremental counting carries on)
+EVENT_COUNT_RECONCILE_RETRY = float(os.environ.get('EVENT_COUNT_RECONCILE_RETRY', 300))
+# Days that may leave the window between refreshes and be subtracted one call each;
+# after a longer pause the window is recounted in a single call instead
+EVENT_COUNT_MAX_EXPIRE_DAYS = int(os.environ.get('EVENT_COUNT_MAX_EXPIRE_DAYS', 3))
+
+DAY_MS = 86400 * 1000
+
+
+class EventCountError(Exception):
+    """The events API answered a count with a non-200 status"""
+
+    def __init__(self, status_code):
+        super().__init__(f'HTTP {status_code} counting events')
+        self.status_code = status_code
+
+
+def _iso(ms):
+    return datetime.fromtimestamp(ms // 1000, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S') + f'.{ms % 1000:03d}Z'
+
+
+def count_between(api_base, headers, after_ms, before_ms, timeout=None):
+    """Events with after < timestamp <= before (epoch milliseconds)"""
+    window = {'timestamp': {'after': _iso(after_ms), 'before': _iso(before_ms)}}
+    params = {
+        'size': 1,
+        'filter': json.dumps(window, separators=(',', ':')),
+        'history': 'true',  # Include historical events
+        'includeShared': 'false'  # Only tenant's own events
+    }
+    response = upstream.get(api_base, EVENTS_PATH, headers=headers, params=params, timeout=timeout, stream=True)
+    if response.status_code != 200:
+        response.close()
+        raise EventCountError(response.status_code)
+    return read_count(response, ('page', 'totalElements'))
+
+
+class EventCounter:
+    """Running event count of one tenant over the last EVENT_COUNT_WINDOW_DAYS UTC days.
+
+    The first refresh seeds the total with one count over the whole window.
+    After that, a refresh only counts events newer than the watermark, and
+    subtracts the count of each day that has left the window (one call per
+    day, so normally one at midnight). After a pause of more than
+    EVENT_COUNT_MAX_EXPIRE_DAYS days the total is seeded again instead,
+    which is one call however long the pause. A reconciliation recounts the window
+    up to the watermark in one call every EVENT_COUNT_RECONCILE_INTERVAL
+    seconds, replacing the total. This picks up events that arrived late,
+    with timestamps behind the watermark, and reports the difference as
+    `drift`.
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.first_day = None      # UTC day number the window starts at
+        self.watermark = None      # epoch ms; every event up to here is counted
+        self.reconciled_at = None
+        self.next_reconcile = 0.0
+        self._lock = threading.Lock()
+
+    def _seed(self, api_base, headers, now_ms, first_day, timeout):
+        self.total = count_between(api_base, headers, first_day * DAY_MS - 1, now_ms, timeout)
+        self.first_day = first_day
+        self.watermark = now_ms
+
+    def _expire(self, api_base, headers, first_day, timeout):
+        """Subtract the days before `first_day`; returns the number of upstream calls"""
+        calls = 0
+        while self.first_day < first_day:
+            day = self.first_day
+            self.total -= count_between(api_base, headers, day * DAY_MS - 1, (day + 1) * DAY_MS - 1, timeout)
+            self.first_day = day + 1
+            calls += 1
+        return calls
+
+    def _advance(self, api_base, headers, now_ms, timeout):
+        """Add the events after the watermark; returns the number of upstream calls"""
+        if now_ms <= self.watermark:
+            return 0
+        self.total += count_between(api_base, headers, self.watermark, now_ms, timeout)
+        self.watermark = now_ms
+        return 1
+
+    def refresh(self, api_base, headers, timeout=None, now=None):
+        """Bring the count up to date and return it with how it was obtained"""
+        with self._lock:
+            now = time.time() if now is None else now
+            now_ms = int(now * 1000)
+            first_day = now_ms // DAY_MS - EVENT_COUNT_WINDOW_DAYS
+            drift = None
+
+            # A watermark older than the new window start has nothing left to carry over,
+            # and past a few expired days one recount is cheaper than subtracting each
+            if (self.watermark is None or self.watermark < first_day * DAY_MS - 1
+                    or first_day - self.first_day > EVENT_COUNT_MAX_EXPIRE_DAYS):
+                self._seed(api_base, headers, now_ms, first_day, timeout)
+                calls = 1
+                mode = 'seeded'
+                self.reconciled_at = now
+                self.next_reconcile = now + EVENT_COUNT_RECONCILE_INTERVAL
+            else:
+                calls = self._expire(api_base, headers, first_day, timeout)
+                calls += self._advance(api_base, headers, now_ms, timeout)
+                mode = 'incremental'
+                if now >= self.next_reconcile:
+                    try:
+                        recount = count_between(
+                            api_base, headers, self.first_day * DAY_MS - 1, self.watermark, timeout
+                        )
+                    except Exception:
+                        # The running total stands; try again later
+                        self.next_reconcile = now + EVENT_COUNT_RECONCILE_RETRY
+                    else:
+                        drift = recount - self.total
+                        self.total = recount
+                        self.reconciled_at = now
+                        self.next_reconcile = now + EVENT_COUNT_RECONCILE_INTERVAL
+                        mode = 'reconciled'
+                    calls += 1
+
+            return {
+                'count': self.total,
+                'since': _iso(self.first_day * DAY_MS),
+                'watermark': _iso(self.watermark),
+                'refresh': mode,
+                'upstream_calls': calls,
+                'reconciled_at': datetime.fromtimestamp(self.reconciled_at).isoformat(),
+                'drift': drift,
+            }
+
+
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def get_counter(key):
+    """The event counter for a tenant key, created on first use"""
+    with _counters_lock:
+        counter = _counters.get(key)
+        if counter is None:
+            counter = _counters[key] = EventCounter()
+        return counter
+
+
+def count_events(api_base, headers, timeout=None):
+    """Probe runner for the events metric.
+
+    Counters are keyed by the token's tenant (like the Data Lake index), so
+    every viewer of a tenant, and every rotation of their tokens, shares one
+    running count. It is only served once upstream has accepted the caller's
+    token (see token_check). A token without a tenant claim gets a counter
+    of its own for this refresh only: one seeding call, as before.
+    """
+    key = index_key(api_base, headers)
+    if not key[0].startswith('tenant:'):
+        return EventCounter().refresh(api_base, headers, timeout)
+    check_token(api_base, headers, timeout)
+    return get_counter(key).refresh(api_base, headers, timeout)
@@ -0,0 +1,26 @@
+"""Gunicorn settings shared by every start command (picked up automatically from the app directory)"""
+import os
+import shutil
+import tempfile
+
+# Workers write Prometheus samples here so /metrics can aggregate all of them.
+# Must be set before the app (and prometheus_client) is imported in a worker.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'flask-app-prometheus'))
+
+# Threaded workers: a dashboard holding a metrics stream open keeps one thread
+# busy, not a whole worker. gunicorn's --timeout only checks worker liveness here.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+
+
+def on_starting(server):
+    """Start every server run with an empty metrics directory"""
+    path = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):
+    """Drop live gauges of workers that have exited"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
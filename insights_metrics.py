@@ -0,0 +1,398 @@
+"""Insights Hub metric probes and the concurrent collector behind the dashboard"""
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import datalake_index
+import event_counter
+import upstream
+import upstream_async
+from count_probe import CountNotFound, read_count, read_count_async
+from circuit_breaker import get_breaker, is_failure
+
+# Per-probe upstream timeout (seconds)
+PROBE_TIMEOUT = 30
+
+# Overall deadline for one dashboard collection; must stay below gunicorn's --timeout
+METRICS_DEADLINE = float(os.environ.get('METRICS_DEADLINE', 25))
+METRICS_MAX_DEADLINE = float(os.environ.get('METRICS_MAX_DEADLINE', 110))
+
+# Upper bound on probe threads shared by all requests in this process
+METRICS_MAX_WORKERS = int(os.environ.get('METRICS_MAX_WORKERS', 20))
+
+
+# Metric descriptors, in dashboard order.
+#   key      - name of the metric in the response
+#   path     - upstream endpoint relative to the API base
+#   params   - query parameters (dict, or callable returning one per request)
+#   field    - name of the value field in the metric result
+#   count    - path of the total in the body, e.g. ('page', 'totalElements'); the
+#              body is streamed and only read until that number is parsed
+#   extract  - alternative to `count`: turns the decoded body into the metric value
+#   run      - optional; replaces the single GET: called as run(api_base, headers,
+#              timeout) and returns the result fields (including `field`)
+#   label    - optional suffix shown after the path in error messages
+#   ttl      - seconds a cached value counts as fresh (see metrics_cache)
+METRIC_PROBES = [
+    {
+        'key': 'assets',
+        'ttl': 300,
+        'path': '/api/assetmanagement/v3/assets',
+        'params': {'size': 1},
+        'field': 'count',
+        'count': ('page', 'totalElements'),
+    },
+    {
+        'key': 'agents',
+        'ttl': 300,
+        'path': '/api/assetmanagement/v3/assets',
+        'params': {'filter': '{"hasType":{"in":["core.basicagent"]}}', 'size': 1},
+        'field': 'count',
+        'count': ('page', 'totalElements'),
+        'label': '?filter={"hasType":{"in":["core.basicagent"]}}',
+    },
+    {
+        'key': 'datalake',
+        'ttl': 600,
+        'path': datalake_index.LIST_OBJECTS_PATH,
+        'params': None,
+        'field': 'objects',
+        # Whole-lake totals from the incremental folder index
+        'run': datalake_index.count_objects,
+        'label': '?path=/ (recursive)',
+    },
+    {
+        'key': 'events',
+        'ttl': 60,
+        'path': event_counter.EVENTS_PATH,
+        'params': None,
+        'field': 'count',
+        # Last EVENT_COUNT_WINDOW_DAYS days: a running total advanced from a watermark
+        'run': event_counter.count_events,
+        'label': '?filter={"timestamp":{"after":<watermark>}}',
+    },
+    {
+        'key': 'vfc_flows',
+        'ttl': 300,
+        'path': '/api/visualflowcreator/v3/flows',
+        'params': {'size': 1},
+        'field': 'count',
+        'count': ('page', 'totalElements'),
+    },
+    {
+        'key': 'dashboards',
+        'ttl': 300,
+        'path': '/api/kpidashboardconfiguration/v3/dashboards',
+        'params': {'size': 1},
+        'field': 'count',
+        'count': ('page', 'totalElements'),
+    },
+    {
+        'key': 'rules',
+        'ttl': 300,
+        'path': '/api/rulesmanagement/v4/rules',
+        'params': {'size': 1},
+        'field': 'count',
+        'count': ('page', 'totalElements'),
+    },
+    {
+        'key': 'cases',
+        'ttl': 120,
+        'path': '/api/casemanagement/v3/cases',
+        'params': {'size': 1},
+        'field': 'count',
+        'count': ('totalElements',),
+    },
+    {
+        'key': 'predictions',
+        'ttl': 600,
+        'path': '/api/oipredictapi/v3/predict-assets/all',
+        'params': {'size': 1},
+        'field': 'count',
+        'count': ('page', 'totalElements'),
+    },
+    {
+        'key': 'anomaly_detections',
+        'ttl': 600,
+        'path': '/api/oipredictapi/v3/usageDetails',
+        'params': {'requestType': 'ANOMALY'},
+        'field': 'count',
+        'count': ('page', 'totalElements'),
+        'label': '?requestType=ANOMALY',
+    },
+]
+
+PROBES_BY_KEY = {probe['key']: probe for probe in METRIC_PROBES}
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the process-wide probe thread pool, creating it after fork if needed"""
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _executor_lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(
+                    max_workers=METRICS_MAX_WORKERS,
+                    thread_name_prefix='metrics-probe'
+                )
+                _executor_pid = pid
+    return _executor
+
+
+def describe(probe, api_base):
+    """Human readable upstream call used in error messages"""
+    return f"GET {api_base}{probe['path']}{probe.get('label', '')}"
+
+
+def error_result(probe, message):
+    """Metric result for a probe that did not produce a value"""
+    return {probe['field']: 0, 'status': 'error', 'message': message}
+
+
+def degraded_result(probe, breaker):
+    """Metric result for a probe skipped because its service's circuit is open"""
+    message = f'Service degraded; retrying in {breaker.retry_in():.0f}s'
+    result = error_result(probe, message)
+    result['status'] = 'degraded'
+    return result, message
+
+
+def _record(breaker, status_code, start):
+    if is_failure(status_code):
+        breaker.record_failure()
+    else:
+        breaker.record_success(time.monotonic() - start)
+
+
+def _failed(probe, api_base, message, status_code=None):
+    result = error_result(probe, message)
+    if status_code is not None:
+        # Lets a caller tell a refused token (401/403) from a failing service
+        result['http_status'] = status_code
+    return result, f'{describe(probe, api_base)} → {message}'
+
+
+def _get_value(probe, api_base, headers, params, breaker, timeout, start):
+    """Single GET probe: (metric result, error message or None)"""
+    response = upstream.get(
+        api_base,
+        probe['path'],
+        headers=headers,
+        params=params,
+        timeout=timeout,
+        stream='count' in probe
+    )
+    _record(breaker, response.status_code, start)
+    if response.status_code == 200:
+        if 'count' in probe:
+            try:
+                value = read_count(response, probe['count'])
+            except CountNotFound as e:
+                # The service answered; the body was just too big to count
+                return _failed(probe, api_base, str(e))
+        else:
+            value = probe['extract'](response.json())
+        return {probe['field']: value, 'status': 'success'}, None
+    response.close()
+    return _failed(probe, api_base, f'HTTP {response.status_code}', response.status_code)
+
+
+async def _get_value_async(probe, api_base, headers, params, breaker, timeout, start):
+    """_get_value over the asynchronous client"""
+    async with upstream_async.stream(api_base, probe['path'], headers=headers, params=params,
+                                     timeout=timeout) as response:
+        _record(breaker, response.status_code, start)
+        if response.status_code != 200:
+            return _failed(probe, api_base, f'HTTP {response.status_code}', response.status_code)
+        if 'count' in probe:
+            try:
+                value = await read_count_async(response, probe['count'])
+            except CountNotFound as e:
+                return _failed(probe, api_base, str(e))
+        else:
+            value = probe['extract'](json.loads(await response.aread()))
+    return {probe['field']: value, 'status': 'success'}, None
+
+
+def _prepare(probe, api_base):
+    """(breaker, params, skipped): `skipped` is the outcome when the circuit is open, else None"""
+    breaker = get_breaker(api_base, probe['path'])
+    if not breaker.allow():
+        result, message = degraded_result(probe, breaker)
+        result['circuit'] = breaker.snapshot()
+        return breaker, None, (result, f'{describe(probe, api_base)} → {message}')
+    params = probe['params']
+    return breaker, params() if callable(params) else params, None
+
+
+def _probe_failed(probe, api_base, breaker, e):
+    if is_failure(getattr(e, 'status_code', 500)):
+        breaker.record_failure()
+    else:
+        # A 4xx, or work still in progress (202): no verdict, but the call is over
+        breaker.release()
+    # Some client timeouts carry no message
+    return _failed(probe, api_base, str(e) or type(e).__name__, getattr(e, 'status_code', None))
+
+
+def run_probe(probe, api_base, headers, timeout=PROBE_TIMEOUT):
+    """Run a single probe and return (metric result, error message or None)"""
+    breaker, params, skipped = _prepare(probe, api_base)
+    if skipped is not None:
+        return skipped
+    start = time.monotonic()
+    result = None
+    try:
+        if 'run' in probe:
+            fields = probe['run'](api_base, headers, breaker.timeout(timeout))
+            breaker.record_success(time.monotonic() - start)
+            result, error = dict(fields, status='success'), None
+        else:
+            result, error = _get_value(probe, api_base, headers, params, breaker, breaker.timeout(timeout), start)
+    except Exception as e:
+        result, error = _probe_failed(probe, api_base, breaker, e)
+    finally:
+        if result is None:
+            # Interrupted mid-call; a half-open circuit must not wait for this probe forever
+            breaker.release()
+    result['circuit'] = breaker.snapshot()
+    return result, error
+
+
+async def run_probe_async(probe, api_base, headers, timeout=PROBE_TIMEOUT):
+    """run_probe on the event loop; `run` probes (which block) go to a thread"""
+    breaker, params, skipped = _prepare(probe, api_base)
+    if skipped is not None:
+        return skipped
+    start = time.monotonic()
+    result = None
+    try:
+        if 'run' in probe:
+            fields = await asyncio.to_thread(probe['run'], api_base, headers, breaker.timeout(timeout))
+            breaker.record_success(time.monotonic() - start)
+            result, error = dict(fields, status='success'), None
+        else:
+            result, error = await _get_value_async(
+                probe, api_base, headers, params, breaker, breaker.timeout(timeout), start
+            )
+    except Exception as e:
+        result, error = _probe_failed(probe, api_base, breaker, e)
+    finally:
+        if result is None:
+            # Cancelled mid-call; a half-open circuit must not wait for this probe forever
+            breaker.release()
+    result['circuit'] = breaker.snapshot()
+    return result, error
+
+
+def submit_probe(probe, api_base, headers, timeout=PROBE_TIMEOUT):
+    """Schedule a probe on the shared pool and return its future"""
+    return get_executor().submit(run_probe, probe, api_base, headers, timeout)
+
+
+def submit_probe_async(probe, api_base, headers, timeout=PROBE_TIMEOUT):
+    """Schedule a probe on the running event loop; returns a concurrent future like submit_probe.
+
+    Must be called from the loop's thread. The future can be shared with
+    threaded waiters (see metrics_cache).
+    """
+    loop = asyncio.get_running_loop()
+    return asyncio.run_coroutine_threadsafe(run_probe_async(probe, api_base, headers, timeout), loop)
+
+
+def gather(futures, deadline):
+    """Wait up to `deadline` seconds for {key: future} and return {key: (result, error)}.
+
+    Futures still running when the deadline passes are reported as None. They
+    are left to finish in the background because they may be shared with other
+    waiters (see metrics_cache).
+    """
+    wait(list(futures.values()), timeout=deadline)
+    return {
+        key: future.result() if future.done() else None
+        for key, future in futures.items()
+    }
+
+
+async def gather_async(futures, deadline):
+    """gather() for use on the event loop; waits without blocking it"""
+    if futures:
+        await asyncio.wait([asyncio.wrap_future(future) for future in futures.values()], timeout=deadline)
+    return {
+        key: future.result() if future.done() else None
+        for key, future in futures.items()
+    }
+
+
+def timeout_result(probe, api_base, deadline):
+    """(result, error) pair for a probe that missed the collection deadline"""
+    message = f'Deadline of {deadline:g}s exceeded'
+    result = error_result(probe, message)
+    result['status'] = 'timeout'
+    return result, f'{describe(probe, api_base)} → {message}'
+
+
+def collect_metrics(api_base, headers, deadline=None, probes=None):
+    """Run probes concurrently and return (metrics, errors) within `deadline` seconds"""
+    if deadline is None:
+        deadline = METRICS_DEADLINE
+    if probes is None:
+        probes = METRIC_PROBES
+
+    # Nothing that finishes after the deadline is used, so don't wait longer upstream
+    timeout = min(PROBE_TIMEOUT, deadline)
+    futures = {
+        probe['key']: submit_probe(probe, api_base, headers, timeout)
+        for probe in probes
+    }
+    return _assemble(probes, gather(futures, deadline), api_base, deadline)
+
+
+async def collect_metrics_async(api_base, headers, deadline=None, probes=None):
+    """collect_metrics with every probe on the running event loop"""
+    if deadline is None:
+        deadline = METRICS_DEADLINE
+    if probes is None:
+        probes = METRIC_PROBES
+
+    timeout = min(PROBE_TIMEOUT, deadline)
+    futures = {
+        probe['key']: submit_probe_async(probe, api_base, headers, timeout)
+        for probe in probes
+    }
+    return _assemble(probes, await gather_async(futures, deadline), api_base, deadline)
+
+
+def _assemble(probes, outcomes, api_base, deadline):
+    metrics = {}
+    errors = []
+    for probe in probes:
+        outcome = outcomes[probe['key']]
+        if outcome is None:
+            outcome = timeout_result(probe, api_base, deadline)
+        result, error = outcome
+        metrics[probe['key']] = result
+        if error:
+            errors.append(error)
+    return metrics, errors
+
+
+def parse_deadline(value):
+    """Parse a `deadline` query parameter, falling back to the configured default"""
+    if value is None or value == '':
+        return METRICS_DEADLINE
+    try:
+        deadline = float(value)
+    except (TypeError, ValueError):
+        return METRICS_DEADLINE
+    if deadline <= 0:
+        return METRICS_DEADLINE
+    return min(deadline, METRICS_MAX_DEADLINE)
@@ -0,0 +1,101 @@
+"""Prometheus instrumentation for routes, upstream calls and caches.
+
+Under gunicorn, set PROMETHEUS_MULTIPROC_DIR (gunicorn.conf.py does this) so
+every worker writes its samples to shared files and /metrics aggregates them.
+"""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Upstream calls range from milliseconds to the 30 s timeout
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+REQUEST_DURATION = Histogram(
+    'app_request_duration_seconds',
+    'Time spent handling requests, per Flask route',
+    ['route', 'method'],
+    buckets=LATENCY_BUCKETS
+)
+REQUESTS = Counter(
+    'app_requests_total',
+    'Requests handled, per Flask route and status code',
+    ['route', 'method', 'status']
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'app_requests_in_flight',
+    'Requests currently being handled',
+    multiprocess_mode='livesum'
+)
+
+UPSTREAM_DURATION = Histogram(
+    'app_upstream_request_duration_seconds',
+    'Time until response headers from Insights Hub, per service and endpoint',
+    ['service', 'endpoint'],
+    buckets=LATENCY_BUCKETS
+)
+UPSTREAM_REQUESTS = Counter(
+    'app_upstream_requests_total',
+    'Insights Hub requests, per service, endpoint and status code ("error" when no response)',
+    ['service', 'endpoint', 'status']
+)
+UPSTREAM_IN_FLIGHT = Gauge(
+    'app_upstream_requests_in_flight',
+    'Insights Hub requests currently waiting for a response',
+    ['service'],
+    multiprocess_mode='livesum'
+)
+
+CIRCUIT_STATE = Gauge(
+    'app_circuit_state',
+    'Circuit breaker state per upstream service (0 closed, 1 half-open, 2 open)',
+    ['api_base', 'service'],
+    multiprocess_mode='livemax'
+)
+
+CACHE_REQUESTS = Counter(
+    'app_cache_requests_total',
+    'Cache lookups, per cache and result (hit, stale, miss)',
+    ['cache', 'result']
+)
+
+
+def upstream_service(path):
+    """Service name for an upstream path, e.g. /api/datalake/v3/listObjects -> datalake"""
+    parts = path.strip('/').split('/')
+    if len(parts) > 1 and parts[0] == 'api':
+        return parts[1]
+    return parts[0] or 'unknown'
+
+
+def observe_request(route, method, status, duration):
+    REQUEST_DURATION.labels(route, method).observe(duration)
+    REQUESTS.labels(route, method, str(status)).inc()
+
+
+def observe_upstream(path, status, duration):
+    service = upstream_service(path)
+    UPSTREAM_DURATION.labels(service, path).observe(duration)
+    UPSTREAM_REQUESTS.labels(service, path, str(status)).inc()
+
+
+def count_cache(cache, result):
+    CACHE_REQUESTS.labels(cache, result).inc()
+
+
+def render():
+    """Return (body, content type) in the Prometheus text exposition format"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
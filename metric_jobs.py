@@ -0,0 +1,185 @@
+"""Background dashboard-metrics jobs and the bounded, expiring store for their results"""
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from insights_metrics import METRIC_PROBES, PROBES_BY_KEY, PROBE_TIMEOUT, submit_probe, timeout_result
+from metrics_cache import metrics_cache, resolve
+from sqlite_connections import SqliteConnections
+
+# Finished or not, jobs disappear this many seconds after they were started
+METRIC_JOBS_TTL = float(os.environ.get('METRIC_JOBS_TTL', 300))
+# Most jobs kept at once; the oldest are dropped first
+METRIC_JOBS_MAX = int(os.environ.get('METRIC_JOBS_MAX', 1000))
+# Metrics still pending this long after the job started are reported as timed out
+METRIC_JOBS_DEADLINE = float(os.environ.get('METRIC_JOBS_DEADLINE', 110))
+
+
+class InMemoryJobStore:
+    """Jobs kept in this process only"""
+
+    def __init__(self, max_jobs=METRIC_JOBS_MAX, ttl=METRIC_JOBS_TTL):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._jobs:
+            job_id, job = next(iter(self._jobs.items()))
+            if len(self._jobs) <= self.max_jobs and job['created'] + self.ttl > now:
+                return
+            self._jobs.pop(job_id)
+
+    def create(self, job_id, owner, metric_keys):
+        now = time.time()
+        with self._lock:
+            self._jobs[job_id] = {'owner': owner, 'created': now, 'metric_keys': list(metric_keys), 'results': {}}
+            self._expire(now)
+
+    def record(self, job_id, metric_key, result, error):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job['results'][metric_key] = (result, error)
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire(time.time())
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return dict(job, results=dict(job['results']))
+
+
+class SqliteJobStore:
+    """Jobs in a SQLite database, so any gunicorn worker can answer a poll"""
+
+    _SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS metric_jobs ('
+        ' id TEXT PRIMARY KEY,'
+        ' owner TEXT NOT NULL,'
+        ' created REAL NOT NULL,'
+        ' metric_keys TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS idx_metric_jobs_created ON metric_jobs (created)',
+        'CREATE TABLE IF NOT EXISTS metric_job_results ('
+        ' job_id TEXT NOT NULL,'
+        ' metric_key TEXT NOT NULL,'
+        ' result TEXT NOT NULL,'
+        ' error TEXT,'
+        ' PRIMARY KEY (job_id, metric_key))',
+    )
+    _CREATE = 'INSERT INTO metric_jobs (id, owner, created, metric_keys) VALUES (?, ?, ?, ?)'
+    _RECORD = 'INSERT OR REPLACE INTO metric_job_results (job_id, metric_key, result, error) VALUES (?, ?, ?, ?)'
+    _GET = 'SELECT owner, created, metric_keys FROM metric_jobs WHERE id = ? AND created > ?'
+    _RESULTS = 'SELECT metric_key, result, error FROM metric_job_results WHERE job_id = ?'
+    # Jobs past their TTL, plus everything beyond the newest `max_jobs`
+    _PRUNE_JOBS = ('DELETE FROM metric_jobs WHERE created <= ? OR id IN '
+                   '(SELECT id FROM metric_jobs ORDER BY created DESC LIMIT -1 OFFSET ?)')
+    _PRUNE_RESULTS = 'DELETE FROM metric_job_results WHERE job_id NOT IN (SELECT id FROM metric_jobs)'
+
+    def __init__(self, path, max_jobs=METRIC_JOBS_MAX, ttl=METRIC_JOBS_TTL, busy_timeout=5.0):
+        self.path = path
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.busy_timeout = busy_timeout
+        self._connections = SqliteConnections(path, busy_timeout, self._SCHEMA)
+
+    def create(self, job_id, owner, metric_keys):
+        conn = self._connections.get()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(self._CREATE, (job_id, owner, now, json.dumps(list(metric_keys))))
+            conn.execute(self._PRUNE_JOBS, (now - self.ttl, self.max_jobs))
+            conn.execute(self._PRUNE_RESULTS)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def record(self, job_id, metric_key, result, error):
+        self._connections.get().execute(self._RECORD, (job_id, metric_key, json.dumps(result), error))
+
+    def get(self, job_id):
+        conn = self._connections.get()
+        row = conn.execute(self._GET, (job_id, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return None
+        owner, created, metric_keys = row
+        results = {
+            metric_key: (json.loads(result), error)
+            for metric_key, result, error in conn.execute(self._RESULTS, (job_id,))
+        }
+        return {'owner': owner, 'created': created, 'metric_keys': json.loads(metric_keys), 'results': results}
+
+
+def create_job_store(backend='sqlite', path='jobs.db'):
+    """Build the job store selected by configuration"""
+    if backend == 'memory':
+        return InMemoryJobStore()
+    if backend == 'sqlite':
+        return SqliteJobStore(path)
+    raise ValueError(f'Unknown job backend: {backend}')
+
+
+def start_job(store, owner, api_base, headers, key=None, probes=None):
+    """Start collecting metrics in the background and return the new job id.
+
+    With a cache key, cached metrics are recorded immediately and the rest
+    join (or start) the cache's upstream fetches; otherwise every probe runs.
+    """
+    if probes is None:
+        probes = METRIC_PROBES
+    job_id = uuid.uuid4().hex
+    store.create(job_id, owner, [probe['key'] for probe in probes])
+
+    if key:
+        started = metrics_cache.start(key, api_base, headers, PROBE_TIMEOUT, probes)
+    else:
+        started = {
+            probe['key']: (None, submit_probe(probe, api_base, headers, PROBE_TIMEOUT), None)
+            for probe in probes
+        }
+
+    for probe in probes:
+        result, future, entry = started[probe['key']]
+        if result is not None:
+            store.record(job_id, probe['key'], result, None)
+            continue
+
+        def done(f, probe=probe, entry=entry):
+            result, error = resolve(probe, f.result(), entry)
+            store.record(job_id, probe['key'], result, error)
+
+        future.add_done_callback(done)
+    return job_id
+
+
+def job_status(job, api_base, deadline=METRIC_JOBS_DEADLINE):
+    """Metrics finished so far, per-metric progress and whether the job is complete"""
+    expired = time.time() - job['created'] > deadline
+    metrics = {}
+    progress = {}
+    errors = []
+    for metric_key in job['metric_keys']:
+        outcome = job['results'].get(metric_key)
+        if outcome is None and expired:
+            outcome = timeout_result(PROBES_BY_KEY[metric_key], api_base, deadline)
+        if outcome is None:
+            progress[metric_key] = 'pending'
+            continue
+        result, error = outcome
+        progress[metric_key] = 'done'
+        metrics[metric_key] = result
+        if error:
+            errors.append(error)
+    return {
+        'complete': all(state == 'done' for state in progress.values()),
+        'progress': progress,
+        'metrics': metrics,
+        'errors': errors if errors else None,
+    }
@@ -0,0 +1,251 @@
+"""Per-tenant cache for dashboard metrics with stale-while-revalidate and request coalescing"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import instrumentation
+from insights_metrics import (
+    METRIC_PROBES,
+    METRICS_DEADLINE,
+    PROBE_TIMEOUT,
+    gather,
+    gather_async,
+    submit_probe,
+    submit_probe_async,
+    timeout_result,
+)
+from metrics_history import metrics_history
+from token_check import check_tenant
+
+# How long past its TTL a value may still be served while it is refreshed (seconds)
+METRICS_CACHE_STALE = float(os.environ.get('METRICS_CACHE_STALE', 3600))
+# Bounds on what the cache may hold; least recently used tenants are evicted first
+METRICS_CACHE_MAX_KEYS = int(os.environ.get('METRICS_CACHE_MAX_KEYS', 1000))
+METRICS_CACHE_MAX_BYTES = int(os.environ.get('METRICS_CACHE_MAX_BYTES', 4 * 1024 * 1024))
+
+# Rough per-value bookkeeping cost added to the serialized result size
+_ENTRY_OVERHEAD = 200
+
+
+def _entry_size(result):
+    return len(json.dumps(result)) + _ENTRY_OVERHEAD
+
+
+class MetricsCache:
+    """Caches metric results per (tenant, API base) key.
+
+    Fresh values are served directly. Values past their TTL but within the
+    stale window are served while a single background refresh runs. Missing
+    or expired values are fetched, and concurrent fetches of the same metric
+    share one upstream request.
+    """
+
+    def __init__(self, max_keys=METRICS_CACHE_MAX_KEYS, max_bytes=METRICS_CACHE_MAX_BYTES,
+                 stale=METRICS_CACHE_STALE):
+        self.max_keys = max_keys
+        self.max_bytes = max_bytes
+        self.stale = stale
+        self._lock = threading.Lock()
+        # key -> {metric key: (result, fetched_at, size)}
+        self._entries = OrderedDict()
+        # (key, metric key) -> future of (result, error)
+        self._inflight = {}
+        self._bytes = 0
+
+    def _lookup(self, key, metric_key):
+        with self._lock:
+            metrics = self._entries.get(key)
+            if metrics is None:
+                return None
+            self._entries.move_to_end(key)
+            return metrics.get(metric_key)
+
+    def _store(self, key, metric_key, result):
+        size = _entry_size(result)
+        with self._lock:
+            metrics = self._entries.get(key)
+            if metrics is None:
+                metrics = self._entries[key] = {}
+            previous = metrics.get(metric_key)
+            if previous is not None:
+                self._bytes -= previous[2]
+            metrics[metric_key] = (result, time.time(), size)
+            self._bytes += size
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_keys or self._bytes > self.max_bytes):
+            _, metrics = self._entries.popitem(last=False)
+            self._bytes -= sum(entry[2] for entry in metrics.values())
+
+    def _fetch(self, key, probe, api_base, headers, timeout, submit):
+        """Start (or join) the upstream fetch of one metric for a key"""
+        inflight_key = (key, probe['key'])
+        with self._lock:
+            future = self._inflight.get(inflight_key)
+            if future is not None:
+                return future
+            future = submit(probe, api_base, headers, timeout)
+            self._inflight[inflight_key] = future
+
+        def done(f):
+            # Store before dropping the in-flight marker so no caller sees neither
+            result, error = f.result()
+            if error is None:
+                # Circuit state describes the call, not the value; don't cache it
+                self._store(key, probe['key'], {k: v for k, v in result.items() if k != 'circuit'})
+            with self._lock:
+                self._inflight.pop(inflight_key, None)
+            if error is None:
+                # Every value fetched upstream becomes a point in the tenant's history
+                metrics_history.record(key, probe['key'], result[probe['field']])
+
+        future.add_done_callback(done)
+        return future
+
+    def start(self, key, api_base, headers, timeout=PROBE_TIMEOUT, probes=None, refresh=False,
+              submit=submit_probe):
+        """Look up every probe and start fetches for those that need one.
+
+        Returns {metric key: (result or None, future or None, last-known entry)}.
+        Cached metrics come back with a finished result; the others with the
+        (possibly shared) future of their upstream fetch. Stale metrics come
+        back with both: the stale result and the future of its refresh.
+        `submit` starts a fetch: submit_probe (thread pool) or
+        submit_probe_async (running event loop).
+        """
+        if probes is None:
+            probes = METRIC_PROBES
+        now = time.time()
+        started = {}
+        for probe in probes:
+            entry = self._lookup(key, probe['key'])
+            if entry is not None and not refresh:
+                result, fetched_at, _ = entry
+                age = now - fetched_at
+                if age < probe['ttl']:
+                    instrumentation.count_cache('metrics', 'hit')
+                    started[probe['key']] = (with_cache_info(result, True, False, age), None, entry)
+                    continue
+                if age < probe['ttl'] + self.stale:
+                    instrumentation.count_cache('metrics', 'stale')
+                    started[probe['key']] = (
+                        with_cache_info(result, True, True, age),
+                        self._fetch(key, probe, api_base, headers, timeout, submit),
+                        entry
+                    )
+                    continue
+            instrumentation.count_cache('metrics', 'miss')
+            started[probe['key']] = (None, self._fetch(key, probe, api_base, headers, timeout, submit), entry)
+        return started
+
+    def get_metrics(self, key, api_base, headers, deadline=None, probes=None, refresh=False):
+        """Return (metrics, errors) for a key, using cached values where possible.
+
+        Every metric carries a `cache` object telling whether it was served from
+        the cache, whether it was stale and how old it is in seconds.
+        """
+        if deadline is None:
+            deadline = METRICS_DEADLINE
+        if probes is None:
+            probes = METRIC_PROBES
+        started = self.start(key, api_base, headers, min(PROBE_TIMEOUT, deadline), probes, refresh)
+        futures = _awaited(started)
+        outcomes = gather(futures, deadline) if futures else {}
+        return _assemble(probes, started, outcomes, api_base, deadline)
+
+    async def get_metrics_async(self, key, api_base, headers, deadline=None, probes=None, refresh=False):
+        """get_metrics for the event loop; fetches run on it and are shared like threaded ones"""
+        if deadline is None:
+            deadline = METRICS_DEADLINE
+        if probes is None:
+            probes = METRIC_PROBES
+        started = self.start(key, api_base, headers, min(PROBE_TIMEOUT, deadline), probes, refresh,
+                             submit=submit_probe_async)
+        outcomes = await gather_async(_awaited(started), deadline)
+        return _assemble(probes, started, outcomes, api_base, deadline)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'keys': len(self._entries),
+                'bytes': self._bytes,
+                'inflight': len(self._inflight),
+                'max_keys': self.max_keys,
+                'max_bytes': self.max_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+metrics_cache = MetricsCache()
+
+
+def _awaited(started):
+    """{metric key: future} for the metrics that have no result to serve yet"""
+    return {
+        metric_key: future
+        for metric_key, (result, future, _) in started.items()
+        if result is None
+    }
+
+
+def _assemble(probes, started, outcomes, api_base, deadline):
+    metrics = {}
+    errors = []
+    for probe in probes:
+        result, future, entry = started[probe['key']]
+        if result is not None:
+            metrics[probe['key']] = result
+            continue
+        outcome = outcomes[probe['key']]
+        if outcome is None:
+            outcome = timeout_result(probe, api_base, deadline)
+        result, error = resolve(probe, outcome, entry)
+        metrics[probe['key']] = result
+        if error:
+            errors.append(error)
+    return metrics, errors
+
+
+def with_cache_info(result, hit, stale, age):
+    return dict(result, cache={'hit': hit, 'stale': stale, 'age': round(age, 3)})
+
+
+def resolve(probe, outcome, entry):
+    """Final (result, error) for a fetched metric, given its last-known cache entry.
+
+    When the probe was skipped because the service's circuit is open, the
+    last value seen for this tenant is served instead, however old it is.
+    """
+    result, error = outcome
+    if result['status'] == 'degraded' and entry is not None:
+        value, fetched_at, _ = entry
+        result = dict(result, **{probe['field']: value[probe['field']]})
+        return with_cache_info(result, True, True, time.time() - fetched_at), error
+    return with_cache_info(result, False, False, 0), error
+
+
+def cache_key(tenant, api_base):
+    """Cache key for a tenant on an API base, or None when the tenant is unknown"""
+    if not tenant:
+        return None
+    return (tenant, api_base)
+
+
+def authorized_key(tenant, api_base, headers, timeout=PROBE_TIMEOUT):
+    """cache_key, once the caller's token is confirmed to belong to `tenant`.
+
+    Raises token_check.TokenRejected otherwise, so a tenant's cached
+    metrics are never served to a token from another tenant.
+    """
+    key = cache_key(tenant, api_base)
+    if key is not None:
+        check_tenant(api_base, headers, tenant, timeout)
+    return key
@@ -0,0 +1,373 @@
+"""Compact per-tenant time series of dashboard metrics, with hourly and daily rollups.
+
+Every tenant has one fixed-size block of doubles: for each metric, a ring
+buffer per tier (raw samples, hourly and daily buckets) of
+(time, last value, min, max) points. With METRICS_HISTORY_DIR set the
+blocks are memory-mapped (sparse) files, so all gunicorn workers share them
+and history survives restarts; otherwise they are private anonymous
+mappings in process memory. Either way, pages of a block take memory only
+once points are written to them.
+"""
+import contextlib
+import hashlib
+import json
+import math
+import mmap
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+
+from insights_metrics import METRIC_PROBES
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on POSIX
+    fcntl = None
+
+# Directory for the memory-mapped history files; empty keeps history in memory
+METRICS_HISTORY_DIR = os.environ.get('METRICS_HISTORY_DIR', '')
+# Points kept per metric in each tier
+METRICS_HISTORY_RAW_POINTS = int(os.environ.get('METRICS_HISTORY_RAW_POINTS', 360))
+METRICS_HISTORY_HOURLY_POINTS = int(os.environ.get('METRICS_HISTORY_HOURLY_POINTS', 24 * 31))
+METRICS_HISTORY_DAILY_POINTS = int(os.environ.get('METRICS_HISTORY_DAILY_POINTS', 400))
+# Tenants whose history is held open (in memory mode, the others' history is dropped)
+METRICS_HISTORY_MAX_TENANTS = int(os.environ.get('METRICS_HISTORY_MAX_TENANTS', 100))
+# History files kept in METRICS_HISTORY_DIR; the least recently used beyond this are deleted
+METRICS_HISTORY_MAX_FILES = int(os.environ.get('METRICS_HISTORY_MAX_FILES', 1000))
+
+# (name, bucket width in seconds or 0 for every sample, capacity), finest first
+TIERS = (
+    ('raw', 0, METRICS_HISTORY_RAW_POINTS),
+    ('hourly', 3600, METRICS_HISTORY_HOURLY_POINTS),
+    ('daily', 86400, METRICS_HISTORY_DAILY_POINTS),
+)
+TIER_NAMES = [name for name, _, _ in TIERS]
+METRIC_KEYS = [probe['key'] for probe in METRIC_PROBES]
+_METRIC_INDEX = {key: i for i, key in enumerate(METRIC_KEYS)}
+
+_POINT = 4  # doubles per point: time, last value, min, max
+_MAGIC = b'MHIST001'
+# Files written with other metrics or capacities are reset rather than misread
+_LAYOUT = hashlib.sha256(json.dumps([METRIC_KEYS, TIERS]).encode()).digest()[:8]
+_RINGS = len(METRIC_KEYS) * len(TIERS)
+_HEADER = len(_MAGIC) + len(_LAYOUT)
+_DATA = _HEADER + 8 * _RINGS  # per-ring write counters come first
+_OFFSETS = []  # ring -> index of its first double in the data area
+_offset = 0
+for _ in METRIC_KEYS:
+    for _, _, capacity in TIERS:
+        _OFFSETS.append(_offset)
+        _offset += capacity * _POINT
+SIZE = _DATA + _offset * 8
+
+
+def _new_block():
+    if hasattr(mmap, 'MAP_PRIVATE'):
+        # Zero pages are only backed once written; private, so a forked worker gets its own copy
+        block = mmap.mmap(-1, SIZE, flags=mmap.MAP_PRIVATE)
+    else:  # pragma: no cover - not on POSIX
+        block = bytearray(SIZE)
+    block[:_HEADER] = _MAGIC + _LAYOUT
+    return block
+
+
+class TenantHistory:
+    """The rings of one tenant, over a bytearray or a shared memory-mapped file"""
+
+    def __init__(self, block, fd=None):
+        self._block = block
+        self._fd = fd
+        self._lock = threading.Lock()
+        self._closed = False
+        view = memoryview(block)
+        self._counts = view[_HEADER:_DATA].cast('q')
+        self._data = view[_DATA:SIZE].cast('d')
+
+    @classmethod
+    def open(cls, path, create=True):
+        """Map the history file at `path`; None if it does not exist and `create` is false"""
+        flags = os.O_RDWR | (os.O_CREAT if create else 0)
+        try:
+            fd = os.open(path, flags, 0o644)
+        except FileNotFoundError:
+            return None
+        # The modification time tells METRICS_HISTORY_MAX_FILES pruning when a tenant was last used
+        os.utime(fd)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                header = os.pread(fd, _HEADER, 0)
+                if os.fstat(fd).st_size != SIZE or header != _MAGIC + _LAYOUT:
+                    os.ftruncate(fd, 0)
+                    os.ftruncate(fd, SIZE)
+                    os.pwrite(fd, _MAGIC + _LAYOUT, 0)
+                block = mmap.mmap(fd, SIZE)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+        except BaseException:
+            os.close(fd)
+            raise
+        return cls(block, fd)
+
+    def close(self):
+        # Under the lock, so a caller still holding this history after eviction finds it closed
+        with self._lock:
+            self._closed = True
+            self._counts.release()
+            self._data.release()
+            if isinstance(self._block, mmap.mmap):
+                self._block.close()
+            if self._fd is not None:
+                os.close(self._fd)
+
+    @contextlib.contextmanager
+    def _locked(self, exclusive):
+        """The thread lock, plus an flock on the file so other workers are excluded too"""
+        with self._lock:
+            shared = self._fd is not None and fcntl is not None and not self._closed
+            if shared:
+                fcntl.flock(self._fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                if shared:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _append(self, ring, point):
+        n = self._counts[ring]
+        capacity = TIERS[ring % len(TIERS)][2]
+        start = _OFFSETS[ring] + (n % capacity) * _POINT
+        self._data[start:start + _POINT] = array('d', point)
+        # Counter last: a reader never sees a point that is not fully written
+        self._counts[ring] = n + 1
+
+    def record(self, metric, value, at):
+        """Add a sample of `metric` taken at `at` (epoch seconds)"""
+        value = float(value)
+        first_ring = _METRIC_INDEX[metric] * len(TIERS)
+        with self._locked(True):
+            if self._closed:
+                return
+            for i, (_, width, capacity) in enumerate(TIERS):
+                ring = first_ring + i
+                if not width:
+                    self._append(ring, (at, value, value, value))
+                    continue
+                bucket = at - at % width
+                n = self._counts[ring]
+                if n:
+                    start = _OFFSETS[ring] + ((n - 1) % capacity) * _POINT
+                    latest = self._data[start]
+                    if bucket == latest:
+                        data = self._data
+                        data[start + 1] = value
+                        data[start + 2] = min(data[start + 2], value)
+                        data[start + 3] = max(data[start + 3], value)
+                        continue
+                    if bucket < latest:
+                        # A late sample from another worker; its bucket has moved on
+                        continue
+                self._append(ring, (bucket, value, value, value))
+
+    def points(self, metric, tier, since=None, until=None):
+        """(complete, [(time, last, min, max), ...]) oldest first.
+
+        `complete` tells whether the ring still holds every point it was given.
+        """
+        i = TIER_NAMES.index(tier)
+        ring = _METRIC_INDEX[metric] * len(TIERS) + i
+        capacity = TIERS[i][2]
+        with self._locked(False):
+            if self._closed:
+                return True, []
+            n = self._counts[ring]
+            base = _OFFSETS[ring]
+            data = self._data
+            points = []
+            for k in range(max(n - capacity, 0), n):
+                start = base + (k % capacity) * _POINT
+                point = tuple(data[start:start + _POINT])
+                if (since is None or point[0] >= since) and (until is None or point[0] <= until):
+                    points.append(point)
+        return n <= capacity, points
+
+
+def _file_name(key):
+    return hashlib.sha256(json.dumps(list(key)).encode()).hexdigest()[:32] + '.hist'
+
+
+class MetricsHistory:
+    """Per-tenant histories, keyed like metrics_cache (tenant, API base)"""
+
+    def __init__(self, directory=METRICS_HISTORY_DIR, max_tenants=METRICS_HISTORY_MAX_TENANTS,
+                 max_files=METRICS_HISTORY_MAX_FILES):
+        self.directory = directory
+        self.max_tenants = max_tenants
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        self._tenants = OrderedDict()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _get(self, key, create):
+        with self._lock:
+            history = self._tenants.get(key)
+            if history is not None:
+                self._tenants.move_to_end(key)
+                return history
+            if self.directory:
+                path = os.path.join(self.directory, _file_name(key))
+                new_file = create and not os.path.exists(path)
+                history = TenantHistory.open(path, create)
+                if new_file:
+                    self._prune_files()
+            elif create:
+                history = TenantHistory(_new_block())
+            if history is None:
+                return None
+            self._tenants[key] = history
+            while len(self._tenants) > self.max_tenants:
+                _, evicted = self._tenants.popitem(last=False)
+                evicted.close()
+            return history
+
+    def _prune_files(self):
+        """Delete the least recently used history files beyond METRICS_HISTORY_MAX_FILES"""
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith('.hist'):
+                    try:
+                        files.append((entry.stat().st_mtime, entry.path))
+                    except FileNotFoundError:
+                        continue
+        if len(files) <= self.max_files:
+            return
+        open_paths = {os.path.join(self.directory, _file_name(key)) for key in self._tenants}
+        files.sort()
+        for _, path in files[:len(files) - self.max_files]:
+            if path in open_paths:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass  # Another worker pruned it first
+
+    def record(self, key, metric, value, at=None):
+        """Record one fetched metric value for a tenant"""
+        if metric not in _METRIC_INDEX or not isinstance(value, (int, float)) or isinstance(value, bool):
+            return
+        if str(key[0]).startswith('token:'):
+            # Tenantless callers are keyed by a token hash, which changes with every
+            # rotation; each would leave a block (and a file) behind
+            return
+        self._get(key, True).record(metric, value, time.time() if at is None else at)
+
+    def query(self, key, metrics, window, resolution='auto', now=None):
+        """Points and change over the last `window` seconds for each metric.
+
+        `resolution` is a tier name, or `auto` for the finest tier that covers
+        the window (or everything recorded, if that is less).
+        """
+        now = time.time() if now is None else now
+        since = now - window
+        history = self._get(key, False)
+        if history is None:
+            return resolution if resolution != 'auto' else 'raw', {metric: _series([]) for metric in metrics}
+
+        if resolution == 'auto':
+            resolution = TIER_NAMES[-1]
+            for tier in TIER_NAMES:
+                covered = True
+                for metric in metrics:
+                    complete, points = history.points(metric, tier)
+                    if not complete and (not points or points[0][0] > since):
+                        covered = False
+                        break
+                if covered:
+                    resolution = tier
+                    break
+        return resolution, {
+            metric: _series(history.points(metric, resolution, since, now)[1], resolution != 'raw')
+            for metric in metrics
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                'tenants': len(self._tenants),
+                'max_tenants': self.max_tenants,
+                'directory': self.directory or None,
+                'max_files': self.max_files if self.directory else None,
+                'bytes_per_tenant': SIZE,
+            }
+
+    def reset(self):
+        with self._lock:
+            for history in self._tenants.values():
+                history.close()
+            self._tenants.clear()
+
+    def _after_fork(self):
+        """A child must not share the parent's file locks; in-memory blocks are its own copy"""
+        self._lock = threading.Lock()
+        if self.directory:
+            self._tenants = OrderedDict()
+        for history in self._tenants.values():
+            history._lock = threading.Lock()
+
+
+def _number(value):
+    return int(value) if value.is_integer() else value
+
+
+def _iso(t):
+    # Local time, like every other timestamp the app returns
+    return datetime.fromtimestamp(t).isoformat()
+
+
+def _series(points, rolled_up=False):
+    """Response form of one metric's points, with the latest value and the change over them"""
+    if rolled_up:
+        out = [
+            {'timestamp': _iso(t), 'value': _number(last), 'min': _number(low), 'max': _number(high)}
+            for t, last, low, high in points
+        ]
+    else:
+        out = [{'timestamp': _iso(t), 'value': _number(last)} for t, last, _, _ in points]
+    series = {'points': out, 'latest': None, 'change': None}
+    if points:
+        first, last = points[0][1], points[-1][1]
+        series['latest'] = out[-1]
+        series['change'] = {
+            'absolute': _number(last - first),
+            'percent': round((last - first) / first * 100, 2) if first else None,
+            'since': out[0]['timestamp'],
+        }
+    return series
+
+
+_WINDOW_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parse_window(value, default=7 * 86400):
+    """Seconds in a window such as `30d`, `12h`, `90m` or `3600`; ValueError if malformed"""
+    if not value:
+        return default
+    unit = _WINDOW_UNITS.get(value[-1].lower())
+    seconds = float(value[:-1]) * unit if unit else float(value)
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError(f'Invalid window: {value}')
+    return seconds
+
+
+metrics_history = MetricsHistory()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=metrics_history._after_fork)
@@ -0,0 +1,313 @@
+"""Shared background pollers that push dashboard-metric changes to Server-Sent Events subscribers"""
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from insights_metrics import METRIC_PROBES, PROBE_TIMEOUT
+from metrics_cache import metrics_cache, resolve
+
+# Seconds between keep-alive comments; also how quickly a closed connection is noticed
+METRICS_STREAM_HEARTBEAT = float(os.environ.get('METRICS_STREAM_HEARTBEAT', 15))
+# Streams are closed after this many seconds and the browser reconnects, which
+# picks up a fresh Authorization header and stays under the gateway's proxy timeout
+METRICS_STREAM_MAX_AGE = float(os.environ.get('METRICS_STREAM_MAX_AGE', 100))
+# How soon a metric that failed is polled again (never later than its TTL)
+METRICS_STREAM_ERROR_RETRY = float(os.environ.get('METRICS_STREAM_ERROR_RETRY', 30))
+# Events buffered per subscriber; a subscriber that falls this far behind is dropped
+METRICS_STREAM_QUEUE_SIZE = int(os.environ.get('METRICS_STREAM_QUEUE_SIZE', 100))
+
+# Milliseconds the browser waits before reconnecting
+_RETRY_MS = 3000
+# Upstream answers meaning the poller's token was refused, not that the service failed
+_TOKEN_REFUSED = (401, 403)
+
+
+def _fingerprint(probe, result):
+    """The part of a result worth pushing; cache age and circuit details change constantly"""
+    return result.get('status'), result.get(probe['field'])
+
+
+class Subscription:
+    """One connected browser: its upstream headers and a bounded queue of pending events.
+
+    `notify`, when given, is called from the poller's thread after every push
+    (ASGI mode uses it to wake the connection's coroutine).
+    """
+
+    def __init__(self, headers, notify=None):
+        self.headers = headers
+        self.joined = time.monotonic()
+        self.events = queue.Queue(maxsize=METRICS_STREAM_QUEUE_SIZE)
+        self.closed = False
+        self._notify = notify
+
+    def push(self, event):
+        """Queue an event; returns False when the subscriber is too far behind"""
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            self.closed = True
+            return False
+        if self._notify is not None:
+            self._notify()
+        return True
+
+
+class MetricsPoller:
+    """Polls every metric of one (tenant, API base) key on its own schedule.
+
+    A metric is polled again once its cached value reaches its TTL, so
+    upstream traffic follows the number of keys, not the number of viewers.
+    Polls go through the metrics cache and share fetches with the regular
+    dashboard endpoints. Only results whose status or value changed are
+    pushed. The thread exits when the last subscriber leaves.
+
+    Polls use the token of a connected subscriber, the newest one by
+    preference. When that subscriber leaves, or upstream refuses its token,
+    the poller moves on to another subscriber's token.
+    """
+
+    def __init__(self, key, api_base, probes=None):
+        self.key = key
+        self.api_base = api_base
+        self.headers = None
+        self.probes = probes if probes is not None else METRIC_PROBES
+        self.subscribers = set()
+        # Authorization headers upstream has refused
+        self._refused = set()
+        # metric key -> (fingerprint, event) of the last pushed result
+        self._latest = {}
+        self._due = {probe['key']: 0.0 for probe in self.probes}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'metrics-poller-{key[0]}', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _live_headers(self):
+        """Headers of the newest subscriber whose token upstream hasn't refused; None if there is none"""
+        usable = [subscription for subscription in self.subscribers
+                  if subscription.headers.get('Authorization') not in self._refused]
+        if not usable:
+            return None
+        return max(usable, key=lambda subscription: subscription.joined).headers
+
+    def add(self, subscription):
+        """Register a subscriber and queue the latest known value of every metric"""
+        with self._lock:
+            self.subscribers.add(subscription)
+            # The newest token wins; older ones expire first
+            self.headers = self._live_headers()
+            for _, event in self._latest.values():
+                subscription.push(event)
+
+    def discard(self, subscription):
+        with self._lock:
+            self.subscribers.discard(subscription)
+            if subscription.headers is self.headers:
+                # Never keep polling with the token of a viewer who has left
+                self.headers = self._live_headers()
+        self._wake.set()
+
+    def _refuse(self, headers):
+        """Stop using a token upstream refused; False when no subscriber has a usable one.
+
+        Subscribers left without a usable token are closed, so their
+        browsers reconnect with fresh tokens.
+        """
+        with self._lock:
+            self._refused.add(headers.get('Authorization'))
+            if self.headers is headers:
+                self.headers = self._live_headers()
+            if self.headers is None:
+                for subscription in self.subscribers:
+                    subscription.closed = True
+                self.subscribers.clear()
+                return False
+            return True
+
+    def _publish(self, probe, result, error):
+        fingerprint = _fingerprint(probe, result)
+        event = {'key': probe['key'], 'metric': result, 'error': error,
+                 'timestamp': datetime.now().isoformat()}
+        with self._lock:
+            previous = self._latest.get(probe['key'])
+            if previous is not None and previous[0] == fingerprint:
+                return
+            self._latest[probe['key']] = (fingerprint, event)
+            for subscription in list(self.subscribers):
+                if not subscription.push(event):
+                    self.subscribers.discard(subscription)
+
+    def _poll(self, probe):
+        with self._lock:
+            headers = self.headers
+        if headers is None:
+            return
+        result, future, entry = metrics_cache.start(
+            self.key, self.api_base, headers, PROBE_TIMEOUT, [probe]
+        )[probe['key']]
+        if result is not None:
+            self._publish(probe, result, None)
+        if future is None:
+            # Fresh in the cache; come back when it expires
+            self._due[probe['key']] = entry[1] + probe['ttl']
+            return
+        self._pending.add(probe['key'])
+
+        def done(f):
+            result, error = resolve(probe, f.result(), entry)
+            if result.get('http_status') in _TOKEN_REFUSED and self._refuse(headers):
+                # Not news to the subscribers; poll again straight away with another one's token
+                retry = 0.0
+            else:
+                self._publish(probe, result, error)
+                retry = probe['ttl'] if error is None else min(probe['ttl'], METRICS_STREAM_ERROR_RETRY)
+            self._due[probe['key']] = time.time() + retry
+            self._pending.discard(probe['key'])
+            self._wake.set()
+
+        future.add_done_callback(done)
+
+    def _run(self):
+        try:
+            self._loop()
+        finally:
+            # Whatever ended the loop, later subscribers get a new poller
+            with _pollers_lock:
+                if _pollers.get(self.key) is self:
+                    del _pollers[self.key]
+                with self._lock:
+                    for subscription in self.subscribers:
+                        subscription.closed = True
+
+    def _loop(self):
+        while True:
+            with _pollers_lock:
+                with self._lock:
+                    if not self.subscribers:
+                        # Unregister while still holding the lock so no one joins a finished poller
+                        if _pollers.get(self.key) is self:
+                            del _pollers[self.key]
+                        return
+            self._wake.clear()
+            now = time.time()
+            for probe in self.probes:
+                if probe['key'] not in self._pending and self._due[probe['key']] <= now:
+                    self._poll(probe)
+            waiting = [self._due[key] for key in self._due if key not in self._pending]
+            delay = min(waiting) - time.time() if waiting else METRICS_STREAM_HEARTBEAT
+            self._wake.wait(max(delay, 0.0))
+
+
+_pollers = {}
+_pollers_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """Poller threads do not survive fork; forget the parent's pollers"""
+    global _pollers, _pollers_lock
+    _pollers = {}
+    _pollers_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def subscribe(key, api_base, headers, notify=None):
+    """Subscribe to a key's metrics, starting its poller if none is running"""
+    subscription = Subscription(headers, notify)
+    with _pollers_lock:
+        poller = _pollers.get(key)
+        if poller is None:
+            poller = _pollers[key] = MetricsPoller(key, api_base)
+            poller.add(subscription)
+            poller.start()
+        else:
+            poller.add(subscription)
+    return poller, subscription
+
+
+def _format(event):
+    return f'event: metric\ndata: {json.dumps(event)}\n\n'
+
+
+def events(key, api_base, headers, max_age=METRICS_STREAM_MAX_AGE, heartbeat=METRICS_STREAM_HEARTBEAT):
+    """Server-Sent Events for a key until the client leaves or `max_age` passes.
+
+    Subscribes lazily, so nothing is registered until the response is iterated.
+    """
+    poller, subscription = subscribe(key, api_base, headers)
+    try:
+        yield f'retry: {_RETRY_MS}\n\n'
+        ends_at = time.monotonic() + max_age
+        while not subscription.closed:
+            remaining = ends_at - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event = subscription.events.get(timeout=min(heartbeat, remaining))
+            except queue.Empty:
+                yield ': keep-alive\n\n'
+                continue
+            yield _format(event)
+    finally:
+        poller.discard(subscription)
+
+
+async def events_async(key, api_base, headers, max_age=METRICS_STREAM_MAX_AGE,
+                       heartbeat=METRICS_STREAM_HEARTBEAT):
+    """events() for the event loop: waits on the loop instead of holding a thread per viewer"""
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+
+    def notify():
+        try:
+            loop.call_soon_threadsafe(ready.set)
+        except RuntimeError:
+            # The loop has shut down
+            pass
+
+    poller, subscription = subscribe(key, api_base, headers, notify)
+    try:
+        yield f'retry: {_RETRY_MS}\n\n'
+        ends_at = time.monotonic() + max_age
+        while not subscription.closed:
+            try:
+                yield _format(subscription.events.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = ends_at - time.monotonic()
+            if remaining <= 0:
+                return
+            ready.clear()
+            if not subscription.events.empty():
+                continue
+            try:
+                await asyncio.wait_for(ready.wait(), timeout=min(heartbeat, remaining))
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+    finally:
+        poller.discard(subscription)
+
+
+def stats():
+    """Running pollers and their subscriber counts in this process"""
+    with _pollers_lock:
+        pollers = list(_pollers.values())
+    return {
+        'pid': os.getpid(),
+        'pollers': [
+            {'api_base': poller.api_base, 'subscribers': len(poller.subscribers),
+             'pending': len(poller._pending)}
+            for poller in pollers
+        ],
+    }
@@ -0,0 +1,173 @@
+"""Structured per-request logging with sampling and a background writer.
+
+Each request produces one JSON line. The request thread only builds a dict
+and puts it on a bounded queue; a listener thread serializes and writes it.
+When the queue is full the record is dropped rather than blocking a request.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+from datetime import datetime
+
+# Headers whose values never appear in logs
+MASKED_HEADERS = {'authorization', 'cookie', 'x-xsrf-token'}
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_HEADERS = os.environ.get('LOG_HEADERS', 'true').lower() in ('1', 'true', 'yes')
+
+# Comma-separated `path-prefix=value` rules; the longest matching prefix wins
+LOG_ROUTE_LEVELS = os.environ.get('LOG_ROUTE_LEVELS', '')
+LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '/api/health=0.01,/static=0.01')
+
+logger = logging.getLogger('app.requests')
+logger.propagate = False
+logger.setLevel(LOG_LEVEL)
+
+_dropped = 0
+_listener = None
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def parse_rules(spec, convert):
+    """Parse `prefix=value,...` into [(prefix, value)], longest prefix first"""
+    rules = []
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        prefix, value = item.split('=', 1)
+        rules.append((prefix.strip(), convert(value.strip())))
+    return sorted(rules, key=lambda rule: len(rule[0]), reverse=True)
+
+
+def _level(name):
+    return logging.getLevelName(name.upper())
+
+
+ROUTE_LEVELS = parse_rules(LOG_ROUTE_LEVELS, _level)
+SAMPLE_RATES = parse_rules(LOG_SAMPLE_RATES, float)
+
+
+def match_rule(rules, path, default):
+    for prefix, value in rules:
+        if path.startswith(prefix):
+            return value
+    return default
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records whose message is a dict as a single JSON line"""
+
+    def format(self, record):
+        if isinstance(record.msg, dict):
+            return json.dumps(record.msg, default=str)
+        return json.dumps({'ts': datetime.now().isoformat(), 'level': record.levelname,
+                           'message': record.getMessage()})
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks and counts records it had to drop"""
+
+    def prepare(self, record):
+        # Formatting happens on the listener thread, not the request thread
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+
+def _start():
+    """(Re)start the background writer; threads don't survive fork"""
+    global _listener, _listener_pid
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter())
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(DroppingQueueHandler(log_queue))
+    _listener = logging.handlers.QueueListener(log_queue, stream)
+    _listener.start()
+    _listener_pid = os.getpid()
+    # Flush what is still queued when the worker exits
+    atexit.register(_listener.stop)
+
+
+def ensure_started():
+    if _listener_pid != os.getpid():
+        with _listener_lock:
+            if _listener_pid != os.getpid():
+                _start()
+
+
+def mask_authorization(value):
+    """Show only the ends of a bearer token so requests can be correlated"""
+    if value.startswith('Bearer '):
+        token = value[7:]
+        return f"Bearer {token[:10]}...{token[-10:]}" if len(token) > 20 else 'Bearer ***'
+    return f'{value[:20]}...'
+
+
+def masked_headers(headers):
+    return {
+        name: '***masked***' if name.lower() in MASKED_HEADERS else value
+        for name, value in headers
+    }
+
+
+def log_request(request, status, duration, route_path, **fields):
+    """Queue one structured line for a finished request, subject to level and sampling.
+
+    `route_path` is the request path with any deployment base path removed; it
+    is what the per-route level and sample rate rules match against.
+    """
+    level = match_rule(ROUTE_LEVELS, route_path, logging.INFO)
+    if status >= 500:
+        level = logging.ERROR
+    elif status >= 400:
+        level = max(level, logging.WARNING)
+    if not logger.isEnabledFor(level):
+        return
+    # Errors are always kept; everything else honours the route's sample rate
+    rate = match_rule(SAMPLE_RATES, route_path, 1.0)
+    if level < logging.ERROR and rate < 1.0 and random.random() >= rate:
+        return
+
+    ensure_started()
+
+    headers = request.headers
+    record = {
+        'ts': datetime.now().isoformat(),
+        'level': logging.getLevelName(level),
+        'method': request.method,
+        'path': request.path,
+        'status': status,
+        'duration_ms': round(duration * 1000, 3),
+        'remote_ip': request.remote_addr,
+        'forwarded_for': headers.get('X-Forwarded-For'),
+        'real_ip': headers.get('X-Real-IP'),
+        'user_agent': headers.get('User-Agent'),
+        'tenant': headers.get('X-MindSphere-Tenant'),
+        'user': headers.get('X-MindSphere-User'),
+    }
+    auth_header = headers.get('Authorization')
+    if auth_header:
+        record['authorization'] = mask_authorization(auth_header)
+    record.update(fields)
+    if LOG_HEADERS:
+        record['headers'] = masked_headers(headers)
+    logger.log(level, record)
+
+
+def stats():
+    return {'dropped': _dropped, 'queue_size': LOG_QUEUE_SIZE}
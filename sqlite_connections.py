@@ -0,0 +1,39 @@
+"""Per-thread SQLite connections in WAL mode, shared by the SQLite-backed stores"""
+import os
+import sqlite3
+import threading
+
+
+class SqliteConnections:
+    """Connections to one database file: one per thread, reopened after fork.
+
+    `schema` statements run once, on a connection of their own, when the
+    database is opened.
+    """
+
+    def __init__(self, path, busy_timeout=5.0, schema=(), cached_statements=128):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        conn = self.connect()
+        for statement in schema:
+            conn.execute(statement)
+        conn.close()
+
+    def connect(self):
+        """A new connection in autocommit mode, with WAL journaling"""
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                               check_same_thread=False, cached_statements=self.cached_statements)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    def get(self):
+        """Connection for the current thread, never one inherited across fork"""
+        local = self._local
+        pid = os.getpid()
+        if getattr(local, 'pid', None) != pid:
+            local.conn = self.connect()
+            local.pid = pid
+        return local.conn
@@ -0,0 +1,372 @@
+"""Inverted index for full-text search over submissions"""
+import bisect
+import heapq
+import math
+import os
+import re
+import threading
+import weakref
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+
+# Submission ids held by the cache of recent prefix (`pump*`) matches, across all prefixes
+SEARCH_PREFIX_CACHE_IDS = int(os.environ.get('SEARCH_PREFIX_CACHE_IDS', 5_000_000))
+# Submissions read from the store and indexed per lock hold while catching up
+SEARCH_SYNC_BATCH = int(os.environ.get('SEARCH_SYNC_BATCH', 1000))
+
+_TOKEN = re.compile(r'\w+')
+# Too common to narrow a search; leaving them out keeps the largest postings out of the index
+STOP_WORDS = frozenset(
+    'a an and are as at be but by for from has have in is it its of on or that the this to was were will with'
+    .split()
+)
+# Score of a term occurring tf times in a submission (tf is capped at 255)
+_TF_WEIGHT = [0.0] + [1 + math.log(tf) for tf in range(1, 256)]
+
+
+def tokenize(text):
+    """Lower-cased word tokens of `text`, stop words removed"""
+    return [token for token in _TOKEN.findall(text.lower()) if token not in STOP_WORDS]
+
+
+def parse_query(q):
+    """Split a query string into (terms, prefixes); a word ending in `*` is a prefix"""
+    terms, prefixes = [], []
+    for word in (q or '').split():
+        tokens = _TOKEN.findall(word.lower())
+        if not tokens:
+            continue
+        if word.endswith('*'):
+            *whole, last = tokens
+            terms.extend(whole)
+            prefixes.append(last)
+        else:
+            terms.extend(tokens)
+    return [term for term in terms if term not in STOP_WORDS], prefixes
+
+
+def parse_timestamp(value):
+    """Epoch seconds of an ISO 8601 timestamp (naive ones are local time, like submission timestamps)"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def _newest(ids, lo, hi, offset, limit):
+    """Page of ids[lo:hi] in descending order, unscored"""
+    start = hi - offset
+    if start <= lo:
+        return []
+    return [(sid, 0.0) for sid in reversed(ids[max(start - limit, lo):start])]
+
+
+class _Clause:
+    """Submission ids matching one query term, in ascending order, with the score each contributes.
+
+    Terms score by count (`tfs`) times `idf`; without counts (prefixes, names)
+    every match scores `idf`. `lo`/`hi` bound the part of `ids` still in play.
+    """
+
+    __slots__ = ('ids', 'tfs', 'idf', 'lo', 'hi')
+
+    def __init__(self, ids, tfs=None, idf=0.0):
+        self.ids = ids
+        self.tfs = tfs
+        self.idf = idf
+        self.lo = 0
+        self.hi = len(ids)
+
+    def score(self, pos):
+        if self.tfs is not None:
+            return _TF_WEIGHT[self.tfs[pos]] * self.idf
+        return self.idf
+
+
+# Live indexes, each reset in a forked child (see SubmissionIndex._after_fork)
+_indexes = weakref.WeakSet()
+
+
+def _after_fork():
+    for index in list(_indexes):
+        index._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class SubmissionIndex:
+    """Incrementally maintained inverted index over a submission store.
+
+    Each term maps to the ids of the submissions containing it (ascending,
+    since ids only grow) and its count in each. Names map to ids the same
+    way, and a parallel array of timestamps answers time ranges. New
+    submissions are indexed as they are stored; anything added by another
+    process is caught up from the store before a search. The initial build
+    runs in a background thread (see `start`); until `is_ready`, the
+    search route answers 503.
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._builder_pid = None
+        self.ready = False
+        self.build_error = None
+        self._reset()
+        _indexes.add(self)
+
+    def _reset(self):
+        self._postings = {}   # term -> (array of ids, array of term counts)
+        self._terms = []      # sorted, for prefix lookups
+        self._names = {}      # lower-cased name -> array of ids
+        self._prefixes = OrderedDict()  # prefix -> array of ids, least recently used first
+        self._prefix_ids = 0
+        self._max_tf = 0
+        self._ids = array('I')
+        self._times = array('d')
+        # True while timestamps grow with ids, so a time range is a contiguous id range
+        self._ordered = True
+        self._last_id = 0
+        self._version = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _index(self, submission):
+        sid = submission.id
+        counts = {}
+        for token in tokenize(submission.text):
+            counts[token] = counts.get(token, 0) + 1
+        postings = self._postings
+        for term, tf in counts.items():
+            posting = postings.get(term)
+            if posting is None:
+                posting = postings[term] = (array('I'), array('B'))
+                bisect.insort(self._terms, term)
+            posting[0].append(sid)
+            posting[1].append(min(tf, 255))
+            self._max_tf = max(self._max_tf, min(tf, 255))
+        if self._prefixes:
+            # Keep cached prefix matches current
+            for term in counts:
+                for end in range(1, len(term) + 1):
+                    ids = self._prefixes.get(term[:end])
+                    if ids is not None and (not ids or ids[-1] != sid):
+                        ids.append(sid)
+                        self._prefix_ids += 1
+        name = submission.name.lower()
+        ids = self._names.get(name)
+        if ids is None:
+            ids = self._names[name] = array('I')
+        ids.append(sid)
+        timestamp = parse_timestamp(submission.timestamp)
+        if self._times and timestamp < self._times[-1]:
+            self._ordered = False
+        self._ids.append(sid)
+        self._times.append(timestamp)
+        self._last_id = sid
+
+    def add(self, submission):
+        """Index a submission just stored by this process.
+
+        Only the next id is indexed directly; after a gap (another worker's
+        submissions, or an index not yet built) the next `sync` reads them
+        from the store in order.
+        """
+        with self._lock:
+            if submission.id == self._last_id + 1:
+                self._index(submission)
+
+    def sync(self):
+        """Index every stored submission newer than the index.
+
+        The store is read in batches of SEARCH_SYNC_BATCH with the index
+        lock released in between, so a long catch-up doesn't hold up
+        submits or searches.
+        """
+        version = self._store.version()
+        if version == self._version:
+            return
+        with self._sync_lock:
+            while True:
+                batch = self._store.page(after=self._last_id, limit=SEARCH_SYNC_BATCH)
+                with self._lock:
+                    for submission in batch:
+                        # `add` may have indexed it since the batch was read
+                        if submission.id > self._last_id:
+                            self._index(submission)
+                if len(batch) < SEARCH_SYNC_BATCH:
+                    break
+            self._version = version
+
+    def start(self):
+        """Build the index in a background thread, once per process"""
+        pid = os.getpid()
+        with self._start_lock:
+            if self._builder_pid == pid:
+                return
+            self._builder_pid = pid
+        threading.Thread(target=self._build, name='submission-index', daemon=True).start()
+
+    def _build(self):
+        try:
+            self.sync()
+        except Exception as e:
+            # Reported by the search route; the next is_ready() tries again
+            self.build_error = e
+            self._builder_pid = None
+            return
+        self.build_error = None
+        self.ready = True
+
+    def is_ready(self):
+        """Whether the initial build has finished; starts it if this process hasn't yet"""
+        if not self.ready:
+            self.start()
+        return self.ready
+
+    def _after_fork(self):
+        """A child gets fresh locks, and starts over unless the parent's build had finished"""
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        if not self.ready:
+            # The parent's builder may have been mid-batch; its thread is gone
+            self._builder_pid = None
+            self._reset()
+
+    def _time_bounds(self, since, until):
+        """(lo, hi) positions in `_ids` of submissions within [since, until]; needs ordered timestamps"""
+        lo = bisect.bisect_left(self._times, since) if since is not None else 0
+        hi = bisect.bisect_right(self._times, until) if until is not None else len(self._times)
+        return lo, max(hi, lo)
+
+    def _timestamp(self, sid):
+        return self._times[bisect.bisect_left(self._ids, sid)]
+
+    def _prefix_ids_for(self, prefix):
+        """Ids of submissions with a term starting with `prefix`"""
+        ids = self._prefixes.get(prefix)
+        if ids is not None:
+            self._prefixes.move_to_end(prefix)
+            return ids
+        lo = bisect.bisect_left(self._terms, prefix)
+        hi = bisect.bisect_left(self._terms, prefix + '\U0010ffff')
+        postings = [self._postings[term][0] for term in self._terms[lo:hi]]
+        if len(postings) == 1:
+            ids = array('I', postings[0])
+        else:
+            ids = array('I', sorted(set().union(*postings)))
+        # The union costs a pass over every matching posting, so recent ones are kept
+        # (and extended as submissions arrive) within SEARCH_PREFIX_CACHE_IDS
+        self._prefixes[prefix] = ids
+        self._prefix_ids += len(ids)
+        while self._prefix_ids > SEARCH_PREFIX_CACHE_IDS and len(self._prefixes) > 1:
+            _, evicted = self._prefixes.popitem(last=False)
+            self._prefix_ids -= len(evicted)
+        return ids
+
+    def search(self, terms=(), prefixes=(), name=None, since=None, until=None, offset=0, limit=20):
+        """Submission ids matching every term, prefix and filter, best first.
+
+        Returns (total matches, [(id, score), ...] for the requested page).
+        Scores are tf-idf sums, ties newest first. A prefix scores like a
+        single term every match contains once (as Lucene's constant-score
+        prefix queries do); without terms or prefixes, newest comes first.
+        `since`/`until` are epoch seconds, inclusive.
+        """
+        self.sync()
+        with self._lock:
+            total_docs = len(self._ids)
+            clauses = []
+            for term in dict.fromkeys(terms):
+                posting = self._postings.get(term)
+                if posting is None:
+                    return 0, []
+                ids, tfs = posting
+                clauses.append(_Clause(ids, tfs, math.log(1 + total_docs / len(ids))))
+            for prefix in dict.fromkeys(prefixes):
+                ids = self._prefix_ids_for(prefix)
+                if not ids:
+                    return 0, []
+                clauses.append(_Clause(ids, idf=math.log(1 + total_docs / len(ids))))
+            ranked = bool(clauses)
+            if name is not None:
+                ids = self._names.get(name.lower())
+                if ids is None:
+                    return 0, []
+                clauses.append(_Clause(ids))
+
+            timed = since is not None or until is not None
+            check_time = timed and not self._ordered
+            if timed and self._ordered:
+                # Narrow every clause to the id range the time window covers
+                lo, hi = self._time_bounds(since, until)
+                if lo == hi:
+                    return 0, []
+                if not clauses:
+                    return hi - lo, _newest(self._ids, lo, hi, offset, limit)
+                first, last = self._ids[lo], self._ids[hi - 1]
+                for clause in clauses:
+                    clause.lo = bisect.bisect_left(clause.ids, first)
+                    clause.hi = bisect.bisect_right(clause.ids, last)
+            elif not clauses:
+                clauses.append(_Clause(self._ids))
+
+            clauses.sort(key=lambda clause: clause.hi - clause.lo)
+            driver, others = clauses[0], clauses[1:]
+            if not others and not check_time:
+                return self._single(driver, offset, limit)
+
+            matches = []
+            ids = driver.ids
+            for pos in range(driver.lo, driver.hi):
+                sid = ids[pos]
+                score = driver.score(pos)
+                for clause in others:
+                    j = bisect.bisect_left(clause.ids, sid, clause.lo, clause.hi)
+                    if j == clause.hi or clause.ids[j] != sid:
+                        break
+                    clause.lo = j
+                    score += clause.score(j)
+                else:
+                    if check_time:
+                        timestamp = self._timestamp(sid)
+                        if (since is not None and timestamp < since) or (until is not None and timestamp > until):
+                            continue
+                    matches.append((score, sid))
+
+        if not ranked:
+            return len(matches), [(sid, score) for score, sid in matches[::-1][offset:offset + limit]]
+        top = heapq.nlargest(offset + limit, matches)
+        return len(matches), [(sid, score) for score, sid in top[offset:]]
+
+    def _single(self, clause, offset, limit):
+        """Page of a single clause without scanning all of it"""
+        lo, hi = clause.lo, clause.hi
+        total = hi - lo
+        if not total:
+            return 0, []
+        if clause.tfs is None:
+            # Every match scores the same
+            return total, [(sid, clause.idf) for sid, _ in _newest(clause.ids, lo, hi, offset, limit)]
+        # One term: ranked by count, newest first within a count. Walk the counts down
+        # from the highest, finding each count's positions newest-first with a
+        # C-level scan of the count bytes.
+        tfs = clause.tfs[lo:hi].tobytes()
+        wanted = offset + limit
+        page = []
+        for tf in range(self._max_tf, 0, -1):
+            needle = bytes((tf,))
+            end = len(tfs)
+            while len(page) < wanted:
+                pos = tfs.rfind(needle, 0, end)
+                if pos < 0:
+                    break
+                page.append((clause.ids[lo + pos], _TF_WEIGHT[tf] * clause.idf))
+                end = pos
+            if len(page) >= wanted:
+                break
+        return total, page[offset:]
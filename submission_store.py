@@ -0,0 +1,201 @@
+"""Submission storage backends"""
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+
+from sqlite_connections import SqliteConnections
+
+
+class Submission:
+    """A single text submission"""
+
+    __slots__ = ('id', 'name', 'text', 'timestamp')
+
+    def __init__(self, id, name, text, timestamp):
+        self.id = id
+        self.name = name
+        self.text = text
+        self.timestamp = timestamp
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'text': self.text,
+            'timestamp': self.timestamp
+        }
+
+
+class SubmissionStore:
+    """Interface shared by all submission backends"""
+
+    def add(self, name, text):
+        """Store a new submission and return it with its allocated id"""
+        raise NotImplementedError
+
+    def get(self, submission_id):
+        """Return the submission with this id, or None"""
+        raise NotImplementedError
+
+    def count(self):
+        """Number of stored submissions"""
+        raise NotImplementedError
+
+    def all(self):
+        """All submissions in id order"""
+        raise NotImplementedError
+
+    def page(self, after=0, limit=None):
+        """Submissions with id greater than `after`, in id order, at most `limit` of them"""
+        raise NotImplementedError
+
+    def version(self):
+        """Opaque token that changes whenever the stored data changes"""
+        raise NotImplementedError
+
+    def iter_all(self, after=0, batch_size=500):
+        """Yield submissions after `after` in id order, fetching `batch_size` at a time"""
+        while True:
+            batch = self.page(after=after, limit=batch_size)
+            yield from batch
+            if len(batch) < batch_size:
+                return
+            after = batch[-1].id
+
+
+class InMemorySubmissionStore(SubmissionStore):
+    """Process-local store with an id index and atomic id allocation"""
+
+    def __init__(self):
+        self._records = {}
+        self._ids = itertools.count(1)
+        self._last_id = 0
+        self._lock = threading.Lock()
+
+    def add(self, name, text):
+        with self._lock:
+            submission = Submission(next(self._ids), name, text, datetime.now().isoformat())
+            self._records[submission.id] = submission
+            self._last_id = submission.id
+        return submission
+
+    def get(self, submission_id):
+        return self._records.get(submission_id)
+
+    def count(self):
+        return len(self._records)
+
+    def all(self):
+        with self._lock:
+            return list(self._records.values())
+
+    def page(self, after=0, limit=None):
+        # Ids are allocated sequentially, so a page is a contiguous id range
+        after = max(after, 0)
+        last_id = self._last_id
+        stop = last_id if limit is None else min(last_id, after + limit)
+        records = self._records
+        return [records[i] for i in range(after + 1, stop + 1) if i in records]
+
+    def version(self):
+        # The store is append-only, so the newest id identifies its contents
+        return str(self._last_id)
+
+
+class SqliteSubmissionStore(SubmissionStore):
+    """Durable store in a SQLite database in WAL mode, shared by all worker processes.
+
+    Each thread keeps its own connection, reopened after fork. Concurrent
+    inserts within a process are group-committed, so a burst of submissions
+    costs one transaction per `batch_size` rows.
+    """
+
+    _SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS submissions ('
+        ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+        ' name TEXT NOT NULL,'
+        ' text TEXT NOT NULL,'
+        ' timestamp TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS idx_submissions_timestamp ON submissions (timestamp)',
+    )
+    # Statements are constant strings so sqlite3's statement cache reuses them
+    _INSERT = 'INSERT INTO submissions (name, text, timestamp) VALUES (?, ?, ?)'
+    _GET = 'SELECT id, name, text, timestamp FROM submissions WHERE id = ?'
+    _PAGE = 'SELECT id, name, text, timestamp FROM submissions WHERE id > ? ORDER BY id LIMIT ?'
+    _COUNT = 'SELECT COUNT(*) FROM submissions'
+    _VERSION = 'SELECT COALESCE(MAX(id), 0) FROM submissions'
+
+    def __init__(self, path, batch_size=100, busy_timeout=5.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.busy_timeout = busy_timeout
+        self._pending = queue.Queue()
+        self._commit_lock = threading.Lock()
+        self._connections = SqliteConnections(path, busy_timeout, self._SCHEMA, cached_statements=32)
+
+    def _flush(self):
+        """Insert everything queued so far, `batch_size` rows per transaction"""
+        conn = self._connections.get()
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                rows = []
+                for name, text, _ in batch:
+                    timestamp = datetime.now().isoformat()
+                    cursor = conn.execute(self._INSERT, (name, text, timestamp))
+                    rows.append(Submission(cursor.lastrowid, name, text, timestamp))
+                conn.execute('COMMIT')
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for row, (_, _, future) in zip(rows, batch):
+                future.set_result(row)
+
+    def add(self, name, text):
+        # Group commit: whichever caller gets the commit lock writes every
+        # submission queued behind it; the others find theirs already done.
+        future = Future()
+        self._pending.put((name, text, future))
+        with self._commit_lock:
+            if not future.done():
+                self._flush()
+        return future.result()
+
+    def get(self, submission_id):
+        row = self._connections.get().execute(self._GET, (submission_id,)).fetchone()
+        return Submission(*row) if row else None
+
+    def count(self):
+        return self._connections.get().execute(self._COUNT).fetchone()[0]
+
+    def all(self):
+        return self.page()
+
+    def page(self, after=0, limit=None):
+        rows = self._connections.get().execute(self._PAGE, (after, -1 if limit is None else limit))
+        return [Submission(*row) for row in rows]
+
+    def version(self):
+        return str(self._connections.get().execute(self._VERSION).fetchone()[0])
+
+
+def create_store(backend='sqlite', path='submissions.db'):
+    """Build the submission store selected by configuration"""
+    if backend == 'memory':
+        return InMemorySubmissionStore()
+    if backend == 'sqlite':
+        return SqliteSubmissionStore(path)
+    raise ValueError(f'Unknown submission backend: {backend}')
@@ -0,0 +1,82 @@
+"""Cached checks that a caller's bearer token is genuine and belongs to the tenant it is used for"""
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import upstream
+
+# Endpoint asked for a one-item page to learn whether upstream accepts a token
+TOKEN_CHECK_PATH = '/api/assetmanagement/v3/assets'
+# Seconds a token stays trusted after upstream accepted it
+TOKEN_CHECK_TTL = float(os.environ.get('TOKEN_CHECK_TTL', 300))
+# Accepted tokens remembered per process; least recently checked are dropped first
+TOKEN_CHECK_MAX_TOKENS = int(os.environ.get('TOKEN_CHECK_MAX_TOKENS', 10000))
+
+
+class TokenRejected(Exception):
+    """Upstream refused the token, or it does not belong to the tenant it was used for"""
+
+    def __init__(self, status_code, message):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def token_tenant(auth_header):
+    """Tenant claim (`ten`) of a bearer JWT, without verifying it; None if absent"""
+    try:
+        payload = auth_header.split(' ', 1)[1].split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get('ten')
+    except Exception:
+        return None
+
+
+def token_digest(headers):
+    return hashlib.sha256((headers or {}).get('Authorization', '').encode()).hexdigest()
+
+
+_accepted = OrderedDict()  # (token digest, API base) -> when upstream last accepted it
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def check_token(api_base, headers, timeout=None):
+    """Raise TokenRejected unless upstream accepted the caller's token in the last TOKEN_CHECK_TTL seconds.
+
+    A token's claims are covered by its signature, so once upstream accepts
+    the token, its tenant claim can be trusted too.
+    """
+    key = (token_digest(headers), api_base)
+    now = time.monotonic()
+    with _lock:
+        accepted = _accepted.get(key)
+    if accepted is not None and now - accepted < TOKEN_CHECK_TTL:
+        return
+    response = upstream.get(api_base, TOKEN_CHECK_PATH, headers=headers, params={'size': 1}, timeout=timeout)
+    response.close()
+    if response.status_code != 200:
+        raise TokenRejected(response.status_code, f'Insights Hub did not accept the token: HTTP {response.status_code}')
+    with _lock:
+        _accepted[key] = now
+        _accepted.move_to_end(key)
+        while len(_accepted) > TOKEN_CHECK_MAX_TOKENS:
+            _accepted.popitem(last=False)
+
+
+def check_tenant(api_base, headers, tenant, timeout=None):
+    """check_token, and the token's tenant claim must be `tenant`"""
+    if token_tenant((headers or {}).get('Authorization', '')) != tenant:
+        raise TokenRejected(403, f'Token does not belong to tenant {tenant}')
+    check_token(api_base, headers, timeout)
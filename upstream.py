@@ -0,0 +1,180 @@
+"""Shared, connection-pooled HTTP client for calls to the Insights Hub gateway"""
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectTimeout
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError
+
+import instrumentation
+
+# Number of distinct hosts kept in each session's pool manager
+UPSTREAM_POOL_CONNECTIONS = int(os.environ.get('UPSTREAM_POOL_CONNECTIONS', 4))
+# Keep-alive connections kept open per host
+UPSTREAM_POOL_MAXSIZE = int(os.environ.get('UPSTREAM_POOL_MAXSIZE', 20))
+# When true, callers wait for a free connection instead of opening more than
+# UPSTREAM_POOL_MAXSIZE connections to the same host (for at most the connect timeout)
+UPSTREAM_POOL_BLOCK = os.environ.get('UPSTREAM_POOL_BLOCK', 'true').lower() in ('1', 'true', 'yes')
+
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 5))
+UPSTREAM_READ_TIMEOUT = float(os.environ.get('UPSTREAM_READ_TIMEOUT', 30))
+
+_stats_lock = threading.Lock()
+_stats = {'requests': 0, 'connections_created': 0}
+
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+
+class _CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        _count('connections_created')
+        super().connect()
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        _count('connections_created')
+        super().connect()
+
+
+def _pool_timeout(kwargs):
+    # Waiting for a free connection counts against the connect timeout, as in upstream_async
+    timeout = kwargs.get('timeout')
+    kwargs.setdefault('pool_timeout', getattr(timeout, 'connect_timeout', UPSTREAM_CONNECT_TIMEOUT))
+    return kwargs
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+    def urlopen(self, *args, **kwargs):
+        _count('requests')
+        return super().urlopen(*args, **_pool_timeout(kwargs))
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+    def urlopen(self, *args, **kwargs):
+        _count('requests')
+        return super().urlopen(*args, **_pool_timeout(kwargs))
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools count new and reused connections"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, *args, **kwargs):
+        try:
+            return super().send(request, *args, **kwargs)
+        except EmptyPoolError as e:
+            # requests passes this through as is; report it like any other connect timeout
+            raise ConnectTimeout(e, request=request)
+
+
+_sessions = {}
+_sessions_pid = os.getpid()
+_sessions_lock = threading.Lock()
+
+
+def _new_session():
+    session = requests.Session()
+    adapter = PooledAdapter(
+        pool_connections=UPSTREAM_POOL_CONNECTIONS,
+        pool_maxsize=UPSTREAM_POOL_MAXSIZE,
+        pool_block=UPSTREAM_POOL_BLOCK
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers['Connection'] = 'keep-alive'
+    return session
+
+
+def _reset_after_fork():
+    """Drop sessions inherited from the parent; their sockets belong to it"""
+    global _sessions, _sessions_pid, _sessions_lock
+    _sessions = {}
+    _sessions_pid = os.getpid()
+    _sessions_lock = threading.Lock()
+    with _stats_lock:
+        for name in _stats:
+            _stats[name] = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_session(api_base):
+    """Return the pooled session for an API base (one per base per process)"""
+    if _sessions_pid != os.getpid():
+        _reset_after_fork()
+    session = _sessions.get(api_base)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(api_base)
+            if session is None:
+                session = _new_session()
+                _sessions[api_base] = session
+    return session
+
+
+def get_timeout(timeout=None):
+    """Build a (connect, read) timeout; a scalar caps both values"""
+    if timeout is None:
+        return (UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT)
+    if isinstance(timeout, tuple):
+        return timeout
+    return (min(UPSTREAM_CONNECT_TIMEOUT, timeout), min(UPSTREAM_READ_TIMEOUT, timeout))
+
+
+def get(api_base, path, headers=None, params=None, timeout=None, **kwargs):
+    """GET `path` relative to `api_base` over the shared pooled session"""
+    in_flight = instrumentation.UPSTREAM_IN_FLIGHT.labels(instrumentation.upstream_service(path))
+    in_flight.inc()
+    start = time.perf_counter()
+    status = 'error'
+    try:
+        response = get_session(api_base).get(
+            f'{api_base}{path}',
+            headers=headers,
+            params=params,
+            timeout=get_timeout(timeout),
+            **kwargs
+        )
+        status = response.status_code
+        return response
+    finally:
+        in_flight.dec()
+        instrumentation.observe_upstream(path, status, time.perf_counter() - start)
+
+
+def stats():
+    """Connection pool counters for this process"""
+    with _stats_lock:
+        requests_made = _stats['requests']
+        created = _stats['connections_created']
+    return {
+        'pid': os.getpid(),
+        'sessions': sorted(_sessions),
+        'requests': requests_made,
+        'connections_created': created,
+        'connections_reused': max(requests_made - created, 0),
+        'pool_maxsize': UPSTREAM_POOL_MAXSIZE,
+        'pool_block': UPSTREAM_POOL_BLOCK,
+        'connect_timeout': UPSTREAM_CONNECT_TIMEOUT,
+        'read_timeout': UPSTREAM_READ_TIMEOUT,
+    }
@@ -0,0 +1,101 @@
+"""Asynchronous, connection-pooled HTTP client for Insights Hub gateway calls (ASGI mode)"""
+import asyncio
+import contextlib
+import os
+import time
+
+import httpx
+
+import instrumentation
+from upstream import UPSTREAM_POOL_MAXSIZE, get_timeout
+
+# Concurrent connections per API base; an await on a free connection replaces
+# a blocked thread, so this can be far larger than UPSTREAM_POOL_MAXSIZE
+ASYNC_UPSTREAM_MAX_CONNECTIONS = int(os.environ.get('ASYNC_UPSTREAM_MAX_CONNECTIONS', 200))
+
+_clients = {}
+_clients_loop = None
+_requests = 0
+
+
+def _reset_after_fork():
+    """Clients belong to the parent's event loop and sockets"""
+    global _clients, _clients_loop, _requests
+    _clients = {}
+    _clients_loop = None
+    _requests = 0
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_client(api_base):
+    """The pooled client for an API base on the running event loop"""
+    global _clients, _clients_loop
+    loop = asyncio.get_running_loop()
+    if _clients_loop is not loop:
+        # Clients cannot be shared between event loops
+        _clients = {}
+        _clients_loop = loop
+    client = _clients.get(api_base)
+    if client is None:
+        client = _clients[api_base] = httpx.AsyncClient(
+            base_url=api_base,
+            limits=httpx.Limits(
+                max_connections=ASYNC_UPSTREAM_MAX_CONNECTIONS,
+                max_keepalive_connections=UPSTREAM_POOL_MAXSIZE
+            )
+        )
+    return client
+
+
+async def close():
+    """Close every client of the running loop (on application shutdown)"""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+def _timeout(timeout):
+    connect, read = get_timeout(timeout)
+    return httpx.Timeout(read, connect=connect, pool=connect)
+
+
+@contextlib.asynccontextmanager
+async def stream(api_base, path, headers=None, params=None, timeout=None):
+    """Open a streamed GET of `path` relative to `api_base`; closed when the block exits"""
+    global _requests
+    in_flight = instrumentation.UPSTREAM_IN_FLIGHT.labels(instrumentation.upstream_service(path))
+    in_flight.inc()
+    _requests += 1
+    start = time.perf_counter()
+    status = 'error'
+    try:
+        async with get_client(api_base).stream(
+            'GET', path, headers=headers, params=params, timeout=_timeout(timeout)
+        ) as response:
+            status = response.status_code
+            yield response
+    finally:
+        in_flight.dec()
+        instrumentation.observe_upstream(path, status, time.perf_counter() - start)
+
+
+async def get(api_base, path, headers=None, params=None, timeout=None):
+    """GET `path` relative to `api_base` and read the whole body"""
+    async with stream(api_base, path, headers=headers, params=params, timeout=timeout) as response:
+        await response.aread()
+        return response
+
+
+def stats():
+    """Client counters for this process"""
+    return {
+        'pid': os.getpid(),
+        'clients': sorted(_clients),
+        'requests': _requests,
+        'max_connections': ASYNC_UPSTREAM_MAX_CONNECTIONS,
+        'max_keepalive': UPSTREAM_POOL_MAXSIZE,
+    }